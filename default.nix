@@ -71,6 +71,8 @@ let
         psutil
       ] ++ (if pp.pythonAtLeast "3.10" then [
         ipython
+        jupyter-client
+        ipykernel
       ] else [])
     );
 
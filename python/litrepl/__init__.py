@@ -1,45 +1,60 @@
-from typing import Optional
+""" The package exports the names of the `types`, `utils`, `eval` and `base`
+modules and the version attributes. Both are resolved on the first access, so
+importing a single module (e.g. `litrepl.main`) does not load the others. """
+
+from typing import Optional, Any
+from os import environ
 from os.path import join
-from logging import getLogger
-logger=getLogger(__name__)
-info=logger.info
-warning=logger.warning
+from importlib import import_module
 
-from .types import *
-from .utils import *
-from .eval import *
-from .base import *
+EXPORTS=['types','utils','eval','base']
 
-# Determine the package version using the following source priorities:
-# 1) semver.txt+git 2) semver.txt 3) version.py
-__revision__:Optional[str]
-try:
-  __revision__=environ["LITREPL_REVISION"]
-except Exception:
+def revision()->Optional[str]:
+  """ Determine the package revision using the following source priorities:
+  1) LITREPL_REVISION 2) git 3) revision.py """
   try:
-    from subprocess import check_output, DEVNULL
-    __revision__=check_output(['git', 'rev-parse', 'HEAD'],
-                            cwd=environ['LITREPL_ROOT'],
-                            stderr=DEVNULL).decode().strip()
+    return environ["LITREPL_REVISION"]
   except Exception:
     try:
-      from litrepl.revision import __revision__ as __rv__
-      __revision__=__rv__
-    except ImportError:
-      __revision__=None
-
+      from subprocess import check_output, DEVNULL
+      return check_output(['git', 'rev-parse', 'HEAD'],
+                          cwd=environ['LITREPL_ROOT'],
+                          stderr=DEVNULL).decode().strip()
+    except Exception:
+      try:
+        from litrepl.revision import __revision__ as __rv__
+        return __rv__
+      except ImportError:
+        return None
 
-__semver__:Optional[str]
-try:
-  __semver__=open(join(environ['LITREPL_ROOT'],'semver.txt')).read().strip()
-except Exception:
+def semver()->Optional[str]:
+  """ Determine the package semantic version using the following source
+  priorities: 1) semver.txt 2) semver.py """
+  try:
+    return open(join(environ['LITREPL_ROOT'],'semver.txt')).read().strip()
+  except Exception:
     try:
       from litrepl.semver import __semver__ as __sv__
-      __semver__= __sv__
+      return __sv__
     except ImportError:
-      __semver__=None
+      return None
 
+def version()->Optional[str]:
+  sv,rv=semver(),revision()
+  return (sv + (f"+g{rv[:7]}" if rv else "")) if sv else None
 
-__version__:Optional[str]
-__version__=(__semver__ + (f"+g{__revision__[:7]}" \
-                           if __revision__ else "")) if __semver__ else None
+def __getattr__(name:str)->Any:
+  if name in {'__revision__','__semver__','__version__'}:
+    value={'__revision__':revision,'__semver__':semver,'__version__':version}[name]()
+    globals()[name]=value
+    return value
+  if name in EXPORTS:
+    return import_module(f".{name}",__name__)
+  # Like the star-imports of the modules, the later modules take precedence
+  for m in reversed(EXPORTS):
+    mod=import_module(f".{m}",__name__)
+    if not name.startswith('_') and hasattr(mod,name):
+      value=getattr(mod,name)
+      globals()[name]=value
+      return value
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
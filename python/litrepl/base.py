@@ -2,46 +2,59 @@ import os
 import sys
 import fcntl
 import re
+import pickle
 
 from re import search, match as re_match, compile as re_compile
 from copy import copy, deepcopy
 from typing import (List, Optional, Tuple, Set, Dict, Callable, Any, Iterable,
-                    Union)
+                    Union, TYPE_CHECKING)
 from select import select
-from os import (environ, system, isatty, getpid, unlink, getpgid, setpgid,
-                mkfifo, kill)
-from lark import Lark, Visitor, Transformer, Token, Tree, LarkError
-from lark.visitors import Interpreter as LarkInterpreter
-from os.path import isfile, join, exists, basename, splitext, dirname
-from signal import signal, SIGINT, SIGKILL, SIGTERM
-from time import sleep, time
+from os import (environ, isatty, getpid, unlink, getpgid, setpgid,
+                mkfifo, kill, posix_spawn, waitpid, setsid, listdir, rename)
+from os.path import isfile, isdir, join, exists, basename, splitext, dirname, abspath
+from importlib import import_module
+from importlib.util import find_spec
+from hashlib import sha256
+from types import ModuleType
+from io import BytesIO
+from signal import signal, SIGINT, SIGKILL, SIGTERM, SIGQUIT, SIG_IGN
+from time import time, sleep
 from dataclasses import dataclass
 from functools import partial
+from bisect import bisect_right
 from argparse import ArgumentParser
 from collections import defaultdict
-from os import makedirs, getuid, getcwd, WEXITSTATUS, remove
-from tempfile import gettempdir
-from psutil import Process, NoSuchProcess
+from os import makedirs, getuid, getcwd, WEXITSTATUS, remove, rmdir
+from tempfile import gettempdir, mkdtemp
+from shutil import rmtree
 from textwrap import dedent
-from subprocess import check_output, DEVNULL, CalledProcessError
 from contextlib import contextmanager
 
 from .types import (PrepInfo, RunResult, NSec, FileName, SecRec, FileNames,
                     CursorPos, ReadResult, SType, LitreplArgs, EvalState,
                     ECode, ECODE_OK, ECODE_RUNNING, SECVAR_RE, Interpreter,
-                    LarkGrammar, Symbols, LarkTree, ParseResult, ErrorMsg)
+                    LarkGrammar, Symbols, LarkTree, ParseResult, ErrorMsg,
+                    ResultLimits, InterpCaps)
 from .eval import (process, pstderr, rresult_load, rresult_save, process_adapt,
                    process_cont, interp_exitcode, readipid, with_parent_finally,
                    with_fd, eval_code, eval_code_, interp_is_running, isync,
-                   with_locked_fd)
+                   with_locked_fd, process_batch, interp_code_preprocess,
+                   batchable, CREATE_WRONLY_EMPTY)
 from .utils import(unindent, indent, escape, fillspaces, fmterror, assert_,
-                   cursor_within, nlines, wraplong, remove_silent, hashdigest)
+                   cursor_within, nlines, wraplong, remove_silent, hashdigest,
+                   isprivatedir, SpanWriter)
 
-from .interpreters.python import PythonInterpreter
+from .interpreters.python import PythonInterpreter, PythonFramedInterpreter, PYAGENT_MARKER
 from .interpreters.ipython import IPythonInterpreter
+from .interpreters.jupyter import JupyterInterpreter, JUPYTER_MARKER
 from .interpreters.aicli import AicliInterpreter
 from .interpreters.shell import ShellInterpreter
 
+# Lark, psutil and the scanner are imported by the functions using them, so the
+# commands which do not parse documents do not load them.
+if TYPE_CHECKING:
+  from lark import Lark, LarkError
+
 DEBUG:bool=False
 
 def pdebug(*args,**kwargs):
@@ -120,26 +133,85 @@ def bmarker2st(a:LitreplArgs, bmarker:str)->Optional[SType]:
         ', '.join([f'"{st2name(c)}"' for c in acc])
       )
 
+SECLIMITS_RE=re_compile(r"\bresult-(max-bytes|max-lines|spill)(?:=([0-9]+))?")
+
+def section_limits(a:LitreplArgs, bmarker:str)->ResultLimits:
+  """ Return the result limits of a code section: the command-line limits,
+  overridden by the `result-max-bytes=N`, `result-max-lines=N` and
+  `result-spill` attributes of the section marker, if any. """
+  limits=copy(a.result_limits)
+  for m in SECLIMITS_RE.finditer(bmarker):
+    if m[1]=='max-bytes' and m[2] is not None:
+      limits.max_bytes=int(m[2])
+    elif m[1]=='max-lines' and m[2] is not None:
+      limits.max_lines=int(m[2])
+    elif m[1]=='spill':
+      limits.spill=True
+  return limits
+
+SHM_DIR='/dev/shm'
+
+def readout_store(a:LitreplArgs, auxdir:str)->Tuple[str,bool]:
+  """ Return the directory of the readout files and whether the files are
+  written synchronously, according to --readout-store. The files kept by
+  --keep-readout are always durable. """
+  store='durable' if a.keep_readout else a.readout_store
+  if store=='shm' and isdir(SHM_DIR):
+    return join(SHM_DIR,f"litrepl_{getuid()}_{hashdigest(abspath(auxdir))}"),False
+  return auxdir,(store=='durable')
+
 def pipenames(a:LitreplArgs, st:SType)->FileNames:
   """ Return the background interpreter session state: input and output pipe
   names, pid, etc. If not explicitly specified in the config, the state is
   shared for all files in the current directory. """
-  auxdir=st2auxdir(a,st)
+  return auxnames(a,st2auxdir(a,st))
+
+def auxnames(a:LitreplArgs, auxdir:str)->FileNames:
+  """ Return the session state kept in the auxiliary directory `auxdir`. """
+  readoutd,readout_sync=readout_store(a,auxdir)
   return FileNames(auxdir,
                    join(auxdir,"in.pipe"),join(auxdir,"out.pipe"),
-                   join(auxdir,"pid.txt"),join(auxdir,"ecode.txt"),join(auxdir,"emsg.txt"))
+                   join(auxdir,"pid.txt"),join(auxdir,"ecode.txt"),join(auxdir,"emsg.txt"),
+                   join(auxdir,"sync.txt"),join(auxdir,"class.txt"),
+                   readoutd,readout_sync)
+
+# Interpreter classes by name, see `attach`
+INTERPRETER_CLASSES:Dict[str,Tuple[SType,type]]={c.__name__:(st,c) for st,c in [
+  (SType.SPython,PythonInterpreter), (SType.SPython,PythonFramedInterpreter),
+  (SType.SPython,IPythonInterpreter), (SType.SPython,JupyterInterpreter),
+  (SType.SAI,AicliInterpreter), (SType.SShell,ShellInterpreter)]}
 
 def attach(fns:FileNames, st:Optional[SType]=None)->Union[Interpreter,ErrorMsg]:
-  """ Attach to the interpreter associated with the given pipe filenames. """
+  """ Attach to the interpreter associated with the given pipe filenames. The
+  interpreter class is recorded by `start_`. The class of a session without
+  the record is derived from the interpreter command line. """
   pid=readipid(fns)
   if pid is None:
     return f"Can not access PID of a {st2name(st)} interpreter to attach"
+  try:
+    with open(fns.classf) as f:
+      name=f.read().strip()
+  except FileNotFoundError:
+    name=None
+  if name in INTERPRETER_CLASSES:
+    cst,cls=INTERPRETER_CLASSES[name]
+    if st is not None and cst!=st:
+      return f"Unsupported {st2name(st)} interpreter PID {pid} class '{name}'"
+    if not interp_is_running(fns):
+      return f"Could not attach to a {st2name(st)} interpreter PID {pid}: not running"
+    pdebug(f"Interpreter PID {pid} was recorded as '{name}'")
+    return cls(fns)
+  from psutil import Process, NoSuchProcess
   try:
     p=Process(pid)
     cmd=p.cmdline()
     cls=None
     if (st is None or st==SType.SAI) and any('aicli' in w for w in cmd):
       cls=AicliInterpreter
+    elif (st is None or st==SType.SPython) and JUPYTER_MARKER in cmd:
+      cls=JupyterInterpreter
+    elif (st is None or st==SType.SPython) and PYAGENT_MARKER in cmd:
+      cls=PythonFramedInterpreter
     elif (st is None or st==SType.SPython) and any('ipython' in w.lower() for w in cmd):
       cls=IPythonInterpreter
     elif (st is None or st==SType.SPython) and any('python' in w.lower() for w in cmd):
@@ -154,28 +226,42 @@ def attach(fns:FileNames, st:Optional[SType]=None)->Union[Interpreter,ErrorMsg]:
     return f"Could not attach to a {st2name(st)} interpreter PID {pid}: {err}"
 
 def open_child_pipes(inp,outp):
-  return os.open(inp,os.O_RDWR|os.O_SYNC),os.open(outp,os.O_RDWR|os.O_SYNC);
+  return os.open(inp,os.O_RDWR),os.open(outp,os.O_RDWR);
 def open_parent_pipes(inp,outp):
   return open(inp,'w'),open(outp,'r')
 
 
-def write_child_pid(pidf:str, pid:int)->bool:
-  """ Write first children of a fork-child process as the main interpreter
-  pid. This works as long as `Interpreter.run_child` calls real interpreter
-  using system() call."""
-  cpid=None
-  for attempt in range(20):
-    try:
-      cpid=Process(pid).children()[0].pid
-      break
-    except IndexError:
-      sleep(0.1)
-  if cpid is None:
-    return False
-  else:
-    with open(pidf,'w') as f:
-      f.write(str(cpid))
-    return True
+# The exit code recorded if the interpreter could not be started
+START_FAILURE_EXITCODE=127
+
+def run_child(cmd:str, fdh:int)->int:
+  """ Run the shell command `cmd` and wait for it to complete, then return its
+  wait status, like `system()` does. The PID of the shell, which `exec`s the
+  interpreter, is sent into the handshake pipe `fdh` as soon as the process is
+  created, see `read_child_pid`. """
+  sigs=(SIGINT,SIGQUIT)
+  for s in sigs:
+    signal(s,SIG_IGN)
+  try:
+    pid=posix_spawn('/bin/sh',['sh','-c',cmd],environ,setsigdef=sigs)
+    os.write(fdh,f"{pid}\n".encode())
+  finally:
+    os.close(fdh)
+  return waitpid(pid,0)[1]
+
+def read_child_pid(fdh:int)->Optional[int]:
+  """ Receive the interpreter PID sent by `run_child` through the handshake
+  pipe `fdh`. Return None if the interpreter was not started. """
+  data=b''
+  try:
+    while r:=os.read(fdh,64):
+      data+=r
+  finally:
+    os.close(fdh)
+  try:
+    return int(data)
+  except ValueError:
+    return None
 
 def start_(a:LitreplArgs, interpreter:str, i:Interpreter, restart:bool)->int:
   """ Starts the background Python interpreter. Kill an existing interpreter if
@@ -196,39 +282,253 @@ def start_(a:LitreplArgs, interpreter:str, i:Interpreter, restart:bool)->int:
     pass
   remove_silent(fns.inp)
   remove_silent(fns.outp)
+  pdir=pool_dir(a,interpreter,i) if a.pool_size>0 and i.poolable else None
+  if pdir is not None:
+    adopted=pool_adopt(a,pdir,fns)
+    pool_fill(a,interpreter,i,pdir)
+    if adopted:
+      return 0
   mkfifo(fns.inp)
   mkfifo(fns.outp)
   sys.stdout.flush(); sys.stderr.flush() # FIXME: to avoid duplicated stdout
+  fdhr,fdhw=os.pipe() # The handshake pipe, see `run_child`
+  # The child exits only after the parent has opened the session pipes or has
+  # given up, otherwise the parent would wait for a pipe partner forever if the
+  # interpreter exits early.
+  fdar,fdaw=os.pipe()
   npid=os.fork()
   if npid==0: # Child
-    os.close(sys.stdout.fileno())
-    os.close(sys.stderr.fileno())
-    os.close(sys.stdin.fileno())
-    setpgid(getpid(),0)
-    remove_silent(fns.ecodef)
-    open_child_pipes(fns.inp,fns.outp)
-    ret=i.run_child(interpreter)
-    ret=ret if ret<256 else WEXITSTATUS(ret)
-    #pdebug(f"Fork records ecode: {ret} into {fns.wd}")
-    with open(fns.ecodef,'w') as f:
-      f.write(str(ret))
-    exit(ret)
+    # The child never returns to the caller. If the interpreter can not be
+    # started, the failure code is recorded as its exit code.
+    ret,fde=START_FAILURE_EXITCODE,None
+    try:
+      os.close(fdhr)
+      os.close(fdaw)
+      os.close(sys.stdout.fileno())
+      os.close(sys.stderr.fileno())
+      os.close(sys.stdin.fileno())
+      setpgid(getpid(),0)
+      # The exit code file is locked until the code is written, so the readers
+      # learn about the exit as soon as it happens, see `interp_exitcode`.
+      remove_silent(fns.ecodef)
+      fde=os.open(fns.ecodef,CREATE_WRONLY_EMPTY)
+      fcntl.flock(fde,fcntl.LOCK_EX)
+      open_child_pipes(fns.inp,fns.outp)
+      ret=run_child(i.child_cmd(interpreter),fdhw)
+      ret=ret if ret<256 else WEXITSTATUS(ret)
+    finally:
+      os.read(fdar,1)
+      #pdebug(f"Fork records ecode: {ret} into {fns.wd}")
+      if fde is not None:
+        os.write(fde,str(ret).encode())
+      os._exit(ret)
   else: # Parent
-    pdebug(f"starting in {fns.wd}")
-    finp,foutp=open_parent_pipes(fns.inp,fns.outp)
-    i.setup_child(a,finp,foutp)
-    with with_locked_fd(fns.inp, os.O_WRONLY|os.O_SYNC,
-                        fcntl.LOCK_EX|fcntl.LOCK_NB,open_timeout_sec=0.5) as fdw:
-      with with_locked_fd(fns.outp, os.O_RDONLY|os.O_SYNC,
-                          fcntl.LOCK_EX|fcntl.LOCK_NB,open_timeout_sec=0.5) as fdr:
-        assert_(fdw and fdr, "Failed to acquire on-start pipe locks")
-        out=isync(fdr,fdw,i)
-        with open(fns.emsgf,'w') as f:
-          f.write(out)
-    if write_child_pid(fns.pidf,npid):
-      return 0
-    else:
-      return 1
+    os.close(fdhw)
+    os.close(fdar)
+    try:
+      cpid=read_child_pid(fdhr)
+      if cpid is None:
+        pdebug(f"failed to start in {fns.wd}")
+        return 1
+      pdebug(f"starting PID {cpid} in {fns.wd}")
+      finp,foutp=open_parent_pipes(fns.inp,fns.outp)
+      i.setup_child(a,finp,foutp)
+      flags=fcntl.LOCK_EX|fcntl.LOCK_NB
+      with with_locked_fd(fns.inp,os.O_WRONLY,flags,open_timeout_sec=0.5) as fdw:
+        with with_locked_fd(fns.outp,os.O_RDONLY,flags,open_timeout_sec=0.5) as fdr:
+          assert_(fdw and fdr, "Failed to acquire on-start pipe locks")
+          os.write(fdaw,b'\n') # The pipes are open, the child may exit now
+          out=isync(fdr,fdw,i)
+          with open(fns.emsgf,'w') as f:
+            f.write(out)
+    finally:
+      os.close(fdaw)
+    with open(fns.classf,'w') as f:
+      f.write(type(i).__name__)
+    with open(fns.pidf,'w') as f:
+      f.write(str(cpid))
+    return 0
+
+# Environment variables which do not affect the pooled interpreters
+POOL_VOLATILE_ENV={'_','OLDPWD','SHLVL'}
+
+def pool_root(create:bool=True)->Optional[str]:
+  """ Return the directory of the pools, creating it if `create` is set. Return
+  None if there is no such directory or if it is not a private one, see
+  `isprivatedir`. """
+  d=join(gettempdir(),f"litrepl_{getuid()}_pool")
+  try:
+    if create:
+      makedirs(d,mode=0o700,exist_ok=True)
+  except OSError as err:
+    pdebug(f"pool: {d} is not available: {err}")
+    return None
+  if not isprivatedir(d):
+    pdebug(f"pool: {d} is not a private directory of ours, not pooling")
+    return None
+  return d
+
+def pool_dir(a:LitreplArgs, interpreter:str, i:Interpreter)->Optional[str]:
+  """ Return the directory of the pool of `i`-class interpreters, started by
+  the `interpreter` command in the current directory and environment. Only the
+  interpreters of the same pool are interchangeable. Return None if the pools
+  can not be used, see `pool_root`, or if the pool is on another file system
+  than the auxiliary directory of `i`, because the session files could not be
+  moved there, see `pool_adopt`. """
+  root=pool_root()
+  if root is None:
+    return None
+  if os.stat(root).st_dev!=os.stat(i.fns.wd).st_dev:
+    pdebug(f"pool: {i.fns.wd} is not on the file system of {root}, not pooling")
+    return None
+  env=sorted((k,v) for k,v in environ.items() if k not in POOL_VOLATILE_ENV)
+  key=sha256(repr((type(i).__name__,interpreter,a.exception_exitcode,
+                   env)).encode('utf-8')).hexdigest()[:16]
+  st=INTERPRETER_CLASSES[type(i).__name__][0]
+  return join(root,f"{hashdigest(getcwd())}_{st2name(st)}_{key}")
+
+def pool_claim(pdir:str)->Iterable[str]:
+  """ Claim the idle slots of the pool `pdir` one by one, renaming them, so the
+  concurrent sessions get different slots. """
+  try:
+    names=sorted(n for n in listdir(pdir) if n.startswith('idle_'))
+  except FileNotFoundError:
+    return
+  for n in names:
+    slot=join(pdir,f"claimed_{getpid()}_{n[len('idle_'):]}")
+    try:
+      rename(join(pdir,n),slot)
+    except OSError:
+      continue # Claimed by another session
+    yield slot
+
+def pool_kill(a:LitreplArgs, slot:str)->None:
+  """ Stop the interpreter of the pool slot `slot`, if any, and remove the
+  slot. """
+  pid=readipid(auxnames(a,slot))
+  try:
+    if pid is not None:
+      kill(pid,SIGTERM)
+  except ProcessLookupError:
+    pass
+  rmtree(slot,ignore_errors=True)
+
+def pool_adopt(a:LitreplArgs, pdir:str, fns:FileNames)->bool:
+  """ Move a running interpreter from the pool `pdir` into the session `fns`.
+  After the start, the interpreter and its wrapper process only use the
+  descriptors of the session files, so the files can be moved. Like in
+  `start_`, the PID file comes last. If a file can not be moved, the moved
+  ones are put back and the interpreter is stopped. Return False if the pool
+  is empty or the interpreter was not adopted. """
+  for slot in pool_claim(pdir):
+    sfns=auxnames(a,slot)
+    if interp_is_running(sfns):
+      moved=[]
+      try:
+        for f in ['inp','outp','ecodef','emsgf','classf','pidf']:
+          os.replace(getattr(sfns,f),getattr(fns,f))
+          moved.append(f)
+      except OSError as err:
+        pdebug(f"failed to adopt the interpreter of {slot}: {err}")
+        for f in reversed(moved):
+          os.replace(getattr(fns,f),getattr(sfns,f))
+        pool_kill(a,slot)
+        return False
+      remove_silent(fns.syncf)
+      rmtree(slot,ignore_errors=True)
+      pdebug(f"adopted PID {readipid(fns)} from the pool {pdir}")
+      return True
+    rmtree(slot,ignore_errors=True)
+  return False
+
+def pool_fill(a:LitreplArgs, interpreter:str, i:Interpreter, pdir:str)->None:
+  """ Start the interpreters of the pool `pdir` until it has --pool-size idle
+  ones. The interpreters are started by a detached process, so the caller does
+  not wait for them. """
+  makedirs(pdir,mode=0o700,exist_ok=True)
+  sys.stdout.flush(); sys.stderr.flush()
+  pid=os.fork()
+  if pid!=0:
+    waitpid(pid,0)
+    return
+  try:
+    setsid()
+    if os.fork()==0:
+      fdn=os.open(os.devnull,os.O_RDWR)
+      for fd in range(3):
+        os.dup2(fdn,fd)
+      pool_fill_(a,interpreter,i,pdir)
+  finally:
+    os._exit(0)
+
+def pool_slots(a:LitreplArgs, pdir:str)->Tuple[int,int]:
+  """ Return the numbers of the idle slots of the pool `pdir` and of the slots
+  being started. Remove the slots left by the crashed processes, see
+  `pool_fill_` and `pool_claim`. """
+  nidle,nnew=0,0
+  for n in listdir(pdir):
+    if n.startswith('idle_'):
+      nidle+=1
+    elif n.startswith('new_') or n.startswith('claimed_'):
+      try:
+        kill(int(n.split('_')[1]),0)
+        nnew+=1 if n.startswith('new_') else 0
+      except (ValueError,ProcessLookupError):
+        pdebug(f"removing the stale pool slot {n}")
+        pool_kill(a,join(pdir,n))
+  return nidle,nnew
+
+def pool_fill_(a:LitreplArgs, interpreter:str, i:Interpreter, pdir:str)->None:
+  """ Reserve the missing slots of the pool and start their interpreters in
+  parallel. The slots being started are named after the PID of this process,
+  so the slots of the crashed processes are detected and removed. """
+  slots,prefix=[],f"new_{getpid()}_"
+  fdl=os.open(join(pdir,'lock'),os.O_WRONLY|os.O_CREAT)
+  try:
+    fcntl.flock(fdl,fcntl.LOCK_EX)
+    for _ in range(a.pool_size-sum(pool_slots(a,pdir))):
+      slots.append(mkdtemp(prefix=prefix,dir=pdir))
+  finally:
+    os.close(fdl)
+  b=copy(a)
+  b.pool_size=0
+  pids=[]
+  for slot in slots:
+    pid=os.fork()
+    if pid==0:
+      try:
+        ret=start_(b,interpreter,type(i)(auxnames(b,slot)),restart=True)
+        if ret==0:
+          rename(slot,join(pdir,f"idle_{basename(slot)[len(prefix):]}"))
+      finally:
+        os._exit(0)
+    pids.append(pid)
+  for pid in pids:
+    waitpid(pid,0)
+  for slot in slots:
+    rmtree(slot,ignore_errors=True) # The slots which failed to start
+
+POOL_STOP_TIMEOUT_SEC=10.0
+
+def pool_stop(a:LitreplArgs, st:SType)->None:
+  """ Stop the pooled interpreters of class `st`, started in the current
+  directory. The interpreters which are being started are stopped as soon as
+  they are ready, waiting for at most POOL_STOP_TIMEOUT_SEC seconds. """
+  prefix=f"{hashdigest(getcwd())}_{st2name(st)}_"
+  root=pool_root(create=False)
+  if root is None:
+    return
+  pdirs=[join(root,d) for d in listdir(root) if d.startswith(prefix)]
+  deadline=time()+POOL_STOP_TIMEOUT_SEC
+  for pdir in pdirs:
+    while True:
+      nnew=pool_slots(a,pdir)[1] # Counted first, as they become idle
+      for slot in pool_claim(pdir):
+        pool_kill(a,slot)
+        pdebug(f"stopped the pooled interpreter in {slot}")
+      if nnew==0 or time()>deadline:
+        break
+      sleep(0.1)
 
 def start(a:LitreplArgs, st:SType, restart:bool=False)->int:
   """ Start Litrepl session of type `st`. """
@@ -236,12 +536,24 @@ def start(a:LitreplArgs, st:SType, restart:bool=False)->int:
     raise ValueError(f"Interpreter class {st2name(st)} is disabled by the user")
   fns=pipenames(a,st)
   if st is SType.SPython:
-    if 'ipython' in a.python_interpreter.lower():
+    if a.python_protocol=='framed':
+      if 'ipython' in a.python_interpreter.lower():
+        raise ValueError(f"The framed protocol requires a Python interpreter, "
+                         f"not {a.python_interpreter}")
+      interpreter='python3' if a.python_interpreter=='auto' else a.python_interpreter
+      return start_(a,interpreter,PythonFramedInterpreter(fns),restart)
+    elif a.python_protocol=='kernel':
+      assert_(find_spec('jupyter_client') is not None,
+              "The kernel protocol requires the `jupyter_client` package")
+      kernel='python3' if a.python_interpreter=='auto' else a.python_interpreter
+      return start_(a,kernel,JupyterInterpreter(fns),restart)
+    elif 'ipython' in a.python_interpreter.lower():
       return start_(a,a.python_interpreter,IPythonInterpreter(fns),restart)
     elif 'python' in a.python_interpreter:
       return start_(a,a.python_interpreter,PythonInterpreter(fns),restart)
     elif a.python_interpreter=='auto':
-      if system('python3 -m IPython -c \'print("OK")\' >/dev/null 2>&1')==0:
+      caps=probe_python(a,'python3')
+      if caps is not None and caps.ipython is not None:
         return start_(a,'python3 -m IPython',IPythonInterpreter(fns),restart)
       else:
         return start_(a,'python3',PythonInterpreter(fns),restart)
@@ -258,6 +570,80 @@ def start(a:LitreplArgs, st:SType, restart:bool=False)->int:
   else:
     raise ValueError(f"Unsupported section type: {st}")
 
+# The environment variables which affect the result of the probe
+PROBE_ENV=['PYTHONPATH','PYTHONHOME','PYTHONNOUSERSITE','PYTHONSAFEPATH']
+
+PROBE_PYTHON="""
+import os, sys, json, site, sysconfig
+try:
+  import IPython
+  ipython=IPython.__version__
+except Exception:
+  ipython=None
+paths={sysconfig.get_path("purelib"),sysconfig.get_path("platlib")}
+paths|={p for p in sys.path if p and os.path.isdir(p)}
+if site.ENABLE_USER_SITE:
+  paths.add(site.getusersitepackages())
+print(json.dumps({"version":sys.version.split()[0],"ipython":ipython,
+                  "paths":sorted(paths)}))
+"""
+
+def probe_mtimes(paths:Iterable[str])->Dict[str,int]:
+  """ Return the modification times of `paths`, -1 for the missing ones. """
+  res={}
+  for p in paths:
+    try:
+      res[p]=os.stat(p).st_mtime_ns
+    except OSError:
+      res[p]=-1
+  return res
+
+def probe_python(a:LitreplArgs, python:str)->Optional[InterpCaps]:
+  """ Return the capabilities of the `python` interpreter found in the PATH, or
+  None if it can not be run. The probes are cached next to the parsers, see
+  `parser_cachedir`. The probes are keyed by the interpreter path and the
+  `PROBE_ENV` variables. A cached probe is valid while the interpreter and the
+  directories of its module search path are not modified. """
+  from shutil import which
+  path=which(python)
+  if path is None:
+    return None
+  d=parser_cachedir(a)
+  ident=(path,[environ.get(v) for v in PROBE_ENV])
+  key=sha256(repr(ident).encode('utf-8')).hexdigest()
+  fname=join(d,f"probe_{key}.pickle") if d is not None else None
+  if fname is not None:
+    try:
+      assert_(os.stat(d).st_uid==getuid(), f"Parser cache {d} is not owned by us")
+      with open(fname,'rb') as f:
+        p,caps=pickle.load(f)
+      assert_(p==ident and isinstance(caps,InterpCaps), f"Invalid probe {fname}")
+      if probe_mtimes(caps.mtimes)==caps.mtimes:
+        pdebug(f"capability cache hit {key[:7]}: {path} {caps}")
+        return caps
+      pdebug(f"capability cache: {path} was modified")
+    except FileNotFoundError:
+      pass
+    except Exception as err:
+      pdebug(f"capability cache: ignoring {fname}: {err}")
+  import json
+  from subprocess import run, DEVNULL
+  try:
+    out=run([path,'-c',PROBE_PYTHON],stdin=DEVNULL,capture_output=True).stdout
+    data=json.loads(out)
+  except (OSError,ValueError) as err:
+    pdebug(f"capability probe of {path} failed: {err}")
+    return None
+  caps=InterpCaps(data['version'],data['ipython'],
+                  probe_mtimes([path]+data['paths']))
+  pdebug(f"capability cache miss {key[:7]}: {path} {caps}")
+  if fname is not None:
+    try:
+      write_atomic(fname,pickle.dumps((ident,caps),protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception as err:
+      pdebug(f"capability cache: failed to save {fname}: {err}")
+  return caps
+
 def isdisabled(a:LitreplArgs, st:SType)->bool:
   return getattr(a,f"{st2name(st)}_interpreter",None)=='-'
 
@@ -281,6 +667,11 @@ def stop(a:LitreplArgs,st:SType)->None:
     pass
   remove_silent(fns.pidf)
   remove_silent(fns.inp)
+  if fns.readoutd!=fns.wd:
+    try:
+      rmdir(fns.readoutd) # Only if there are no pending readouts left
+    except OSError:
+      pass
 
 @dataclass
 class SymbolsMarkdown(Symbols):
@@ -443,16 +834,108 @@ def readinput(tty_ok:bool)->str:
   permission is given."""
   return sys.stdin.read() if (not isatty(sys.stdin.fileno()) or tty_ok) else ""
 
-def parse_as(a,inp,filetype)->Union[ParseResult,LarkError]:
+# Parser cache statistics of the current Litrepl process
+PARSER_CACHE_STATS:Dict[str,int]={'hits':0,'misses':0}
+
+# Parsers, already compiled or loaded by the current Litrepl process
+PARSER_CACHE:Dict[str,'Lark']={}
+
+class ParserPickler(pickle.Pickler):
+  """ Pickler for compiled Lark parsers. Earley parsers keep references to the
+  `re` module which is not picklable, so we store modules by name. """
+  def reducer_override(self, obj):
+    if isinstance(obj,ModuleType):
+      return import_module,(obj.__name__,)
+    return NotImplemented
+
+def parser_cachedir(a:LitreplArgs)->Optional[str]:
+  """ Return the parser cache directory or None if the caching is disabled. """
+  d=getattr(a,'parser_cache',None)
+  if d=='-':
+    return None
+  if d is None:
+    d=join(gettempdir(),f"litrepl_{getuid()}_cache")
+  return d
+
+def parser_cachekey(grammar:LarkGrammar, **options)->str:
+  """ Calculate the parser cache key. Besides the grammar text which already
+  depends on the marker options, the key includes Lark and Python versions so
+  the stale entries are never loaded. """
+  import lark
+  return sha256('\n'.join([
+    grammar, repr(sorted(options.items())), lark.__version__,
+    str(sys.version_info[:2])]).encode('utf-8')).hexdigest()
+
+def write_atomic(fname:str, data:bytes)->None:
+  """ Write the cache file `fname` so that readers never see it incomplete. """
+  tmpname=f"{fname}.{getpid()}"
+  try:
+    makedirs(dirname(fname), mode=0o700, exist_ok=True)
+    with open(tmpname,'wb') as f:
+      f.write(data)
+    os.replace(tmpname,fname)
+  except Exception:
+    remove_silent(tmpname)
+    raise
+
+def lark_parser(a:LitreplArgs, grammar:LarkGrammar, **options)->'Lark':
+  """ Return the compiled Lark parser for the `grammar`. Parsers are looked up
+  in memory and then in the on-disk cache, see `parser_cachedir`. The missing
+  parsers are compiled and saved atomically. Unreadable or foreign cache files
+  are ignored. """
+  from lark import Lark
+  key=parser_cachekey(grammar,**options)
+  if key in PARSER_CACHE:
+    return PARSER_CACHE[key]
+  d=parser_cachedir(a)
+  fname=join(d,f"parser_{key}.pickle") if d is not None else None
+  parser=None
+  if fname is not None:
+    try:
+      assert_(os.stat(d).st_uid==getuid(), f"Parser cache {d} is not owned by us")
+      with open(fname,'rb') as f:
+        parser=pickle.load(f)
+      assert_(isinstance(parser,Lark), f"Invalid parser cache file {fname}")
+    except FileNotFoundError:
+      parser=None
+    except Exception as err:
+      pdebug(f"parser cache: ignoring {fname}: {err}")
+      parser=None
+  if parser is not None:
+    PARSER_CACHE_STATS['hits']+=1
+    pdebug(f"parser cache hit {key[:7]}")
+  else:
+    PARSER_CACHE_STATS['misses']+=1
+    pdebug(f"parser cache miss {key[:7]}")
+    parser=Lark(grammar,**options)
+    if fname is not None:
+      try:
+        buf=BytesIO()
+        ParserPickler(buf,protocol=pickle.HIGHEST_PROTOCOL).dump(parser)
+        write_atomic(fname,buf.getvalue())
+      except Exception as err:
+        pdebug(f"parser cache: failed to save {fname}: {err}")
+  PARSER_CACHE[key]=parser
+  return parser
+
+def parse_as(a,inp,filetype)->Union[ParseResult,'LarkError']:
+  from lark import LarkError
+  from .scanner import scan
   try:
     g,s=grammar_(a,filetype)
-    parser=Lark(g,propagate_positions=True)
-    tree=parser.parse(inp)
-    return ParseResult(g,s,tree,filetype)
+    if a.parser=='scanner':
+      tree=scan(inp,s,filetype)
+    elif a.parser=='lark':
+      parser=lark_parser(a,g,propagate_positions=True)
+      tree=parser.parse(inp)
+    else:
+      raise ValueError(f"Unsupported parser \"{a.parser}\"")
+    return ParseResult(g,s,tree,filetype,inp)
   except LarkError as e:
     return e
 
 def numcodesec(tree:LarkTree)->int:
+  from lark.visitors import Interpreter as LarkInterpreter
   class C(LarkInterpreter):
     def __init__(self):
       self.n=0
@@ -464,9 +947,72 @@ def numcodesec(tree:LarkTree)->int:
   c.visit(tree)
   return c.n
 
+def sniff_markers(a:LitreplArgs, inp:str)->Dict[str,int]:
+  """ Count the code section begin markers of each filetype, using a single
+  regexp pass per filetype. """
+  hits={}
+  for ft in ['latex','markdown']:
+    _,s=grammar_(a,ft)
+    ms=[s.codebegin,s.comcodebegin]+([s.inlinemarker+r"\{"] if ft=='latex' else [])
+    pat='|'.join(f"(?:{m})" for m in ms if m)
+    hits[ft]=sum(1 for _ in re.finditer(pat,inp)) if pat else 0
+  pdebug(f"filetype sniffing: {hits}")
+  return hits
+
+def doc_cachefile(a:LitreplArgs, prefix:str, ext:str)->Optional[str]:
+  """ Return the name of a cache file related to the document named by
+  LITREPL_FILE, or None if no caching is possible. """
+  d=parser_cachedir(a)
+  f=environ.get('LITREPL_FILE')
+  if d is None or not f:
+    return None
+  return join(d,f"{prefix}_{hashdigest(os.path.abspath(f))}{ext}")
+
+def filetype_load(a:LitreplArgs)->Optional[str]:
+  fname=doc_cachefile(a,'filetype','.txt')
+  try:
+    if fname is not None:
+      with open(fname) as f:
+        ft=f.read().strip()
+      return ft if ft in ['latex','markdown'] else None
+  except OSError:
+    pass
+  return None
+
+def filetype_save(a:LitreplArgs, filetype:str)->None:
+  fname=doc_cachefile(a,'filetype','.txt')
+  if fname is None or filetype_load(a)==filetype:
+    return
+  try:
+    write_atomic(fname,filetype.encode())
+  except OSError as err:
+    pdebug(f"filetype cache: failed to save {fname}: {err}")
+
 def parse_maybe(a:LitreplArgs)->Optional[ParseResult]:
+  """ Parse the input. In the `auto` mode, the filetype is taken from the
+  filetype cache or guessed by `sniff_markers`. The guess is accepted if it
+  gives a non-empty list of sections, otherwise we parse the input both ways
+  and pick the result with more sections. """
   pdebug(f"parsing start")
   inp=readinput(a.tty)
+  if a.filetype=='auto':
+    nomarkers=False
+    ft=filetype_load(a)
+    if ft is None:
+      hits=sniff_markers(a,inp)
+      fts=[ft for ft,n in hits.items() if n>0]
+      # Without markers, both trees have no sections and Markdown wins the tie
+      nomarkers=len(fts)==0
+      ft='markdown' if nomarkers else (fts[0] if len(fts)==1 else None)
+    if ft is not None:
+      r=parse_as(a,inp,ft)
+      if isinstance(r,ParseResult):
+        n=numcodesec(r.tree)
+        if n>0 or nomarkers:
+          if n>0:
+            filetype_save(a,ft)
+          pdebug(f"parsing finish ({ft}), parser cache: {PARSER_CACHE_STATS}")
+          return r
   rs=[]
   if a.filetype in ['auto','tex','latex']:
     rs.append(parse_as(a,inp,'latex'))
@@ -474,6 +1020,7 @@ def parse_maybe(a:LitreplArgs)->Optional[ParseResult]:
     rs.append(parse_as(a,inp,'markdown'))
   prs=[r for r in rs if isinstance(r,ParseResult)]
   if len(prs)==0:
+    from lark import LarkError
     ers=[r for r in rs if isinstance(r,LarkError)]
     if len(ers)==0:
       pdebug(f"parsing finish (None)")
@@ -481,7 +1028,9 @@ def parse_maybe(a:LitreplArgs)->Optional[ParseResult]:
     else:
       raise ers[0]
   res=sorted(prs,key=lambda pr:numcodesec(pr.tree))[-1]
-  pdebug(f"parsing finish")
+  if a.filetype=='auto' and numcodesec(res.tree)>0:
+    filetype_save(a,res.filetype)
+  pdebug(f"parsing finish, parser cache: {PARSER_CACHE_STATS}")
   return res
 
 def parse_(a:LitreplArgs)->ParseResult:
@@ -508,11 +1057,15 @@ def failmsg(st:SType,fns:FileNames,ss:Union[Interpreter,str],ec:ECode)->str:
   msg+=f"Note: auxiliary directory is set to \"{fns.wd}\"\n"
   return msg
 
-def eval_section_(a:LitreplArgs, tree:LarkTree, sr:SecRec, interrupt:bool=False)->ECode:
+def eval_section_(a:LitreplArgs, tree:LarkTree, sr:SecRec, interrupt:bool=False,
+                  text:Optional[str]=None)->ECode:
   """ Evaluate code sections of the parsed `tree`, as specified in the `sr`
-  request.  """
+  request. If the source `text` of the tree is given, the document is written
+  by copying its unchanged spans, see `SpanWriter`. """
+  from lark.visitors import Interpreter as LarkInterpreter
   nsecs=sr.nsecs
   es=EvalState(sr)
+  w=SpanWriter(text,sys.stdout) if text is not None else None
 
   def _st2interp(st:SType)->Tuple[FileNames,Union[Interpreter,ErrorMsg]]:
     """ Resolve pipe filenames for the interpreter class `st`. """
@@ -528,6 +1081,7 @@ def eval_section_(a:LitreplArgs, tree:LarkTree, sr:SecRec, interrupt:bool=False)
       ipid=readipid(fns)
       if ipid is not None:
         pdebug("Sending SIGINT to the interpreter immediately")
+        remove_silent(fns.syncf)
         os.kill(ipid,SIGINT)
       else:
         pdebug(f"Failed to determine {st2name(st)} interpreter pid, not sending SIGINT")
@@ -553,11 +1107,51 @@ def eval_section_(a:LitreplArgs, tree:LarkTree, sr:SecRec, interrupt:bool=False)
       es.ecodes[nsec]=ec
     return ec
 
+  batched:Dict[NSec,RunResult]={}
+  expired:Set[SType]=set() # Sessions where a batched section has timed out
+
+  def _batch()->None:
+    """ Send the sections to be evaluated by the same interpreter as a batch,
+    see `process_batch`. A batch ends before the first repeated code. """
+    secs:Dict[SType,List[Tuple[NSec,str]]]=defaultdict(list)
+    class B(LarkInterpreter):
+      nsec=-1
+      def codesec(self,tree):
+        self.nsec+=1
+        if self.nsec in nsecs and self.nsec not in sr.preproc.pending:
+          bmarker=tree.children[0].children[0].value
+          st=bmarker2st(a,bmarker)
+          if st is not None:
+            bm=tree.children[0].meta
+            code=unindent(bm.column-1,tree.children[1].children[0].value)
+            secs[st].append((self.nsec,code))
+    B().visit(tree)
+    for st,ncodes in secs.items():
+      if len(ncodes)<2:
+        continue
+      fns,ss=_st2interp(st)
+      if not isinstance(ss,Interpreter):
+        continue
+      if not batchable(ss):
+        continue
+      codes:Dict[str,NSec]={}
+      for nsec,code in ncodes:
+        pcode=interp_code_preprocess(a,ss,es,code)
+        if pcode in codes:
+          break
+        codes[pcode]=nsec
+      runrs=process_batch(fns,ss,list(codes.keys()))
+      if runrs is not None:
+        batched.update(zip(codes.values(),runrs))
+
   class C(LarkInterpreter):
     def _print(self, s:str):
       print(s, end='')
+    def _keep(self, *parts:str):
+      if w is None:
+        self._print(''.join(parts))
     def text(self,tree):
-      self._print(tree.children[0].value)
+      self._keep(tree.children[0].value)
     def topleveltext(self,tree):
       return self.text(tree)
     def codesec(self,tree):
@@ -565,16 +1159,23 @@ def eval_section_(a:LitreplArgs, tree:LarkTree, sr:SecRec, interrupt:bool=False)
       bmarker=tree.children[0].children[0].value
       t=tree.children[1].children[0].value
       emarker=tree.children[2].children[0].value
-      self._print(f"{bmarker}{t}{emarker}")
+      self._keep(bmarker,t,emarker)
       bm,em=tree.children[0].meta,tree.children[2].meta
-      code=unindent(bm.column-1,t)
       if es.nsec in nsecs:
+        code=unindent(bm.column-1,t)
         ok,sres,ec=False,'',ECODE_RUNNING
         st,fns,ss=_bm2interp(bmarker)
         if isinstance(fns,FileNames):
           rr=None
-          if isinstance(ss,Interpreter):
-            sres,rr=eval_code_(a,fns,ss,es,code,sr.preproc.pending.get(es.nsec))
+          limits=section_limits(a,bmarker)
+          if isinstance(ss,Interpreter) and es.nsec in batched:
+            sres,rr=eval_code_(a,fns,ss,es,code,batched[es.nsec],
+              timeout=0 if st in expired else a.timeout_initial,limits=limits)
+            if rr.timeout:
+              expired.add(st)
+          elif isinstance(ss,Interpreter):
+            sres,rr=eval_code_(a,fns,ss,es,code,sr.preproc.pending.get(es.nsec),
+                               limits=limits)
           ec=_checkecode(fns,es.nsec,(rr.timeout if rr else False))
           if (ec is not ECODE_RUNNING) or isinstance(ss,str):
             msg=failmsg(st,fns,ss,ec)
@@ -592,12 +1193,15 @@ def eval_section_(a:LitreplArgs, tree:LarkTree, sr:SecRec, interrupt:bool=False)
       if (es.nsec in nsecs) and (es.nsec in es.sres):
         t2="\n"+indent(bm.column-1,escape(es.sres[es.nsec],emarker))
         es.ledder[bm.line]=nlines(t2)-nlines(t)
-        self._print(bmarker+t2+emarker)
+        if w is None:
+          self._print(bmarker+t2+emarker)
+        else:
+          w.replace(bm.end_pos,em.start_pos,t2)
         if a.irreproducible_exitcode and t!=t2:
           pstderr(f"Result mismatch:\nExisting:\n{t}\nNew:\n{t2}")
           es.ecodes[es.nsec]=a.irreproducible_exitcode
       else:
-        self._print(f"{bmarker}{t}{emarker}")
+        self._keep(bmarker,t,emarker)
     def inlinecodesec(self,tree):
       # FIXME: Latex-only
       bm,em=tree.children[0].meta,tree.children[4].meta
@@ -606,6 +1210,7 @@ def eval_section_(a:LitreplArgs, tree:LarkTree, sr:SecRec, interrupt:bool=False)
       im=tree.children[0].children[0].value
       result=''
       if es.nsec in nsecs:
+        obr,cbr=tree.children[3].meta,tree.children[5].meta
         st=SType.SPython
         fns,ss=_st2interp(st)
         if isinstance(ss,Interpreter):
@@ -615,13 +1220,15 @@ def eval_section_(a:LitreplArgs, tree:LarkTree, sr:SecRec, interrupt:bool=False)
           msg=failmsg(st,fns,ss,ec)
           pstderr(msg)
           result=msg
+        if w is not None:
+          w.replace(obr.end_pos,cbr.start_pos,result)
       else:
         result=tree.children[4].children[0].value if tree.children[4].children else ''
-      self._print(f"{im}{OBR}{code}{CBR}{spaces}{OBR}{result}{CBR}")
+      self._keep(im,OBR,code,CBR,spaces,OBR,result,CBR)
     def ignoresec(self,tree):
       bmarker=tree.children[0].children[0].value
       emarker=tree.children[2].children[0].value
-      self._print(f"{bmarker}{tree.children[1].children[0].value}{emarker}")
+      self._keep(bmarker,tree.children[1].children[0].value,emarker)
 
   def _finally():
     if a.map_cursor:
@@ -636,7 +1243,11 @@ def eval_section_(a:LitreplArgs, tree:LarkTree, sr:SecRec, interrupt:bool=False)
         stop(a,st)
 
   with with_parent_finally(_finally):
+    if a.batch and not interrupt:
+      _batch()
     C().visit(tree)
+    if w is not None:
+      w.close()
 
   ec=max(map(lambda x:ECODE_OK if x is None else x,
                  es.ecodes.values()),default=ECODE_OK)
@@ -645,18 +1256,21 @@ def eval_section_(a:LitreplArgs, tree:LarkTree, sr:SecRec, interrupt:bool=False)
 
 def solve_cpos(tree, cs:List[CursorPos])->PrepInfo:
   """ Preprocess the document tree. Resolve the list of cursor locations `cs`
-  into code section numbers. """
+  into code section numbers. Sections follow each other without overlapping,
+  so a cursor may only be within the last section starting before it. We find
+  it by binary search over the sorted section begin positions. """
+  from lark.visitors import Interpreter as LarkInterpreter
   cursors:dict={}
   rres:Dict[NSec,Set[RunResult]]=defaultdict(set)
   results:Dict[NSec,str]={}
+  begins:List[CursorPos]=[]
+  spans:List[Tuple[CursorPos,NSec]]=[]
   class C(LarkInterpreter):
     def __init__(self):
       self.nsec=-1
     def _count(self,bm,em):
-      for (line,col) in cs:
-        if cursor_within((line,col),(bm.line,bm.column),
-                                    (em.end_line,em.end_column)):
-          cursors[(line,col)]=self.nsec
+      begins.append((bm.line,bm.column))
+      spans.append(((em.end_line,em.end_column),self.nsec))
     def _getrr(self,text,column):
       text1,pend=rresult_load(text)
       results[self.nsec]=unindent(column,text1)
@@ -677,6 +1291,10 @@ def solve_cpos(tree, cs:List[CursorPos])->PrepInfo:
       self._count(tree.children[0].meta,tree.children[5].meta)
   c=C()
   c.visit(tree)
+  for (line,col) in cs:
+    i=bisect_right(begins,(line,col))-1
+    if i>=0 and cursor_within((line,col),begins[i],spans[i][0]):
+      cursors[(line,col)]=spans[i][1]
   rres2:dict={}
   for k,v in rres.items():
     assert_(len(v)==1, f"Results of codesec #{k} refer to different readout files: ({list(v)})")
@@ -684,8 +1302,7 @@ def solve_cpos(tree, cs:List[CursorPos])->PrepInfo:
   return PrepInfo(c.nsec,cursors,rres2,results)
 
 grammar_sloc = fr"""
-start: addr -> l_const
-     | addr (","|";") start -> l_add
+start: addr (("," | ";") addr)* -> l_list
 addr : sloc ".." sloc -> a_range
      | sloc -> a_const
 sloc : NUM ":" NUM -> s_cursor
@@ -697,23 +1314,31 @@ NUM : /[0-9]+/
 SIGN : /[+-]/
 """
 
+# Parser of the "sloc" strings, compiled on the first use
+SLOC_PARSER:Optional['Lark']=None
+
+def sloc_parser()->'Lark':
+  global SLOC_PARSER
+  if SLOC_PARSER is None:
+    from lark import Lark
+    SLOC_PARSER=Lark(grammar_sloc,parser='lalr')
+  return SLOC_PARSER
+
 def solve_sloc(s:str, tree:LarkTree)->SecRec:
   """ Translate "sloc" string `s` into a `SecRec` processing request on the
   given parsed document `tree`. """
-  p=Lark(grammar_sloc)
-  t=p.parse(s)
+  t=sloc_parser().parse(s)
   nknown:Dict[int,Callable[[int],int]]={}
   nqueries:Dict[int,CursorPos]={}
   # print(t.pretty())
   lastq=0
   last_cursor:Optional[CursorPos]=None
+  from lark import Transformer
   class T(Transformer):
     def __init__(self)->None:
       self.q=lastq
-    def l_const(self,tree):
-      return [tree[0]]
-    def l_add(self,tree):
-      return [tree[0]]+tree[1]
+    def l_list(self,tree):
+      return list(tree)
     def a_range(self,tree):
       return (tree[0],tree[1])
     def a_const(self,tree):
@@ -770,26 +1395,33 @@ def status_oneline(a:LitreplArgs,sts:List[SType])->int:
     fns=pipenames(a,st)
     try:
       pid=open(fns.pidf).read().strip()
+      from psutil import Process
       cmd=' '.join(Process(int(pid)).cmdline())
     except Exception as ex:
       pdebug(f"exception: {ex}")
       pid='-'
       cmd='-'
     try:
-      ecode=open(fns.ecodef).read().strip()
+      ecode=open(fns.ecodef).read().strip() or '-'
     except Exception:
       ecode='-'
     print(f"{st2name(st):6s} {pid:10s} {ecode:3s} {fns.wd} {cmd}")
 
 def status_verbose(a:LitreplArgs, t:Optional[LarkTree], sts:List[SType], version:str)->int:
+  from subprocess import check_output, DEVNULL, CalledProcessError
   sr=solve_sloc('0..$',t) if t is not None else None
   print(f"version: {version}")
   print(f"workdir: {getcwd()}")
   print(f"litrepl PATH: {environ.get('PATH','')}")
+  print(f"parser cache: {parser_cachedir(a) or '-'} "
+        f"(hits: {PARSER_CACHE_STATS['hits']}, "
+        f"misses: {PARSER_CACHE_STATS['misses']})")
   ecodes=set()
   for st in sts:
     fns=pipenames(a, st)
     print(f"{st2name(st)} interpreter auxdir: {fns.wd}")
+    print(f"{st2name(st)} readout dir: {fns.readoutd}"
+          f"{' (synchronous)' if fns.readout_sync else ''}")
     try:
       pid=open(fns.pidf).read().strip()
       print(f"{st2name(st)} interpreter pid: {pid}")
@@ -835,6 +1467,7 @@ def status_verbose(a:LitreplArgs, t:Optional[LarkTree], sts:List[SType], version
   return max(ecodes)
 
 def tangle(a:LitreplArgs, tree:LarkTree)->ECode:
+  from lark.visitors import Interpreter as LarkInterpreter
   class C(LarkInterpreter):
     def __init__(self):
       self.validcode=False
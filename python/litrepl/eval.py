@@ -2,29 +2,37 @@ import re
 import os
 import sys
 import fcntl
+import pickle
 
-from fcntl import LOCK_NB,LOCK_UN,LOCK_EX
-from copy import deepcopy
+from fcntl import LOCK_NB,LOCK_UN,LOCK_EX,LOCK_SH
 from typing import List, Optional, Tuple, Set, Dict, Callable
 from re import search, match as re_match, compile as re_compile
-from select import select
+from select import select, PIPE_BUF
 from os import environ, system, getpid, unlink
-from lark import Lark, Visitor, Transformer, Token, Tree
-from lark.visitors import Interpreter
-from os.path import isfile, join
-from signal import signal, SIGINT, SIGTSTP, SIGALRM, setitimer, ITIMER_REAL
+from os.path import isfile, join, abspath, splitext
+from signal import (signal, SIGINT, SIGTSTP, SIGALRM, SIG_IGN, setitimer,
+                    ITIMER_REAL)
 from time import sleep, time
-from dataclasses import dataclass, astuple
+from random import getrandbits
+from dataclasses import dataclass, field
+from struct import Struct
+from hashlib import sha256
+from codecs import getincrementaldecoder
 from functools import partial
 from argparse import ArgumentParser
-from contextlib import contextmanager
+from contextlib import contextmanager, ExitStack
 from errno import ESRCH
+from socket import socket, AF_UNIX, SOCK_STREAM, send_fds, recv_fds
+from threading import Thread, Lock
+from queue import Queue, Empty
 from signal import (pthread_sigmask, valid_signals, SIG_BLOCK, SIG_UNBLOCK,
                     SIG_SETMASK)
 
 from .types import (LitreplArgs, RunResult, ReadResult, FileNames, EvalState,
-                    ECode, ECODE_OK, ECODE_RUNNING, ECODE_UNDEFINED)
+                    ECode, ECODE_OK, ECODE_RUNNING, ECODE_UNDEFINED, Interpreter,
+                    ResultLimits)
 from .utils import remove_silent, wraplong, hashdigest, assert_
+from .interpreters.pyagent import FRAME, FRAME_DONE, frame
 
 def pstderr(*args,**kwargs):
   print(*args, file=sys.stderr, **kwargs, flush=True)
@@ -117,6 +125,7 @@ def with_sigint(detach_on_sigint:bool, propagate_sigint:bool, fns:FileNames):
       os.kill(getpid(),SIGALRM)
     if propagate_sigint:
       pdebug(f"with_sigint, sending SIGINT to {ipid}")
+      remove_silent(fns.syncf)
       os.kill(ipid,SIGINT)
   prev=None
   try:
@@ -187,108 +196,392 @@ def with_alarm(timeout_sec:float):
     yield
 
 
-def merge_basic2(acc,r,x)->Tuple[bytes,int]:
+def merge_basic2(acc:bytearray,r:bytes,x:int)->Tuple[bytearray,int]:
   """ Merges a buffer and a new text without any post-processing. """
-  return (acc+r,x)
-
-def merge_rn2(buf_,r,i_n=-1)->Tuple[bytes,int]:
-  """ Merges a buffer `buf_` and a newly-arrived text `r`, taking into account
-  terminal line-wrapping codes `\\r\\n`. Return a new buffer and
-  the position of the last `\\n` in it."""
-  buf=deepcopy(buf_)
-  sz=len(buf)
-  i_n=-(sz-i_n)
-  start=0
-  for i in range(len(r)):
-    if r[i]==10:
-      i_n=i
-      buf+=r[start:i+1]
-      start=i+1
-    elif r[i]==13:
-      if i_n<0:
-        buf=buf[:sz+i_n+1]
-        sz=len(buf)
-        i_n=-1
-      start=i+1
-  buf+=r[start:]
-  if i_n>=0:
-    i_n-=start
-  assert_(b'\r' not in buf)
-  if i_n>=0:
-    assert_(i_n<len(buf), f"{len(buf)}, {i_n}")
-    assert_(buf[i_n]==(b'\n'[0]), f"{buf}, {i_n}, {buf[i_n]}")
-  return buf,sz+i_n if i_n<0 else sz+i_n
+  acc+=r
+  return (acc,x)
 
+RN_RE=re_compile(b"^[^\\n]*\\r",re.MULTILINE)
+
+def merge_rn2(buf:bytearray,r:bytes,i_n:int=-1)->Tuple[bytearray,int]:
+  """ Merges a buffer `buf` and a newly-arrived text `r`, taking into account
+  terminal line-wrapping codes `\\r\\n`: a `\\r` erases the unfinished line
+  preceding it. The buffer is updated in-place. `i_n` is the position of the
+  last `\\n` in the buffer, or -1 if there is none. Return the buffer and the
+  new position of its last `\\n`."""
+  if not isinstance(buf,bytearray):
+    buf=bytearray(buf)
+  # Only the first line of `r` continues the unfinished line of `buf`
+  i=r.find(b'\n')
+  j=r.rfind(b'\r',0,len(r) if i<0 else i)
+  if j>=0:
+    del buf[i_n+1:]
+  if i<0:
+    buf+=r[j+1:]
+    return buf,i_n
+  buf+=r[j+1:i+1]
+  # Complete lines
+  k=r.rfind(b'\n')
+  lines=r[i+1:k+1]
+  buf+=RN_RE.sub(b'',lines) if b'\r' in lines else lines
+  i_n=len(buf)-1
+  # The new unfinished line
+  j=r.rfind(b'\r',k+1)
+  buf+=r[max(j,k)+1:]
+  return buf,i_n
+
+
+class PromptMatcher:
+  """ Incremental detector of the literal `prompt` in a growing buffer. Every
+  call only searches the bytes that arrived since the previous call plus a
+  prompt-sized overlap, so the per-chunk cost does not depend on the amount of
+  output already received. """
+  def __init__(self, prompt:str):
+    self.prompt=prompt.encode('utf-8')
+    self.pos=0 # The prompt does not start before this offset
+    self.tail=b'' # Unmatched prompt prefix, see `feed`
+
+  def rewind(self, pos:int)->None:
+    """ Notify the matcher that the buffer may have changed starting from `pos`. """
+    self.pos=min(self.pos,pos)
+
+  def search(self, buf)->int:
+    """ Return the offset of the first prompt in `buf` or -1 if there is none. """
+    i=buf.find(self.prompt,self.pos)
+    if i<0:
+      self.pos=max(self.pos,len(buf)-len(self.prompt)+1)
+    return i
+
+  def feed(self, r:bytes)->bool:
+    """ Streaming version of `search`: check if the prompt is found after
+    receiving the chunk `r`. Only the last bytes that could start the prompt
+    are retained between calls. """
+    buf=self.tail+r
+    if buf.find(self.prompt)>=0:
+      return True
+    self.tail=buf[max(0,len(buf)-len(self.prompt)+1):]
+    return False
+
+HEXDUMP_RE=re_compile('[\udc80-\udcff]+')
+
+def hexdump_span(m)->str:
+  """ Show a span of the bytes escaped by the `surrogateescape` handler. """
+  return f"<LitREPL: invalid bytes {' '.join(f'{ord(c)&0xff:02x}' for c in m[0])}>"
+
+class TextDecoder:
+  """ Incremental UTF-8 decoder of the interpreter output. The `errors` policy
+  selects the presentation of the invalid bytes: `replace` shows U+FFFD,
+  `backslashreplace` shows `\\xNN` escapes, `hexdump` shows every span of
+  invalid bytes as a `<LitREPL: invalid bytes NN NN>` marker. The `strict`
+  policy raises `UnicodeDecodeError`. """
+  def __init__(self, errors:str='replace'):
+    self.hexdump=errors=='hexdump'
+    self.dec=getincrementaldecoder('utf-8')(
+      'surrogateescape' if self.hexdump else errors)
+
+  def decode(self, data, final:bool=False)->str:
+    """ Decode the next chunk. The incomplete character at the end of `data`
+    is kept for the next call, unless the chunk is `final`. Spans of invalid
+    bytes are only shown intact if they do not cross the chunks. """
+    s=self.dec.decode(data,final)
+    return HEXDUMP_RE.sub(hexdump_span,s) if self.hexdump else s
 
 def readout(fdr,
-            prompt,
-            merge)->str:
-  """ Read the `fdr` until the prompt regexp is found. The prompt must define
-  exactly one group to query after the match is detected. See `mkre`.
+            prompt:PromptMatcher,
+            merge,
+            errors:str='replace')->str:
+  """ Read the `fdr` until the `prompt` is found. Return the text preceding the
+  prompt. The `merge` function may only rewrite the last unfinished line of
+  the buffer and only if the new data contains `\\r`. The complete lines are
+  decoded as they arrive, according to the `errors` policy of `TextDecoder`.
   """
-  # [1] - Here we query the single matched group, see `mkre`
-  acc:bytes=b''
+  acc=bytearray()
   i_n=-1
-  while select([fdr],[],[],None)[0] != []:
-    r=os.read(fdr, 1024)
-    if r!=b'':
-      acc,i_n=merge(acc,r,i_n)
-    m=re_match(prompt,acc)
-    if m:
-      acc=m.group(1) # [1]
-      r=b''
-    if r==b'':
-      try:
-        return acc.decode('utf-8')
-      except UnicodeDecodeError:
-        return "<LitREPL: Non-unicode output>"
+  dec=TextDecoder(errors)
+  text=[]
+  try:
+    while select([fdr],[],[],None)[0] != []:
+      r=os.read(fdr, 1024)
+      if r!=b'':
+        if b'\r' in r:
+          prompt.rewind(acc.rfind(b'\n')+1)
+        acc,i_n=merge(acc,r,i_n)
+      k=prompt.search(acc)
+      if k>=0:
+        del acc[k:]
+        r=b''
+      if r==b'':
+        text.append(dec.decode(acc,final=True))
+        return ''.join(text)
+      # The complete lines are never rewritten and can not start the prompt
+      n=min(i_n+1,prompt.pos)
+      if n>0:
+        text.append(dec.decode(acc[:n]))
+        del acc[:n]
+        i_n-=n
+        prompt.pos-=n
+  except UnicodeDecodeError:
+    return "<LitREPL: Non-unicode output>"
   return "<LitREPL: timeout waiting the interpreter response>"
 
-def readout_asis(fdr:int, fdw:int, fo:int, pattern:str, prompt,
-                 timeout:Optional[int]=None)->None:
-  """ Read everything from FD `fdr` and send to `fo` until `prompt` regexp is
-  matched. If the `prompt` is not found within the `timeout` seconds, re-send
+READOUT_CHUNK_MIN=1024
+READOUT_CHUNK_MAX=1024*1024
+
+@dataclass
+class MergeState:
+  """ Progress of reading a growing readout file: the number of bytes consumed,
+  the merged text and the state of the merge function and the prompt matcher.
+  The state is saved next to the readout file, so every poll of a pending
+  section only merges the bytes written since the previous poll. If the text
+  exceeds the `ResultLimits`, only its head `acc[:head]` and tail `acc[head:]`
+  are kept, see `bound_merged`. """
+  offset:int=0                      # Readout file bytes consumed
+  i_n:int=-1                        # Position of the last `\n` in `acc`
+  pos:int=0                         # The prompt does not start before `pos`
+  acc:bytearray=field(default_factory=bytearray) # The merged text
+  nl:int=0                          # Number of `\n` in `acc`
+  head:int=-1                       # Size of the head, -1 if nothing is elided
+  dropped:int=0                     # Bytes elided after the head
+  dlines:int=0                      # Lines elided after the head
+
+# Offset, i_n+1, pos, nl, head+1, dropped and dlines of the saved `MergeState`,
+# followed by `acc`
+MERGED_HEADER=Struct('>QQQQQQQ')
+
+def merged_fname(fname:str)->str:
+  """ Name of the file storing the `MergeState` of the readout file `fname`. """
+  return splitext(fname)[0]+".merged"
+
+def spill_fname(fname:str)->str:
+  """ Name of the file collecting the text elided from the result of the
+  readout file `fname`, see `spill_result`. """
+  return splitext(fname)[0]+".spill"
+
+def merged_load(fd:int)->MergeState:
+  """ Load the state saved by `merged_save`. Return the initial state if
+  there is none or it is damaged. """
+  size=os.fstat(fd).st_size
+  data=bytearray()
+  while len(data)<size:
+    r=os.pread(fd,size-len(data),len(data))
+    if r==b'':
+      break
+    data+=r
+  if len(data)<MERGED_HEADER.size:
+    return MergeState()
+  offset,n,pos,nl,head,dropped,dlines=MERGED_HEADER.unpack_from(data)
+  del data[:MERGED_HEADER.size]
+  if n>len(data) or pos>len(data) or head>len(data)+1:
+    return MergeState()
+  return MergeState(offset,n-1,pos,data,nl,head-1,dropped,dlines)
+
+def merged_save(fd:int, st:MergeState, stable:int)->None:
+  """ Save the state `st`. The first `stable` bytes of the merged text are
+  known to be saved already: the merge function only rewrites the text after
+  the last complete line and `bound_merged` only the text after the head. """
+  os.pwrite(fd,memoryview(st.acc)[stable:],MERGED_HEADER.size+stable)
+  os.ftruncate(fd,MERGED_HEADER.size+len(st.acc))
+  os.pwrite(fd,MERGED_HEADER.pack(st.offset,st.i_n+1,st.pos,st.nl,st.head+1,
+                                  st.dropped,st.dlines),0)
+
+def utf8_boundary(buf:bytearray, i:int)->int:
+  """ Move the position `i` back to the nearest UTF-8 character boundary. """
+  while 0<i<len(buf) and (buf[i]&0xC0)==0x80:
+    i-=1
+  return i
+
+def bound_merged(st:MergeState, limits:ResultLimits, prompt:PromptMatcher)->bytes:
+  """ Elide the middle of the merged text if it exceeds the `limits`. The head
+  and the tail get a half of the limits each. Only the complete lines may go
+  to the head, so the merge function never rewrites it. The text where the
+  prompt may start is never elided. Return the elided bytes. """
+  maxb=limits.max_bytes or sys.maxsize
+  maxl=limits.max_lines or sys.maxsize
+  acc=st.acc
+  if len(acc)<=maxb and st.nl<=maxl:
+    return b''
+  if st.head<0:
+    h=min(maxb//2,st.i_n+1,prompt.pos)
+    k,nl=-1,0
+    while nl<maxl//2:
+      k=acc.find(b'\n',k+1,h)
+      if k<0:
+        break
+      nl+=1
+    if nl==maxl//2:
+      h=k+1
+    k=acc.rfind(b'\n',0,h)
+    st.head=k+1 if k>=0 else utf8_boundary(acc,h)
+  d=max(st.head,len(acc)-(maxb-st.head))
+  if st.nl>maxl:
+    # Keep the lines of the tail within the rest of the line limit
+    tl=max(0,maxl-acc.count(b'\n',0,st.head))
+    k=len(acc)
+    for _ in range(tl+1):
+      k=acc.rfind(b'\n',st.head,k)
+      if k<0:
+        break
+    d=max(d,k+1)
+  if d>st.head:
+    # Start the tail with a complete line, if possible
+    k=acc.find(b'\n',d-1)
+    d=k+1 if k>=0 else d
+  d=utf8_boundary(acc,min(d,prompt.pos))
+  if d<=st.head:
+    return b''
+  dropped=bytes(acc[st.head:d])
+  del acc[st.head:d]
+  n,dl=len(dropped),dropped.count(b'\n')
+  st.dropped+=n
+  st.dlines+=dl
+  st.nl-=dl
+  st.i_n=st.i_n-n if st.i_n>=d else st.head-1
+  prompt.pos-=n
+  return dropped
+
+def merged_text(st:MergeState, spilled:Optional[str]=None,
+                errors:str='replace')->str:
+  """ Return the merged text, with the elision marker between the head and
+  the tail. `spilled` names the file with the complete text, if any. The text
+  is decoded according to the `errors` policy of `TextDecoder`. """
+  try:
+    if st.head<0:
+      return TextDecoder(errors).decode(st.acc,final=True)
+    head=TextDecoder(errors).decode(memoryview(st.acc)[:st.head],final=True)
+    tail=TextDecoder(errors).decode(memoryview(st.acc)[st.head:],final=True)
+    sep='\n' if head and head[-1]!='\n' else ''
+    see=f", see {spilled}" if spilled else ''
+    return (f"{head}{sep}<LitREPL: {st.dropped} bytes ({st.dlines} lines) "
+            f"elided{see}>\n{tail}")
+  except UnicodeDecodeError:
+    return "<LitREPL: Non-unicode output>"
+
+def readout_cont(fdr:int, st:MergeState, prompt:PromptMatcher, merge,
+                 limits:Optional[ResultLimits]=None,
+                 spill:Callable[[bytes],None]=lambda _:None)->None:
+  """ Merge the contents of the readout file `fdr` past `st.offset` into the
+  state `st`, the way `readout` does. The text following the prompt, if any, is
+  dropped. If the `limits` are set, the text is kept within them as the chunks
+  arrive, the elided bytes are passed to `spill`. """
+  prompt.pos=st.pos
+  while True:
+    r=os.pread(fdr,READOUT_CHUNK_MAX,st.offset)
+    if r==b'':
+      break
+    st.offset+=len(r)
+    if b'\r' in r:
+      prompt.rewind(st.acc.rfind(b'\n')+1)
+    i0=st.i_n+1
+    st.acc,st.i_n=merge(st.acc,r,st.i_n)
+    st.nl+=st.acc.count(b'\n',i0)
+    k=prompt.search(st.acc)
+    if k>=0:
+      st.nl-=st.acc.count(b'\n',k)
+      del st.acc[k:]
+      st.i_n=st.acc.rfind(b'\n')
+      prompt.pos=len(st.acc)
+    if limits is not None:
+      spill(bound_merged(st,limits,prompt))
+    if k>=0:
+      break
+  st.pos=prompt.pos
+
+def spill_result(st:MergeState, spillf:str, wd:str)->str:
+  """ Save the complete text (the head, the elided text collected in the
+  `spillf` file and the tail) into a file named after its SHA-256 hash in the
+  `wd` directory. An existing file with the same name already has this text.
+  The files are not removed, they stay until the directory is removed. Return
+  the name of the file. """
+  h=sha256()
+  tmp=join(wd,f"result_{getpid()}.tmp")
+  with open(tmp,'wb') as fo:
+    def _write(data)->None:
+      h.update(data)
+      fo.write(data)
+    _write(st.acc[:st.head])
+    with open(spillf,'rb') as fi:
+      while True:
+        data=fi.read(READOUT_CHUNK_MAX)
+        if not data:
+          break
+        _write(data)
+    _write(st.acc[st.head:])
+  fname=join(wd,f"result_{h.hexdigest()}.txt")
+  if isfile(fname):
+    os.unlink(tmp) # Named after the full hash, so the text is the same
+  else:
+    os.replace(tmp,fname)
+  return fname
+
+def readout_asis(fdr:int, fdw:int, fo:int, pattern:str, prompt:PromptMatcher,
+                 timeout:Optional[int]=None)->bool:
+  """ Read everything from FD `fdr` and send to `fo` until the `prompt` is
+  found. If the `prompt` is not found within the `timeout` seconds, re-send
   the `pattern` and continue the interaction. This function is intended to be
   run from a separate process, governing the interaction with interpreters.
+  The memory use does not depend on the amount of data copied: the chunk size
+  grows while the interpreter keeps the pipe full and only the possible prompt
+  prefix is kept between the chunks.
+
+  Return True if the interaction is clean, i.e. the `pattern` was sent once
+  and nothing was read past the `prompt`, so the interpreter is known to wait
+  for the next input.
   """
-  acc:bytes=b''
+  chunk=READOUT_CHUNK_MIN
+  nbytes,nchunks,nsent=0,0,1
   os.write(fdw,pattern.encode())
-  while True:
-    rlist = select([fdr],[],[],timeout)[0]
-    if rlist == []:
-      # pdebug(f"readout_asis timeout, repeating the prompt pattern")
-      os.write(fdw,pattern.encode())
-    else:
-      pdebug(f"readout_asis ready to read")
-      r=os.read(fdr, 1024)
-      pdebug(f"readout_asis read {len(r)} bytes")
-      if r==b'':
-        return
-      w=os.write(fo,r)
-      if w!=len(r):
-        os.write(fo,"<LitREPL failed to copy input stream>\n".encode())
-        # assert True
-      acc+=r # TODO: don't store everything
-      m=re_match(prompt,acc)
-      if m:
-        return
+  try:
+    while True:
+      rlist = select([fdr],[],[],timeout)[0]
+      if rlist == []:
+        # pdebug(f"readout_asis timeout, repeating the prompt pattern")
+        os.write(fdw,pattern.encode())
+        nsent+=1
+      else:
+        r=os.read(fdr, chunk)
+        if r==b'':
+          return False
+        nbytes+=len(r)
+        nchunks+=1
+        w=os.write(fo,r)
+        if w!=len(r):
+          os.write(fo,"<LitREPL failed to copy input stream>\n".encode())
+          # assert True
+        if prompt.feed(r):
+          return nsent==1 and (prompt.tail+r).endswith(prompt.prompt)
+        if len(r)==chunk:
+          chunk=min(chunk*2,READOUT_CHUNK_MAX)
+        elif len(r)<chunk//2:
+          chunk=max(chunk//2,READOUT_CHUNK_MIN)
+  finally:
+    pdebug(f"readout_asis copied {nbytes} bytes in {nchunks} chunks")
 
 TIMEOUT_SEC=3
 
-def mkre(prompt:str):
-  """ Matches the shortest string followed by a sequence of prompts """
-  return re_compile(f"((.(?!{prompt}))*(.(?={prompt}))?)({prompt})+".encode('utf-8'),
-                    re.MULTILINE|re.DOTALL)
-
 def isync(fdr, fdw, ss:Interpreter):
+  """ Synchronize with the interpreter and return its output preceding the
+  synchronization response. If the interpreter has exited, return the rest of
+  its output. """
   p1,p2=ss.patterns()
-  err=os.write(fdw,p1[0].encode())
-  x=readout(fdr,prompt=mkre(p1[1]),merge=merge_rn2)
+  nonce=getrandbits(48)
+  try:
+    request=ss.frame('',nonce)
+    done=frame(FRAME_DONE,str(nonce).encode()).decode()
+    prompt,merge=PromptMatcher(done),merge_basic2
+  except NotImplementedError:
+    request=p1[0].encode()
+    prompt,merge=PromptMatcher(p1[1]),merge_rn2
+  try:
+    # The stale frames, if any, are skipped as a part of the output
+    os.write(fdw,request)
+  except BrokenPipeError:
+    pdebug("sync: the interpreter has exited")
+  x=readout(fdr,prompt=prompt,merge=merge)
   pdebug(f"sync returned '{x}'")
   return x
 
 
-def interact(fdr, fdw, text:str, fo:int, ss:Interpreter)->None:
+def interact(fdr, fdw, text:str, fo:int, ss:Interpreter, sync:bool=True)->bool:
   """ Interpreter interaction procedure, running in a forked process. Its goal
   is to sent the code to the interpreter, to read the response and, most
   importantly, to detect when to stop reading.
@@ -299,13 +592,173 @@ def interact(fdr, fdw, text:str, fo:int, ss:Interpreter)->None:
     text (str): Text to send to the interpreter
     fo (int): Output descriptor, available for writing
     ss (Interpreter): Interpreter abstraction object
+    sync (bool): Sync with the interpreter first. Could be disabled if the
+      previous interaction is known to be clean.
+
+  Returns:
+    bool: True if the interaction left the interpreter in sync, see
+      `readout_asis`.
+
+  If the interpreter supports sentinels or frames, the `text` is evaluated as a
+  batch of one section, see `interact_batch`. Otherwise, the completion pattern
+  is re-sent until the interpreter responds.
   """
-  isync(fdr,fdw,ss)
+  if not batchable(ss):
+    if sync:
+      isync(fdr,fdw,ss)
+    p1,p2=ss.patterns()
+    os.write(fdw,text.encode())
+    os.write(fdw,'\n'.encode())
+    pdebug(f"interact main text ({len(text)} chars) sent")
+    return readout_asis(fdr,fdw,fo,p2[0],prompt=PromptMatcher(p2[1]),
+                        timeout=TIMEOUT_SEC)
+  return interact_batch(fdr,fdw,[text],[fo],ss,lambda _:None,sync=sync)
+
+def readout_split(fdr:int, fdw:int, data:bytes, fos:List[int],
+                  sentinels:List[Tuple[str,str]], prompt:str,
+                  finish:Callable[[int],None],
+                  timeout:Optional[float]=None)->bool:
+  """ Write `data` to FD `fdw` while reading FD `fdr` and splitting the output
+  into `fos` by the responses of the `sentinels`: the output preceding the
+  first response goes to the first file, and so on. Every response is replaced
+  by the `prompt`, then the file is passed to `finish`. Return True if nothing
+  was read past the last response and no request was re-sent.
+
+  A section reading its standard input may consume its sentinel request. So
+  if the interpreter is silent for `timeout` seconds after all the `data` is
+  written, the request of the current sentinel is sent again. The wait doubles
+  after every re-send and is reset as soon as a section completes, so a long
+  silent computation costs only a few extra requests. The extra requests are
+  queued after the batch, so their responses, if any, follow the last
+  response.
+  """
+  mdata=memoryview(data)
+  pats=[x[1].encode() for x in sentinels]
+  eprompt=prompt.encode()
+  chunk=READOUT_CHUNK_MIN
+  i,tail,nresent,wait=0,b'',0,timeout
+  while True:
+    rlist,wlist,_=select([fdr],[fdw] if len(mdata)>0 else [],[],
+                         wait if len(mdata)==0 else None)
+    if not rlist and not wlist:
+      pdebug(f"readout_split: no output for {wait}s, re-sending sentinel {i}")
+      mdata=memoryview(sentinels[i][0].encode())
+      nresent+=1
+      wait=wait*2 if wait is not None else None
+      continue
+    if wlist:
+      n=os.write(fdw,mdata[:PIPE_BUF])
+      mdata=mdata[n:]
+    if rlist:
+      r=os.read(fdr,chunk)
+      if r==b'':
+        return False
+      if len(r)==chunk:
+        chunk=min(chunk*2,READOUT_CHUNK_MAX)
+      elif len(r)<chunk//2:
+        chunk=max(chunk//2,READOUT_CHUNK_MIN)
+      buf=tail+r
+      while True:
+        k=buf.find(pats[i])
+        if k<0:
+          break
+        os.write(fos[i],buf[:k]+eprompt)
+        finish(fos[i])
+        buf=buf[k+len(pats[i]):]
+        i+=1
+        wait=timeout
+        if i==len(pats):
+          return len(buf)==0 and nresent==0
+      n=max(0,len(buf)-len(pats[i])+1)
+      os.write(fos[i],buf[:n])
+      tail=buf[n:]
+
+def readout_frames(fdr:int, fdw:int, data:bytes, fos:List[int],
+                   nonces:List[bytes], prompt:str,
+                   finish:Callable[[int],None])->bool:
+  """ Framed counterpart of `readout_split`: write `data` to FD `fdw` while
+  reading the response frames from FD `fdr`. The output payloads go to the
+  current file of `fos`. The completion frame carrying the current nonce of
+  `nonces` is replaced by the `prompt`, then the file is passed to `finish` and
+  the next file becomes current. Completion frames of the former requests are
+  skipped. Return True if nothing was read past the last completion frame.
+  """
+  mdata=memoryview(data)
+  eprompt=prompt.encode()
+  chunk=READOUT_CHUNK_MIN
+  i,buf=0,b''
+  while True:
+    rlist,wlist,_=select([fdr],[fdw] if len(mdata)>0 else [],[])
+    if wlist:
+      n=os.write(fdw,mdata[:PIPE_BUF])
+      mdata=mdata[n:]
+    if rlist:
+      r=os.read(fdr,chunk)
+      if r==b'':
+        return False
+      if len(r)==chunk:
+        chunk=min(chunk*2,READOUT_CHUNK_MAX)
+      elif len(r)<chunk//2:
+        chunk=max(chunk//2,READOUT_CHUNK_MIN)
+      buf+=r
+      pos=0
+      while len(buf)-pos>=FRAME.size:
+        kind,n=FRAME.unpack_from(buf,pos)
+        end=pos+FRAME.size+n
+        if end>len(buf):
+          break
+        payload=buf[pos+FRAME.size:end]
+        pos=end
+        if kind!=FRAME_DONE:
+          os.write(fos[i],payload)
+        elif payload==nonces[i]:
+          os.write(fos[i],eprompt)
+          finish(fos[i])
+          i+=1
+          if i==len(nonces):
+            return pos==len(buf)
+      buf=buf[pos:]
+
+def batchable(ss:Interpreter)->bool:
+  """ Check if the interpreter could evaluate several sections in one
+  interaction, that is, if it supports either sentinels or frames. """
+  try:
+    ss.sentinel(0)
+    return True
+  except NotImplementedError:
+    pass
+  try:
+    ss.frame('',0)
+    return True
+  except NotImplementedError:
+    return False
+
+def interact_batch(fdr, fdw, codes:List[str], fos:List[int], ss:Interpreter,
+                   finish:Callable[[int],None], sync:bool=True)->bool:
+  """ Evaluate several code sections in one interaction. The sections are sent
+  as a single stream, each one followed by its unique sentinel, see
+  `Interpreter.sentinel`, or as a sequence of frames, see `Interpreter.frame`.
+  The output is split by the sentinels or by the completion frames into the
+  readout files `fos`. Every file is passed to `finish` as soon as its section
+  is complete, so the results could be read while the rest of the batch is
+  running. The completion is detected as soon as the output arrives. Return
+  True if the interaction is clean, see `readout_asis`. """
+  if sync:
+    isync(fdr,fdw,ss)
   p1,p2=ss.patterns()
-  os.write(fdw,text.encode())
-  os.write(fdw,'\n'.encode())
-  pdebug(f"interact main text ({len(text)} chars) sent")
-  readout_asis(fdr,fdw,fo,p2[0],prompt=mkre(p2[1]),timeout=TIMEOUT_SEC)
+  nonce=getrandbits(48)
+  nonces=[nonce+i for i in range(len(codes))]
+  try:
+    data=b''.join(ss.frame(code,n) for code,n in zip(codes,nonces))
+  except NotImplementedError:
+    sentinels=[ss.sentinel(n) for n in nonces]
+    data=''.join(code+'\n'+s[0] for code,s in zip(codes,sentinels)).encode()
+    pdebug(f"interact_batch sends {len(codes)} section(s) ({len(data)} bytes)")
+    return readout_split(fdr,fdw,data,fos,sentinels,p2[1],finish,
+                         timeout=TIMEOUT_SEC)
+  pdebug(f"interact_batch sends {len(codes)} frame(s) ({len(data)} bytes)")
+  return readout_frames(fdr,fdw,data,fos,[str(n).encode() for n in nonces],
+                        p2[1],finish)
 
 def process(a:LitreplArgs,fns:FileNames, ss:Interpreter, lines:str)->Tuple[str,RunResult]:
   """ Evaluate `lines` synchronously. """
@@ -316,7 +769,8 @@ def process(a:LitreplArgs,fns:FileNames, ss:Interpreter, lines:str)->Tuple[str,R
   with with_locked_fd(runr.fname,OPEN_RDONLY,LOCK_EX) as fdr:
     assert_(fdr is not None)
     pdebug("process readout")
-    res=readout(fdr,prompt=mkre(p2[1]),merge=merge_rn2)
+    res=readout(fdr,prompt=PromptMatcher(p2[1]),merge=merge_rn2,
+                errors=a.result_limits.errors)
     remove_silent(runr.fname)
     pdebug("process readout complete")
   return res,runr
@@ -333,26 +787,41 @@ def interp_is_running(fns:FileNames)->bool:
       return False
   return True
 
+def flock_wait(fd:int, flags:int, timeout_sec:float)->bool:
+  """ Lock the `fd`, waiting for at most `timeout_sec` seconds. The blocking
+  call is made by a thread, so the alarm timer stays free for the callers. """
+  try:
+    fcntl.flock(fd,flags|LOCK_NB)
+    return True
+  except BlockingIOError:
+    pass
+  t=Thread(target=fcntl.flock,args=(fd,flags),daemon=True)
+  t.start()
+  t.join(timeout_sec)
+  return not t.is_alive()
+
 def interp_exitcode(fns:FileNames,
-                    poll_sec=0.5,
-                    poll_attempts=4,
+                    timeout_sec:float=2.0,
                     undefined=ECODE_UNDEFINED)->ECode:
-  """ Determines retcode of the interpreter. Polls it a little if it looks
-  crashed."""
-  ecode:int|None=None
-  while ecode is None:
-    if interp_is_running(fns):
-      return ECODE_RUNNING
-    else:
-      try:
-        return int(open(fns.ecodef).read())
-      except (ValueError,FileNotFoundError):
-        pass
-    poll_attempts-=1
-    if poll_attempts<=0:
-      break
-    sleep(poll_sec)
-  return undefined
+  """ Determines retcode of the interpreter. The interpreter wrapper process
+  keeps the exit code file locked until it writes the code, see `base.start_`.
+  If the interpreter has just exited, wait for at most `timeout_sec` seconds
+  for the wrapper to release the lock. """
+  if interp_is_running(fns):
+    return ECODE_RUNNING
+  try:
+    fd=os.open(fns.ecodef,OPEN_RDONLY)
+  except FileNotFoundError:
+    return undefined
+  try:
+    if not flock_wait(fd,LOCK_SH,timeout_sec):
+      pdebug(f"interp_exitcode: {fns.ecodef} is still locked")
+      return undefined
+    return int(os.read(fd,64))
+  except ValueError:
+    return undefined
+  finally:
+    os.close(fd)
 
 @contextmanager
 def with_fd(name:str, flags:int, open_timeout_sec=float('inf')):
@@ -392,21 +861,346 @@ def with_locked_fd(name:str, flags:int, lock_flags:int,
     else:
       yield None
 
-CREATE_WRONLY_EMPTY=os.O_WRONLY|os.O_SYNC|os.O_TRUNC|os.O_CREAT
-OPEN_RDONLY=os.O_RDONLY|os.O_SYNC
+# The pipes and the readout files are shared through the page cache, so
+# neither of them needs `O_SYNC` to be seen by the other processes. Only the
+# durable readout store writes synchronously, see `readout_flags`.
+CREATE_WRONLY_EMPTY=os.O_WRONLY|os.O_TRUNC|os.O_CREAT
+OPEN_RDONLY=os.O_RDONLY
 LOCK_NONBLOCKING=LOCK_EX|LOCK_NB
 LOCK_BLOCKING=LOCK_EX
 
+READER_POLL_SEC=1.0
+
+def reader_sockname(fns:FileNames)->str:
+  """ Socket of the reader daemon of the interpreter session `fns`. """
+  return abspath(join(fns.wd,"reader.sock"))
+
+class ReaderPipes:
+  """ Interpreter pipes, kept open by the reader daemon between the jobs. The
+  pipes are re-opened if the interpreter is restarted. Like the forked reader
+  of `process_async`, the daemon only locks them for the duration of a job.
+
+  After a clean job, the daemon records a sequence number into the `syncf`
+  file. Other users of the pipes (the forked reader, socat, SIGINT senders)
+  remove the file, so the next job could skip the sync if the number is still
+  there. """
+  def __init__(self, fns:FileNames):
+    self.fns=fns
+    self.fds:Optional[Tuple[int,int]]=None
+    self.ids:Optional[tuple]=None
+    self.seq=0
+    self.token:Optional[str]=None # The sync state recorded by this daemon
+
+  def close(self)->None:
+    if self.fds is not None:
+      for fd in self.fds:
+        os.close(fd)
+    self.fds,self.ids=None,None
+    self.record(False)
+
+  def synced(self)->bool:
+    """ Check that the interpreter is still in the state recorded after the
+    previous job and has no pending output. Should be called on locked pipes. """
+    if self.token is None or self.fds is None:
+      return False
+    try:
+      with open(self.fns.syncf) as f:
+        if f.read()!=self.token:
+          return False
+    except FileNotFoundError:
+      return False
+    return select([self.fds[0]],[],[],0)[0]==[]
+
+  def record(self, clean:bool)->None:
+    """ Record the sync state after a job, or invalidate it. """
+    if clean:
+      self.seq+=1
+      self.token=f"{os.getpid()}:{self.seq}"
+      with open(self.fns.syncf,'w') as f:
+        f.write(self.token)
+    else:
+      self.token=None
+      remove_silent(self.fns.syncf)
+
+  def acquire(self)->Optional[Tuple[int,int]]:
+    """ Open (if needed) and lock the pipes. Return the `(fdr,fdw)` pair or
+    None if the interpreter is not accessible. """
+    try:
+      fns=self.fns
+      ids=(os.stat(fns.inp).st_ino,os.stat(fns.outp).st_ino,readipid(fns))
+      if ids!=self.ids:
+        self.close()
+        # The interpreter keeps both pipes open, so the opening never blocks
+        fdw=os.open(fns.inp,os.O_WRONLY|os.O_NONBLOCK)
+        fdr=os.open(fns.outp,os.O_RDONLY|os.O_NONBLOCK)
+        os.set_blocking(fdw,True)
+        os.set_blocking(fdr,True)
+        self.fds,self.ids=(fdr,fdw),ids
+      for fd in self.fds:
+        fcntl.flock(fd,LOCK_EX|LOCK_NB)
+      return self.fds
+    except OSError as err:
+      pdebug(f"reader: unable to lock the pipes: {err}")
+      self.release()
+      return None
+
+  def release(self)->None:
+    if self.fds is not None:
+      for fd in self.fds:
+        fcntl.flock(fd,LOCK_UN)
+
+def reader_job(pipes:ReaderPipes, ss:Interpreter, codes:List[str],
+               fos:List[int], busy:Lock)->bool:
+  """ Evaluate `codes` and copy the responses into the readout files `fos`,
+  then release the `busy` lock and close the files. A single code section is
+  evaluated by `interact`, several sections are evaluated as a batch by
+  `interact_batch`. Return False if the interpreter has gone. """
+  ok=True
+  closed:Set[int]=set()
+  def _finish(fo:int)->None:
+    os.close(fo)
+    closed.add(fo)
+  try:
+    fds=pipes.acquire()
+    if fds is not None:
+      fdr,fdw=fds
+      try:
+        sync=not pipes.synced()
+        pipes.record(False)
+        pdebug(f"reader: interact start ({len(codes)} sections, sync: {sync})")
+        if len(codes)==1:
+          clean=interact(fdr,fdw,codes[0],fos[0],ss,sync=sync)
+        else:
+          clean=interact_batch(fdr,fdw,codes,fos,ss,_finish,sync=sync)
+        pipes.record(clean)
+        pdebug("reader: interact finish")
+      except BrokenPipeError:
+        pdebug("reader: catches Broken Pipe error")
+        for fo in fos:
+          if fo not in closed:
+            os.write(fo,"<BrokenPipe>\n".encode())
+        ok=False
+      finally:
+        pipes.release()
+    else:
+      for fo in fos:
+        os.write(fo,"<Unable to access the interpreter>\n".encode())
+  finally:
+    # The client may submit the next job as soon as `fo` is unlocked
+    busy.release()
+    for fo in fos:
+      if fo not in closed:
+        _finish(fo)
+  return ok
+
+READER_MAX_FDS=253 # SCM_MAX_FD of Linux
+
+def reader_recv(conn:socket)->Tuple[Interpreter,List[str],List[int]]:
+  """ Receive a job, sent by `reader_submit`. """
+  data,fds,_,_=recv_fds(conn,65536,READER_MAX_FDS)
+  try:
+    assert_(len(fds)>0 and len(data)>=4, "Malformed reader job")
+    n=int.from_bytes(data[:4],'big')
+    buf=bytearray(data[4:])
+    while len(buf)<n:
+      r=conn.recv(n-len(buf))
+      assert_(len(r)>0, "Truncated reader job")
+      buf+=r
+    ss,codes=pickle.loads(buf)
+    while len(fds)<len(codes):
+      _,fds2,_,_=recv_fds(conn,1,READER_MAX_FDS)
+      assert_(len(fds2)>0, "Truncated reader job")
+      fds.extend(fds2)
+    assert_(len(fds)==len(codes), "Malformed reader job")
+    return ss,codes,fds
+  except Exception:
+    for fd in fds:
+      os.close(fd)
+    raise
+
+def reader_accept(ls:socket, jobs:Queue, busy:Lock)->None:
+  """ Accept the jobs and acknowledge them, so that the clients do not wait
+  for the preceding jobs to complete. Like the pipe locks of the forked reader,
+  the `busy` lock rejects the jobs arriving while the interpreter is busy. """
+  while True:
+    conn,_=ls.accept()
+    with conn:
+      try:
+        ss,codes,fos=reader_recv(conn)
+        if busy.acquire(blocking=False):
+          jobs.put((ss,codes,fos))
+        else:
+          pdebug("reader: rejecting the job, the interpreter is busy")
+          for fo in fos:
+            os.write(fo,"<Unable to access the interpreter>\n".encode())
+            os.close(fo)
+        conn.sendall(b'\0')
+      except Exception as err:
+        pdebug(f"reader: failed to receive a job: {err}")
+
+def reader_daemon(fns:FileNames, ls:socket, lockfd:int)->None:
+  """ The reader daemon main loop. The daemon owns the interpreter pipes and
+  runs the jobs one by one. It exits when the interpreter stops. """
+  os.setsid()
+  signal(SIGINT,SIG_IGN)
+  signal(SIGTSTP,SIG_IGN)
+  pthread_sigmask(SIG_SETMASK,[])
+  devnull=os.open(os.devnull,os.O_RDWR)
+  os.dup2(devnull,0)
+  os.dup2(devnull,1)
+  if DEBUG:
+    os.dup2(os.open(join(fns.wd,"reader.log"),
+                    os.O_WRONLY|os.O_CREAT|os.O_APPEND,0o600),2)
+  else:
+    os.dup2(devnull,2)
+  # Do not keep the files of the client, e.g. its stdout or readout file
+  lo=3
+  for fd in sorted([ls.fileno(),lockfd]):
+    os.closerange(lo,fd)
+    lo=fd+1
+  os.closerange(lo,os.sysconf('SC_OPEN_MAX'))
+  pdebug(f"reader: started for {fns.wd}")
+  jobs:Queue=Queue()
+  busy=Lock()
+  Thread(target=reader_accept,args=(ls,jobs,busy),daemon=True).start()
+  pipes=ReaderPipes(fns)
+  while True:
+    try:
+      ss,codes,fos=jobs.get(timeout=READER_POLL_SEC)
+    except Empty:
+      if interp_is_running(fns):
+        continue
+      break
+    if not reader_job(pipes,ss,codes,fos,busy):
+      break
+  remove_silent(reader_sockname(fns))
+  while True:
+    try:
+      ss,codes,fos=jobs.get_nowait()
+    except Empty:
+      break
+    reader_job(pipes,ss,codes,fos,busy)
+  pdebug(f"reader: exits")
+
+def reader_spawn(fns:FileNames)->None:
+  """ Start the reader daemon of the session unless it is already running. The
+  daemon holds `reader.lock` for its lifetime. """
+  lockfd=os.open(join(fns.wd,"reader.lock"),os.O_WRONLY|os.O_CREAT,0o600)
+  try:
+    fcntl.flock(lockfd,LOCK_EX|LOCK_NB)
+    sname=reader_sockname(fns)
+    remove_silent(sname)
+    ls=socket(AF_UNIX,SOCK_STREAM)
+  except OSError as err:
+    pdebug(f"reader_spawn: not starting the daemon: {err}")
+    os.close(lockfd)
+    return
+  try:
+    ls.bind(sname)
+    os.chmod(sname,0o600)
+    ls.listen(16)
+    sys.stdout.flush(); sys.stderr.flush()
+    pid=os.fork()
+    if pid==0:
+      try:
+        if os.fork()==0:
+          reader_daemon(fns,ls,lockfd)
+      finally:
+        os._exit(0)
+    os.waitpid(pid,0)
+    pdebug(f"reader_spawn: started the daemon")
+  except OSError as err:
+    pdebug(f"reader_spawn: failed to start the daemon: {err}")
+  finally:
+    ls.close()
+    os.close(lockfd)
+
+def reader_submit(fns:FileNames, ss:Interpreter, codes:List[str],
+                  fos:List[int])->bool:
+  """ Pass the job to the reader daemon of the session, starting the daemon
+  if needed. The daemon receives copies of the readout file descriptors `fos`,
+  one per code section, so it keeps the files locked until the sections are
+  complete. Return False if the daemon is not available or closes the
+  connection without accepting the job, which it does only if the job was not
+  received. Once the descriptors are sent, a failure to get the answer means
+  the job might be queued, so we return True to avoid running it twice. """
+  data=pickle.dumps((ss,codes))
+  msg=len(data).to_bytes(4,'big')+data
+  sname=reader_sockname(fns)
+  for attempt in range(10):
+    s=socket(AF_UNIX,SOCK_STREAM)
+    try:
+      s.settimeout(TIMEOUT_SEC)
+      s.connect(sname)
+    except OSError as err:
+      pdebug(f"reader_submit: {err}")
+      s.close()
+      if attempt==0:
+        reader_spawn(fns)
+      else:
+        sleep(0.05)
+      continue
+    # Once the descriptor is sent, the job must not be re-submitted
+    with s:
+      sent=False
+      try:
+        n=send_fds(s,[msg],fos[:READER_MAX_FDS])
+        sent=True
+        if n<len(msg):
+          s.sendall(msg[n:])
+        for i in range(READER_MAX_FDS,len(fos),READER_MAX_FDS):
+          send_fds(s,[b'\0'],fos[i:i+READER_MAX_FDS])
+        accepted=(s.recv(1)==b'\0')
+      except OSError as err:
+        pdebug(f"reader_submit: {err}, the job was {'' if sent else 'not '}sent")
+        return sent
+      pdebug(f"reader_submit: the job is accepted: {accepted}")
+      return accepted
+  return False
+
+def readout_dir(fns:FileNames)->str:
+  """ Return the directory of the readout files, creating it if needed. Fall
+  back to the auxiliary directory if the readout store directory is not
+  accessible or is not private. """
+  d=fns.readoutd
+  if d!=fns.wd:
+    try:
+      os.makedirs(d,mode=0o700,exist_ok=True)
+      st=os.stat(d)
+      if st.st_uid==os.getuid() and (st.st_mode&0o077)==0:
+        return d
+      pdebug(f"readout_dir: {d} is not private")
+    except OSError as err:
+      pdebug(f"readout_dir: {err}")
+  return fns.wd
+
+def readout_fname(fns:FileNames, code:str)->str:
+  """ Name of the readout file of the `code` section. """
+  return join(readout_dir(fns),f"partial_{hashdigest(code)}.txt")
+
+def readout_flags(fns:FileNames)->int:
+  """ Flags of the readout files. With `O_SYNC`, the data are on the disk once
+  the reader has written them. """
+  return CREATE_WRONLY_EMPTY|(os.O_SYNC if fns.readout_sync else 0)
+
 def process_async(fns:FileNames, ss:Interpreter, code:str)->RunResult:
-  """ Send `code` to the interpreter and fork the response reader. The output
+  """ Send `code` to the interpreter via the reader daemon of the session. If
+  the daemon is not available, fork a one-time response reader. The output
   file is locked and its name is saved into the resulting `RunResult` object.
   """
-  wd,inp,outp,_,_,_=astuple(fns)
-  codehash=hashdigest(code)
-  fname=join(wd,f"partial_{codehash}.txt")
+  inp,outp=fns.inp,fns.outp
+  fname=readout_fname(fns,code)
   pdebug(f"process_async locking {fname}")
-  with with_locked_fd(fname,CREATE_WRONLY_EMPTY,LOCK_NONBLOCKING) as fo:
+  with with_locked_fd(fname,readout_flags(fns),LOCK_NONBLOCKING) as fo:
     if fo is not None:
+      # Left by a previous run, if any
+      remove_silent(merged_fname(fname))
+      remove_silent(spill_fname(fname))
+    if fo is not None and reader_submit(fns,ss,[code],[fo]):
+      return RunResult(fname)
+    elif fo is not None:
+      pdebug(f"process_async falls back to the forked reader")
+      remove_silent(fns.syncf)
       sys.stdout.flush(); sys.stderr.flush() # FIXME: crude
       pid=os.fork()
       if pid==0:
@@ -417,26 +1211,23 @@ def process_async(fns:FileNames, ss:Interpreter, code:str)->RunResult:
         signal(SIGINT,_handler)
         signal(SIGTSTP,_handler)
         pdebug(f"process_async(reader) opening pipes")
-        with with_locked_fd(inp, os.O_WRONLY|os.O_SYNC,
+        with with_locked_fd(inp, os.O_WRONLY,
                             fcntl.LOCK_EX|fcntl.LOCK_NB,open_timeout_sec=0.5) as fdw:
-          with with_locked_fd(outp, os.O_RDONLY|os.O_SYNC,
+          with with_locked_fd(outp, os.O_RDONLY,
                               fcntl.LOCK_EX|fcntl.LOCK_NB,open_timeout_sec=0.5) as fdr:
-            try:
-              if fdw and fdr:
-                pdebug("process_async(reader) interact start")
-                try:
-                  interact(fdr,fdw,code,fo,ss)
-                  pdebug("process_async(reader) interact finish")
-                except BrokenPipeError:
-                  pdebug("process_async(reader) catches Broken Pipe error")
-                  os.write(fo,"<BrokenPipe>\n".encode())
-                  raise
-              else:
-                # FIXME: We must transfer error back to the reader to be able to
-                # exit with an errorcode.
-                os.write(fo,"<Unable to access the interpreter>\n".encode())
-            finally:
-              os.fsync(fo)
+            if fdw and fdr:
+              pdebug("process_async(reader) interact start")
+              try:
+                interact(fdr,fdw,code,fo,ss)
+                pdebug("process_async(reader) interact finish")
+              except BrokenPipeError:
+                pdebug("process_async(reader) catches Broken Pipe error")
+                os.write(fo,"<BrokenPipe>\n".encode())
+                raise
+            else:
+              # FIXME: We must transfer error back to the reader to be able to
+              # exit with an errorcode.
+              os.write(fo,"<Unable to access the interpreter>\n".encode())
         pdebug("process_async(reader) finishes")
         exit(0)
       else:
@@ -448,36 +1239,93 @@ def process_async(fns:FileNames, ss:Interpreter, code:str)->RunResult:
       pdebug(f"process_async reuses already existing reader")
       return RunResult(fname)
 
+def process_batch(fns:FileNames, ss:Interpreter,
+                  codes:List[str])->Optional[List[RunResult]]:
+  """ Send distinct `codes` to the interpreter as a batch, see
+  `interact_batch`. Return the `RunResult` objects of the sections or None if
+  the batch can not be started, e.g. if the reader daemon is not available. """
+  fnames=[readout_fname(fns,code) for code in codes]
+  assert_(len(set(fnames))==len(fnames), "Batched sections must be distinct")
+  with ExitStack() as stack:
+    fos=[stack.enter_context(with_locked_fd(f,readout_flags(fns),LOCK_NONBLOCKING))
+         for f in fnames]
+    for f,fo in zip(fnames,fos):
+      if fo is not None:
+        remove_silent(merged_fname(f))
+        remove_silent(spill_fname(f))
+    if all(fo is not None for fo in fos) and reader_submit(fns,ss,codes,fos):
+      return [RunResult(f) for f in fnames]
+  pdebug("process_batch: unable to start the batch")
+  return None
+
+def readout_merged(fname:str, fdr:int, prompt:PromptMatcher, save:bool=True,
+                   limits:Optional[ResultLimits]=None,
+                   wd:Optional[str]=None)->str:
+  """ Read the readout file `fname`, opened as `fdr`, resuming from the
+  `MergeState` saved by the previous call. Save the new state if `save` is set.
+  Otherwise, the reading is final: if the `limits` ask to spill the elided
+  text, the complete text is saved into the `wd` directory. """
+  spillf=spill_fname(fname)
+  spill=limits is not None and limits.spill
+  def _spill(data:bytes)->None:
+    if spill and data:
+      with open(spillf,'ab') as f:
+        f.write(data)
+  with with_locked_fd(merged_fname(fname),os.O_RDWR|os.O_CREAT,LOCK_BLOCKING) as fdm:
+    assert_(fdm is not None)
+    st=merged_load(fdm)
+    if st.offset>os.fstat(fdr).st_size:
+      pdebug(f"readout_merged: {fname} was re-created")
+      st=MergeState()
+      remove_silent(spillf)
+    offset,stable,dropped=st.offset,st.i_n+1,st.dropped
+    readout_cont(fdr,st,prompt,merge_rn2,limits,_spill)
+    if st.dropped!=dropped:
+      stable=min(stable,st.head)
+    if save:
+      merged_save(fdm,st,min(stable,len(st.acc)))
+    pdebug(f"readout_merged: {st.offset-offset} new bytes merged")
+  spilled=None
+  if not save and spill and st.head>=0 and wd is not None and isfile(spillf):
+    spilled=spill_result(st,spillf,wd)
+    pdebug(f"readout_merged: the complete text is saved to {spilled}")
+  return merged_text(st,spilled,'replace' if limits is None else limits.errors)
+
 def process_cont(fns:FileNames,
                  ss:Interpreter,
                  runr:RunResult,
                  timeout:float,
-                 keep_readout_file:bool=False)->ReadResult:
-  """ Read from the running readout process. """
+                 keep_readout_file:bool=False,
+                 limits:Optional[ResultLimits]=None)->ReadResult:
+  """ Read from the running readout process. The result text is kept within
+  the `limits`, if any. """
   rr:Optional[ReadResult]=None
   p1,p2=ss.patterns()
   pdebug(f"process_cont locking {runr.fname}")
 
   with with_locked_fd(runr.fname,
-                      os.O_RDONLY|os.O_SYNC,
+                      OPEN_RDONLY,
                       LOCK_BLOCKING if timeout>0 else LOCK_NONBLOCKING,
                       lock_timeout_sec=timeout) as fdr:
 
     if fdr:
       pdebug(f"process_cont final readout start")
-      res=readout(fdr,prompt=mkre(p2[1]),merge=merge_rn2)
+      res=readout_merged(runr.fname,fdr,PromptMatcher(p2[1]),save=False,
+                         limits=limits,wd=fns.wd)
       pdebug(f"process_cont final readout finish")
       rr=ReadResult(res,False) # Return final result
+      remove_silent(merged_fname(runr.fname))
+      remove_silent(spill_fname(runr.fname))
       if keep_readout_file:
         pdebug(f"process_cont keep {runr.fname}")
       else:
         remove_silent(runr.fname)
         pdebug(f"process_cont unlinked {runr.fname}")
     else:
-      with with_fd(runr.fname,os.O_RDONLY|os.O_SYNC) as fdr:
+      with with_fd(runr.fname,OPEN_RDONLY) as fdr:
         assert_(fdr is not None)
         pdebug("process_cont readout(nonblocking) start")
-        res=readout(fdr,prompt=mkre(p2[1]),merge=merge_rn2)
+        res=readout_merged(runr.fname,fdr,PromptMatcher(p2[1]),limits=limits)
         pdebug(f"process_cont readout(nonblocking) finish")
         rr=ReadResult(res,True) # Timeout ==> Return continuation
   assert_(rr is not None)
@@ -487,13 +1335,14 @@ def process_adapt(fns:FileNames,
                   ss:Interpreter,
                   code:str,
                   timeout:float=1.0,
-                  keep_readout_file:bool=False)->Tuple[ReadResult,RunResult]:
+                  keep_readout_file:bool=False,
+                  limits:Optional[ResultLimits]=None)->Tuple[ReadResult,RunResult]:
   """ Push `code` to the interpreter and wait for `timeout` seconds for
   the immediate answer. In case of delay, return intermediate answer and
   the continuation context."""
   runr=process_async(fns,ss,code)
   rr=process_cont(fns,ss,runr,timeout=timeout,
-                  keep_readout_file=keep_readout_file)
+                  keep_readout_file=keep_readout_file,limits=limits)
   return rr,runr
 
 # LitRepl pending evaluation tag regexp
@@ -533,9 +1382,13 @@ def eval_code_(a:LitreplArgs,
                ss:Interpreter,
                es:EvalState,
                code:str,
-               runr:Optional[RunResult]=None) -> Tuple[str,ReadResult]:
+               runr:Optional[RunResult]=None,
+               timeout:Optional[float]=None,
+               limits:Optional[ResultLimits]=None) -> Tuple[str,ReadResult]:
   """ Start or complete the code section evaluation. `runr`
-  contains the already existing runner's context, if any.
+  contains the already existing runner's context, if any. `timeout` overrides
+  the timeout of the pending evaluation. `limits` override the result limits
+  set by the command line.
 
   The function returns either the evaluation result or the running context
   encoded in the result for later reference.
@@ -547,7 +1400,9 @@ def eval_code_(a:LitreplArgs,
     rr,runr=eval_code_raw(ss,interp_code_preprocess(a,ss,es,code),
                           a.timeout_initial,a.timeout_continue,
                           runr,
-                          keep_readout_file=a.keep_readout)
+                          keep_readout_file=a.keep_readout,
+                          timeout=timeout,
+                          limits=a.result_limits if limits is None else limits)
     pptext=interp_result_postprocess(a,ss,rr.text)
     res=rresult_save(pptext,runr) if rr.timeout else pptext
   return res,rr
@@ -557,13 +1412,17 @@ def eval_code_raw(ss:Interpreter,
                   timeout_initial,
                   timeout_continue,
                   runr:Optional[RunResult]=None,
-                  keep_readout_file:bool=False) -> Tuple[ReadResult,RunResult]:
+                  keep_readout_file:bool=False,
+                  timeout:Optional[float]=None,
+                  limits:Optional[ResultLimits]=None) -> Tuple[ReadResult,RunResult]:
   """ Start or complete the code section evaluation without pre- and
   post-processing. See also `eval_code_`. """
   fns=ss.fns
   if runr is None:
-    rr,runr=process_adapt(fns,ss,code,timeout_initial,keep_readout_file)
+    rr,runr=process_adapt(fns,ss,code,timeout_initial,keep_readout_file,limits)
   else:
-    rr=process_cont(fns,ss,runr,timeout_continue,keep_readout_file)
+    rr=process_cont(fns,ss,runr,
+                    timeout_continue if timeout is None else timeout,
+                    keep_readout_file,limits)
   return rr,runr
 
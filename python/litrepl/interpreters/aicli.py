@@ -1,5 +1,4 @@
 import re
-from os import system
 from os.path import join
 from copy import copy
 
@@ -18,13 +17,12 @@ def secvar_matches(code:str)->Iterable[tuple[str,int]]:
 
 class AicliInterpreter(Interpreter):
   endcmd="/ask"
-  def run_child(self,interpreter)->int:
+  def child_cmd(self,interpreter)->str:
     fns=self.fns
-    ret=system(
+    return (
       f"exec {interpreter} "
       f"<'{fns.inp}' >'{fns.outp}' 2>&1"
     )
-    return ret
   def setup_child(self, a, finp, foutp)->None:
     finp.write("/set terminal prompt \"\"\n")
     finp.write("/echo ready\n")
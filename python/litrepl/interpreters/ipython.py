@@ -1,5 +1,4 @@
 import re
-from os import system
 from os.path import join, abspath
 
 from ..utils import fillspaces, runsocat, assert_
@@ -12,14 +11,13 @@ PATTERN_PYTHON_2=('325674801010\n',)*2
 CPASTE_PATTERN='12341234213423'
 
 class IPythonInterpreter(Interpreter):
-  def run_child(self,interpreter)->int:
+  def child_cmd(self,interpreter)->str:
     fns=self.fns
     assert_('ipython' in interpreter.lower())
-    ret=system(
+    return (
       f"exec {interpreter} --colors=NoColor -i "
       f"<'{fns.inp}' >'{fns.outp}' 2>&1"
     )
-    return ret
   def setup_child(self, a, finp, foutp)->None:
     finp.write(
       'import sys\n'
@@ -55,6 +53,8 @@ class IPythonInterpreter(Interpreter):
       )
   def patterns(self):
     return PATTERN_PYTHON_1,PATTERN_PYTHON_2
+  def sentinel(self, nonce:int):
+    return (f"{PATTERN_PYTHON_2[0].strip()}{nonce}\n",)*2
   def result_postprocess(self, a:LitreplArgs, text:str) -> str:
     # A workaround for https://github.com/ipython/ipython/issues/13622
     r=re.compile('ERROR! Session/line number was not unique in database. '
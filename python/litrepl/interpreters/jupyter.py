@@ -0,0 +1,144 @@
+""" Jupyter kernel sessions. The interpreter process is a bridge which starts a
+local kernel using the optional `jupyter_client` package. The bridge talks the
+framed protocol (see `litrepl.interpreters.pyagent`) to Litrepl and the kernel
+messaging protocol to the kernel. """
+
+import re
+import os
+import sys
+import json
+from os.path import dirname, abspath, join
+from typing import Callable, Optional
+
+from .python import PythonFramedInterpreter
+from .pyagent import (FRAME, FRAME_STDOUT, FRAME_STDERR, FRAME_DONE, frame,
+                      read_exact, write_all)
+
+JUPYTER_BOOTSTRAP='from litrepl.interpreters.jupyter import main; main()'
+JUPYTER_MARKER='litrepl-kernel'
+ANSI_ESCAPE_RE=re.compile(r'\x1b\[[0-9;]*[A-Za-z]')
+KERNEL_POLL_SEC=1
+
+class JupyterInterpreter(PythonFramedInterpreter):
+  """ Jupyter kernel, driven by the bridge process. The `interpreter` is the
+  name of the kernel. The bridge learns the auxiliary directory during the
+  setup, so the pre-started kernels can not be adopted by other sessions. """
+  poolable=False
+  def child_cmd(self,interpreter)->str:
+    fns=self.fns
+    root=dirname(dirname(dirname(abspath(__file__))))
+    return (
+      f"PYTHONPATH='{root}'${{PYTHONPATH:+:$PYTHONPATH}} "
+      f"exec {sys.executable} -c '{JUPYTER_BOOTSTRAP}' "
+      f"{JUPYTER_MARKER} {interpreter}"
+      f"<'{fns.inp}' >'{fns.outp}' 2>&1"
+    )
+  def setup_child(self, a, finp, foutp)->None:
+    ecode=None if a.exception_exitcode is None else int(a.exception_exitcode)
+    finp.write(json.dumps({'exception_exitcode':ecode,
+                           'wd':abspath(self.fns.wd)})+'\n')
+    finp.flush()
+
+def kernel_msg(km, get:Callable[...,dict])->Optional[dict]:
+  """ Receive a message using the `get` method of a kernel client channel.
+  Return None if the kernel managed by `km` has died. """
+  from queue import Empty
+  while True:
+    try:
+      return get(timeout=KERNEL_POLL_SEC)
+    except Empty:
+      if not km.is_alive():
+        return None
+
+def kernel_reply(km, kc, msg_id:str, output:Callable[[bytes,str],None])->bool:
+  """ Wait for the completion of the execution request `msg_id` sent by the
+  kernel client `kc`, passing its output to the `output` function. The request
+  is complete when both the `idle` status and the `execute_reply` are
+  received, or when the kernel managed by `km` dies. Return True if the code
+  raised an exception or the kernel died. """
+  error=False
+  while True:
+    msg=kernel_msg(km,kc.get_iopub_msg)
+    if msg is None:
+      output(FRAME_STDERR,'The kernel has died\n')
+      return True
+    if msg['parent_header'].get('msg_id')!=msg_id:
+      continue
+    t,c=msg['msg_type'],msg['content']
+    if t=='stream':
+      output(FRAME_STDOUT if c['name']=='stdout' else FRAME_STDERR,c['text'])
+    elif t in {'execute_result','display_data'}:
+      text=c['data'].get('text/plain')
+      if text is not None:
+        output(FRAME_STDOUT,text+'\n')
+    elif t=='error':
+      error=True
+      output(FRAME_STDERR,ANSI_ESCAPE_RE.sub('','\n'.join(c['traceback']))+'\n')
+    elif t=='status' and c['execution_state']=='idle':
+      break
+  while True:
+    reply=kernel_msg(km,kc.get_shell_msg)
+    if reply is None:
+      output(FRAME_STDERR,'The kernel has died\n')
+      return True
+    if reply['parent_header'].get('msg_id')==msg_id:
+      return error or reply['content']['status']=='error'
+
+def main()->None:
+  """ Run the bridge: start the kernel named by the last argument, then serve
+  the requests until the input pipe is closed. The requests which are already
+  in the pipe are sent to the kernel at once, it executes them one by one.
+  SIGINT interrupts the kernel, SIGTERM shuts it down. The bridge exits if the
+  kernel dies. """
+  from signal import signal, SIGINT, SIGTERM
+  from select import select
+  from jupyter_client.manager import KernelManager
+  line=b''
+  while not line.endswith(b'\n'):
+    line+=read_exact(0,1)
+  config=json.loads(line)
+  fdout=os.dup(1)
+  km=KernelManager(kernel_name=sys.argv[-1],transport='ipc',
+                   ip=join(config['wd'],'kernel-ipc'),
+                   connection_file=join(config['wd'],'kernel.json'))
+  km.start_kernel()
+  kc=km.client()
+  try:
+    kc.start_channels()
+    kc.wait_for_ready(timeout=60)
+    # Diagnostics go to the pipe until the kernel is ready, then they would
+    # break the frames.
+    fd=os.open(os.devnull,os.O_WRONLY)
+    os.dup2(fd,1)
+    os.dup2(fd,2)
+    os.close(fd)
+    signal(SIGINT,lambda *_: km.interrupt_kernel())
+    signal(SIGTERM,lambda *_: sys.exit(0))
+    def _output(kind:bytes, text:str)->None:
+      write_all(fdout,frame(kind,text.encode('utf-8',errors='replace')))
+    while True:
+      requests=[]
+      try:
+        while len(requests)==0 or select([0],[],[],0)[0]:
+          kind,n=FRAME.unpack(read_exact(0,FRAME.size))
+          nonce,code=read_exact(0,n).split(b'\n',1)
+          msg_id=None
+          if code.strip():
+            msg_id=kc.execute(code.decode('utf-8',errors='replace'),
+                              allow_stdin=False,stop_on_error=False)
+          requests.append((nonce,msg_id))
+      except EOFError:
+        if len(requests)==0:
+          break
+      for nonce,msg_id in requests:
+        error=False
+        if msg_id is not None:
+          error=kernel_reply(km,kc,msg_id,_output)
+        write_all(fdout,frame(FRAME_DONE,nonce))
+        if error and not km.is_alive():
+          sys.exit(1)
+        if error and config['exception_exitcode'] is not None:
+          sys.exit(config['exception_exitcode'])
+  finally:
+    kc.stop_channels()
+    km.shutdown_kernel(now=True)
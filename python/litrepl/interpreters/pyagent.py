@@ -0,0 +1,140 @@
+""" Agent of the framed Python protocol. The agent replaces the interactive loop
+of the Python interpreter: it reads length-prefixed request frames from the
+standard input, executes the code and writes the output back as frames,
+followed by the completion frame. The source of this module is sent to the
+interpreter by `PythonFramedInterpreter.setup_child`, so it must only depend
+on the standard library. See also `litrepl.eval.readout_frames`. """
+
+import os
+import sys
+from struct import Struct
+
+FRAME=Struct('>cI')  # Frame kind and the payload length
+FRAME_EXEC=b'x'      # Request: the nonce, a newline and the code to execute
+FRAME_STDOUT=b'o'    # Response: a chunk of the standard output
+FRAME_STDERR=b'e'    # Response: a chunk of the standard error
+FRAME_DONE=b'd'      # Response: the nonce of the completed request
+
+FRAME_CHUNK=65536
+
+def frame(kind:bytes, payload:bytes)->bytes:
+  return FRAME.pack(kind,len(payload))+payload
+
+def read_exact(fd:int, n:int)->bytes:
+  buf=b''
+  while len(buf)<n:
+    try:
+      r=os.read(fd,n-len(buf))
+    except KeyboardInterrupt:
+      continue
+    if r==b'':
+      raise EOFError()
+    buf+=r
+  return buf
+
+def write_all(fd:int, data:bytes)->None:
+  view=memoryview(data)
+  while len(view)>0:
+    view=view[os.write(fd,view):]
+
+def run(code:str, g:dict)->None:
+  """ Execute the `code` statement by statement, printing the values of the
+  expression statements like the interactive interpreter does. Stop at the
+  first exception and report it with `sys.excepthook`. """
+  import ast
+  try:
+    for node in ast.parse(code,'<litrepl>').body:
+      exec(compile(ast.Interactive([node]),'<litrepl>','single'),g)
+  except SystemExit:
+    raise
+  except BaseException:
+    t,v,tb=sys.exc_info()
+    # Hide the frames of the agent and of the parser
+    while tb is not None and tb.tb_frame.f_code.co_filename!='<litrepl>':
+      tb=tb.tb_next
+    sys.excepthook(t,v.with_traceback(tb),tb)
+
+def main(exitcode=None)->None:
+  """ Serve the requests until the input pipe is closed. The Python streams
+  `sys.stdout` and `sys.stderr` send frames directly. The standard output and
+  error descriptors are redirected to pipes, so the output of the
+  sub-processes is framed, too: a thread forwards it while the code is
+  running. """
+  import io
+  from signal import (signal, pthread_sigmask, default_int_handler, SIGINT,
+                      SIG_BLOCK, SIG_SETMASK)
+  from threading import Thread, Lock
+  from select import select
+  fdin,fdout=os.dup(0),os.dup(1)
+  fd=os.open(os.devnull,os.O_RDONLY)
+  os.dup2(fd,0)
+  os.close(fd)
+  captures=[]
+  for kind,fd in [(FRAME_STDOUT,1),(FRAME_STDERR,2)]:
+    r,w=os.pipe()
+    os.dup2(w,fd)
+    os.close(w)
+    os.set_blocking(r,False)
+    captures.append((kind,r))
+  lock=Lock()
+
+  def _forward(fds)->None:
+    for kind,fd in fds:
+      while True:
+        try:
+          r=os.read(fd,FRAME_CHUNK)
+        except BlockingIOError:
+          break
+        write_all(fdout,frame(kind,r))
+
+  def _forwarder()->None:
+    while True:
+      ready=select([fd for _,fd in captures],[],[])[0]
+      with lock:
+        _forward([c for c in captures if c[1] in ready])
+
+  def _send(kind:bytes, payload:bytes)->None:
+    """ Send a frame, preceded by the output of the sub-processes, if any.
+    Interrupts would break the frames, so they are postponed. """
+    mask=pthread_sigmask(SIG_BLOCK,[SIGINT])
+    try:
+      with lock:
+        _forward(captures)
+        write_all(fdout,frame(kind,payload))
+    finally:
+      pthread_sigmask(SIG_SETMASK,mask)
+
+  class _Writer(io.RawIOBase):
+    def __init__(self, kind:bytes):
+      self.kind=kind
+    def writable(self)->bool:
+      return True
+    def write(self, b)->int:
+      _send(self.kind,bytes(b))
+      return len(b)
+
+  for name,kind in [('stdout',FRAME_STDOUT),('stderr',FRAME_STDERR)]:
+    stream=getattr(sys,name)
+    setattr(sys,name,io.TextIOWrapper(_Writer(kind),encoding=stream.encoding,
+                                      errors=stream.errors,write_through=True))
+  Thread(target=_forwarder,daemon=True).start()
+  signal(SIGINT,default_int_handler)
+  if exitcode is not None:
+    sys.excepthook=lambda *_: os._exit(exitcode)
+  sys.argv=['']
+  g=__import__('__main__').__dict__
+  while True:
+    try:
+      kind,n=FRAME.unpack(read_exact(fdin,FRAME.size))
+      nonce,code=read_exact(fdin,n).split(b'\n',1)
+    except EOFError:
+      break
+    try:
+      run(code.decode('utf-8',errors='replace'),g)
+    except KeyboardInterrupt:
+      pass
+    finally:
+      try:
+        _send(FRAME_DONE,nonce)
+      except KeyboardInterrupt:
+        pass
@@ -1,19 +1,24 @@
-from os import system
+from os.path import join, dirname
+from codeop import compile_command
 
 from ..types import LitreplArgs, EvalState, Interpreter
 from ..utils import fillspaces, runsocat
+from ..eval import eval_code_raw
+from .pyagent import frame, FRAME_EXEC
 
 PATTERN_PYTHON_1=('3256748426384\n',)*2
 PATTERN_PYTHON_2=('325674801010\n',)*2
+# Reads and runs the first input line which installs the agent
+PYAGENT_BOOTSTRAP='exec(__import__("sys").stdin.buffer.raw.readline())'
+PYAGENT_MARKER='litrepl-agent'
 
 class PythonInterpreter(Interpreter):
-  def run_child(self,interpreter)->int:
+  def child_cmd(self,interpreter)->str:
     fns=self.fns
-    ret=system(
+    return (
       f"exec {interpreter} -ui"
       f"<'{fns.inp}' >'{fns.outp}' 2>&1"
     )
-    return ret
   def setup_child(self, a, finp, foutp)->None:
     finp.write(
       '\nimport sys; sys.ps1=""; sys.ps2=""\n'
@@ -31,6 +36,11 @@ class PythonInterpreter(Interpreter):
       )
   def patterns(self):
     return PATTERN_PYTHON_1,PATTERN_PYTHON_2
+  def sentinel(self, nonce:int):
+    # The empty line closes the compound statement, if any. Otherwise, the
+    # interpreter reports a syntax error and drops the sentinel.
+    s=f"{PATTERN_PYTHON_2[0].strip()}{nonce}\n"
+    return ('\n'+s,s)
   def result_postprocess(self, a:LitreplArgs, text:str) -> str:
     return text
   def code_preprocess(self, a:LitreplArgs, es:EvalState, code:str) -> str:
@@ -38,3 +48,44 @@ class PythonInterpreter(Interpreter):
   def run_repl(self, a:LitreplArgs):
     runsocat(self.fns)
 
+
+class PythonFramedInterpreter(Interpreter):
+  """ Python interpreter running the agent of the framed protocol, see
+  `litrepl.interpreters.pyagent`, instead of the interactive loop. """
+  def child_cmd(self,interpreter)->str:
+    fns=self.fns
+    return (
+      f"exec {interpreter} -u -c '{PYAGENT_BOOTSTRAP}' {PYAGENT_MARKER}"
+      f"<'{fns.inp}' >'{fns.outp}' 2>&1"
+    )
+  def setup_child(self, a, finp, foutp)->None:
+    with open(join(dirname(__file__),'pyagent.py')) as f:
+      agent=f.read()+f"\nmain({a.exception_exitcode})\n"
+    # The bootstrap reads the input byte by byte until the newline, so the
+    # agent is sent as a single line and nothing is read past it.
+    finp.write(f"exec({agent!r},{{}})\n")
+    finp.flush()
+  def patterns(self):
+    return PATTERN_PYTHON_1,PATTERN_PYTHON_2
+  def frame(self, code:str, nonce:int)->bytes:
+    return frame(FRAME_EXEC,f"{nonce}\n{code}".encode())
+  def result_postprocess(self, a:LitreplArgs, text:str) -> str:
+    return text
+  def code_preprocess(self, a:LitreplArgs, es:EvalState, code:str) -> str:
+    return code
+  def run_repl(self, a:LitreplArgs):
+    print("Attaching to the interpreter (USE `Ctrl+D` TO DETACH)")
+    lines:list=[]
+    while True:
+      try:
+        lines.append(input('... ' if lines else '>>> '))
+        if compile_command('\n'.join(lines),'<stdin>','single') is None:
+          continue
+      except EOFError:
+        print()
+        break
+      except SyntaxError:
+        pass
+      rr,_=eval_code_raw(self,'\n'.join(lines),float('inf'),float('inf'))
+      print(rr.text,end='')
+      lines=[]
@@ -1,4 +1,3 @@
-from os import system
 
 from ..types import LitreplArgs, EvalState, Interpreter
 from ..utils import fillspaces, runsocat
@@ -7,17 +6,17 @@ PATTERN_1=('echo 3256748426384\n','3256748426384\n')
 PATTERN_2=('echo ASDSADQ231212\n','ASDSADQ231212\n')
 
 class ShellInterpreter(Interpreter):
-  def run_child(self,interpreter)->int:
+  def child_cmd(self,interpreter)->str:
     fns=self.fns
-    cmd=(f"PS1=\"\" PS2=\"\" exec {interpreter} "
-         f"<'{fns.inp}' >'{fns.outp}' 2>&1")
-    ret=system(cmd)
-    return ret
+    return (f"PS1=\"\" PS2=\"\" exec {interpreter} "
+            f"<'{fns.inp}' >'{fns.outp}' 2>&1")
   def setup_child(self, a, finp, foutp)->None:
     finp.write('\n')
     pass
   def patterns(self):
     return PATTERN_1,PATTERN_2
+  def sentinel(self, nonce:int):
+    return (f"{PATTERN_2[0].strip()}_{nonce}\n",f"{PATTERN_2[1].strip()}_{nonce}\n")
   def result_postprocess(self, a:LitreplArgs, text:str) -> str:
     return text
   def code_preprocess(self, a:LitreplArgs, es:EvalState, code:str) -> str:
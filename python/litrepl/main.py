@@ -1,12 +1,8 @@
-import litrepl
 import sys
-from litrepl import *
-from litrepl import __version__, eval_section_
 from os import chdir, getcwd, environ, isatty
-from subprocess import check_output, DEVNULL, CalledProcessError
-from argparse import ArgumentParser, HelpFormatter
-from tempfile import mkdtemp
+from argparse import ArgumentParser, HelpFormatter, Action, SUPPRESS
 from functools import partial
+from textwrap import dedent
 from typing import Optional
 
 LOCSHELP='(N|$|N..N)[,(...)] where N is either: [+|-]number,$,ROW:COL'
@@ -36,10 +32,21 @@ def _with_type(p, default=None, allow_all=False):
 def _ensure_nonepty(var:Optional[str])->Optional[str]:
   return var if (var is not None and len(var)>0) else None
 
+class VersionAction(Action):
+  """ Print the version. Unlike the `version` action, the version is only
+  determined when requested. """
+  def __init__(self, option_strings, dest=SUPPRESS, default=SUPPRESS, help=None):
+    super().__init__(option_strings=option_strings,dest=dest,default=default,
+                     nargs=0,help=help)
+  def __call__(self, parser, namespace, values, option_string=None):
+    from litrepl import __version__
+    print(__version__ or '?')
+    parser.exit()
+
 def make_parser():
   ap=ArgumentParser(prog='litrepl',
                     formatter_class=make_wide(HelpFormatter))
-  ap.add_argument('-v','--version',action='version',version=__version__ or '?',
+  ap.add_argument('-v','--version',action=VersionAction,
     help='Print version.')
   ap.add_argument('--filetype',metavar='STR',default='auto',
     help='Specify the type of input formatting (markdown|[la]tex|auto).')
@@ -66,6 +73,19 @@ def make_parser():
     Python interpreter command line, or `auto`. Defaults to the
     LITREPL_PYTHON_INTERPRETER environment variable if set, otherwise "auto".
     Litrepl determines "python" or "ipython" type according to the value.'''))
+  ap.add_argument('--python-protocol',choices=['repl','framed','kernel'],
+    default=_ensure_nonepty(environ.get('LITREPL_PYTHON_PROTOCOL','repl')),
+    help=dedent('''
+    Protocol of the Python sessions: `repl` drives the interactive loop of the
+    interpreter, `framed` installs an agent exchanging length-prefixed frames
+    with Litrepl. The latter executes whole code sections at once, does not
+    depend on the indentation hacks and detects the completion without
+    scanning the output. Requires a plain Python interpreter. `kernel` starts a
+    Jupyter kernel named by --python-interpreter ("auto" means "python3") and
+    talks the kernel messaging protocol using the `jupyter_client` package. It
+    is not a performance option, the kernel is usually slower than the
+    terminal IPython. Defaults to the LITREPL_PYTHON_PROTOCOL environment
+    variable if set, otherwise "repl".'''))
   ap.add_argument('--ai-interpreter',metavar='EXE',
     default=_ensure_nonepty(environ.get('LITREPL_AI_INTERPRETER','auto')),
     help=dedent('''
@@ -101,6 +121,24 @@ def make_parser():
     LITREPL_SH_AUXDIR if set; otherwise, it's created in the system's temporary
     directory, named after the current working directory. The above magic
     pattern notice applies.'''))
+  ap.add_argument('--parser',metavar='STR',
+    default=_ensure_nonepty(environ.get('LITREPL_PARSER','lark')),
+    help=dedent('''
+    Document parser to use: "lark" (grammar-based) or "scanner" (linear-time
+    marker scanner). Defaults to the value of LITREPL_PARSER if set,
+    otherwise "lark". The parsers agree on the documents which can be split
+    into sections in only one way. If several splits have the same total
+    section priority, the scanner prefers the top-level text to a section
+    starting at the same position, while the choice of Lark depends on its
+    internal ordering.'''))
+  ap.add_argument('--parser-cache',type=str,metavar='DIR',
+    default=_ensure_nonepty(environ.get('LITREPL_PARSER_CACHE')),
+    help=dedent('''
+    This directory stores compiled document parsers and the detected
+    capabilities of the `auto` Python interpreter. It defaults to
+    LITREPL_PARSER_CACHE if set; otherwise, it's created in the system's
+    temporary directory, named after the OS user identifier. Set to "-" to
+    disable the cache.'''))
   ap.add_argument('--timeout',type=str,metavar='F[,F]',default='inf',
     help=dedent('''
     Timeouts for initial evaluation and for pending checks, in
@@ -117,7 +155,17 @@ def make_parser():
   ap.add_argument('-d','--debug',type=int,metavar='INT',default=0,
     help="Enable (a lot of) debug messages.")
   ap.add_argument('-K','--keep-readout',action='store_true',
-    help='Do not delete temporary readout file (debugging).')
+    help='Do not delete temporary readout file (debugging). Implies '
+         '--readout-store=durable.')
+  ap.add_argument('--readout-store',choices=['shm','auxdir','durable'],
+    default=_ensure_nonepty(environ.get('LITREPL_READOUT_STORE')) or 'shm',
+    help=dedent('''
+    Where the interpreter responses are buffered while they are being read:
+    `shm` places the readout files into a private directory in /dev/shm (if it
+    exists, otherwise into the auxiliary directory), `auxdir` into the
+    auxiliary directory, `durable` into the auxiliary directory and writes them
+    synchronously. Defaults to the LITREPL_READOUT_STORE environment variable
+    if set, otherwise "shm".'''))
   ap.add_argument('--verbose',action='store_true',
     help='Be more verbose (used in status).')
   ap.add_argument('-C','--workdir',type=str,metavar='DIR',
@@ -143,6 +191,16 @@ def make_parser():
     help=dedent('''
     Start a separate session and stop it when the evaluation is
     done. All --*-auxdir settings are ignored in this mode.'''))
+  ap.add_argument('--pool-size',type=str,metavar='NUM',
+    default=_ensure_nonepty(environ.get('LITREPL_POOL_SIZE')),
+    help=dedent('''
+    Keep NUM idle interpreters of each class and interpreter command started in
+    the background. Starting sessions, including the --foreground ones, adopt
+    them instead of starting new interpreters. The interpreters are shared by
+    the sessions with the same working directory and environment; the `stop`
+    command stops them. Jupyter kernels are not pooled. Defaults to the
+    LITREPL_POOL_SIZE environment variable if set, otherwise 0 meaning no
+    pool.'''))
   ap.add_argument('--map-cursor',type=str,metavar='LINE:COL:FILE',default=None,
     help=dedent('''
     Calculate the new position of a cursor at LINE:COL and write
@@ -150,6 +208,40 @@ def make_parser():
   ap.add_argument('--result-textwidth',type=str,metavar='NUM',default=None,
     help=dedent('''
     Wrap result lines longer than NUM symbols.'''))
+  ap.add_argument('--result-max-bytes',type=str,metavar='NUM',
+    default=_ensure_nonepty(environ.get('LITREPL_RESULT_MAX_BYTES')),
+    help=dedent('''
+    Keep results within NUM bytes: the middle of a longer result is replaced
+    with a marker. Markdown sections override it with the
+    `result-max-bytes=NUM` attribute, e.g. ```{.python result-max-bytes=4096}.
+    Defaults to the LITREPL_RESULT_MAX_BYTES environment variable if set,
+    otherwise 0 meaning no limit.'''))
+  ap.add_argument('--result-max-lines',type=str,metavar='NUM',
+    default=_ensure_nonepty(environ.get('LITREPL_RESULT_MAX_LINES')),
+    help=dedent('''
+    Same as --result-max-bytes, but limits the number of lines. The section
+    attribute is `result-max-lines=NUM`, the environment variable is
+    LITREPL_RESULT_MAX_LINES.'''))
+  ap.add_argument('--result-spill',action='store_true',
+    help=dedent('''
+    Save the complete text of the limited results into the auxiliary
+    directory, in a file named after the text hash. The marker refers to the
+    file. The files stay in the auxiliary directory until it is removed. The
+    section attribute is `result-spill`.'''))
+  ap.add_argument('--result-encoding-errors',type=str,metavar='POLICY',
+    choices=['replace','backslashreplace','hexdump','strict'],
+    default=_ensure_nonepty(environ.get('LITREPL_RESULT_ENCODING_ERRORS')) or 'replace',
+    help=dedent('''
+    Presentation of the invalid UTF-8 bytes in the results: `replace` (the
+    default) shows them as U+FFFD, `backslashreplace` as `\\xNN` escapes,
+    `hexdump` as `<LitREPL: invalid bytes NN NN>` markers. `strict` replaces
+    the whole result with an error message. The environment variable is
+    LITREPL_RESULT_ENCODING_ERRORS.'''))
+  ap.add_argument('--batch',action='store_true',
+    help=dedent('''
+    Send the sections to be evaluated by the same interpreter in one batch,
+    rather than one by one. Sections with the same code, pending sections and
+    the interpreters without batch support are evaluated as usual.'''))
   sps=ap.add_subparsers(dest='command',help='Commands to execute')
   sstart=_with_type(sps.add_parser('start',
     help=dedent('''
@@ -196,6 +288,12 @@ def make_parser():
   _with_type(sps.add_parser('print-auxdir',
     help=dedent('''
     Print the auxdir for the given interpreter type.''')))
+  sps.add_parser('serve',
+    help=dedent('''
+    Serve the commands of the `litrepl` clients started in the current
+    directory, until interrupted. The server keeps the modules and the parsers
+    loaded, the clients only pass their arguments, environment and standard
+    streams.'''))
   tangle=sps.add_parser('tangle',
     help=dedent('''
     Tangle code and result sections by sending them to files or file handlers.'''))
@@ -209,11 +307,29 @@ def make_parser():
     help='Line to insert after result sections',nargs='?')
   return ap
 
-AP=make_parser()
+# The parser is built by the first `main` call
+AP:Optional[ArgumentParser]=None
 
 def main(args=None):
+  global AP
   args=args or sys.argv[1:]
+  if AP is None:
+    AP=make_parser()
   a=AP.parse_args(args)
+
+  # The modules are loaded after the arguments are parsed, so `--help` and
+  # `--version` do not load them. Lark and psutil are only loaded by the
+  # commands which need them, see `litrepl.base`.
+  import litrepl
+  from litrepl.types import SType, SecRec, EvalState, Interpreter, ResultLimits
+  from litrepl.utils import assert_
+  from litrepl.eval import (pstderr, eval_code, interp_exitcode,
+                            with_parent_finally, with_early_sigalarm,
+                            with_early_sigint)
+  from litrepl.base import (pdebug, attach, bmarker2st, failmsg, isdisabled,
+                            name2st, parse_, parse_maybe, pipenames, restart,
+                            running, solve_sloc, st2name, start, status, stop,
+                            pool_stop, eval_section_, tangle)
   if a.command is None:
     if isatty(sys.stdin.fileno()):
       pstderr("Usage: litrepl [ARGS..] COMMAND [ARGS..]. See --help for details.")
@@ -221,11 +337,12 @@ def main(args=None):
     else:
       a=AP.parse_args(args+['eval-sections'])
 
-  if a.debug>0:
-    litrepl.eval.DEBUG=True
-    litrepl.base.DEBUG=True
-    litrepl.utils.DEBUG=True
-    litrepl.interpreters.ipython.DEBUG=True
+  # Assigned in both directions, the children of `litrepl serve` inherit them
+  debug=a.debug>0
+  litrepl.eval.DEBUG=debug
+  litrepl.base.DEBUG=debug
+  litrepl.utils.DEBUG=debug
+  litrepl.interpreters.ipython.DEBUG=debug
 
   timeouts=a.timeout.split(',')
   assert_(len(timeouts) in {1,2}, f"invalid timeout value {timeouts}")
@@ -262,6 +379,13 @@ def main(args=None):
     if a.result_textwidth==0:
       a.result_textwidth=None # for vim-compatibility
 
+  a.pool_size=int(a.pool_size or 0)
+
+  a.result_limits=ResultLimits(int(a.result_max_bytes or 0),
+                               int(a.result_max_lines or 0),
+                               a.result_spill,
+                               a.result_encoding_errors)
+
   if a.map_cursor:
     line,col,output=a.map_cursor.split(":")
     a.map_cursor=(int(line),int(col))
@@ -280,6 +404,7 @@ def main(args=None):
       stop(a,st)
 
   if a.foreground:
+    from tempfile import mkdtemp
     assert_(a.command not in {'start','stop','restart','repl','interrupt'},
       f"--foreground is not compatible with '{a.command}' command")
     for st in [SType.SPython,SType.SAI,SType.SShell]:
@@ -293,6 +418,7 @@ def main(args=None):
     for st in SType:
       if a.type in {st2name(st),"all",None}:
         stop(a,st)
+        pool_stop(a,st)
   elif a.command=='restart':
     if a.type in {'all',None}:
       for st in SType:
@@ -306,13 +432,14 @@ def main(args=None):
     exit(0)
   elif a.command=='parse-print':
     sr0=SecRec(set(),{})
-    ecode=eval_section_(a,parse_(a).tree,sr0)
+    pr=parse_(a)
+    ecode=eval_section_(a,pr.tree,sr0,text=pr.text)
     exit(0 if ecode is None else ecode)
   elif a.command=='eval-sections':
     with with_early_sigalarm(), with_early_sigint():
-      t=parse_(a).tree
-      nsecs=solve_sloc(a.locs,t)
-      ecode=eval_section_(a,t,nsecs)
+      pr=parse_(a)
+      nsecs=solve_sloc(a.locs,pr.tree)
+      ecode=eval_section_(a,pr.tree,nsecs,text=pr.text)
     exit(0 if ecode is None else ecode)
   elif a.command=='repl':
     st=name2st(a.type)
@@ -329,10 +456,10 @@ def main(args=None):
     exit(0 if ecode is None else ecode)
   elif a.command=='interrupt':
     with with_early_sigalarm(), with_early_sigint():
-      tree=parse_(a).tree
-      sr=solve_sloc(a.locs,tree)
+      pr=parse_(a)
+      sr=solve_sloc(a.locs,pr.tree)
       sr.nsecs|=set(sr.preproc.pending.keys())
-      ecode=eval_section_(a,tree,sr,interrupt=True)
+      ecode=eval_section_(a,pr.tree,sr,interrupt=True,text=pr.text)
     exit(ecode)
   elif a.command=='eval-code':
     with with_early_sigalarm(), with_early_sigint():
@@ -356,14 +483,14 @@ def main(args=None):
       st=name2st(a.type)
       with with_parent_finally(partial(_foreground_stop,st)):
         start(a,st,restart=True)
-        ecode=status(a,t,[st],__version__)
+        ecode=status(a,t,[st],litrepl.__version__)
       exit(0 if ecode is None else ecode)
     else:
       sts=[]
       for st in SType:
         if a.type in {st2name(st),"all",None}:
           sts.append(st)
-      ecode=status(a,t,sts,__version__)
+      ecode=status(a,t,sts,litrepl.__version__)
       exit(0 if ecode is None else ecode)
   elif a.command=='print-regexp':
     s=parse_(a).symbols
@@ -386,6 +513,9 @@ def main(args=None):
     t=parse_(a).tree
     ecode=tangle(a,t)
     exit(0 if ecode is None else ecode)
+  elif a.command=='serve':
+    from litrepl.server import serve
+    exit(serve(a))
 
   else:
     pstderr(f'Unknown or invalid command: \"{a.command}\".')
@@ -0,0 +1,270 @@
+""" Linear-time document scanner. The scanner is an alternative to the Lark
+grammar, see `litrepl.base.grammar_`. It locates section markers using
+precompiled anchors and builds the same Lark tree, so the tree consumers work
+unchanged. """
+
+from re import compile as re_compile
+from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass
+from lark import Tree, Token, LarkError
+from lark.tree import Meta
+
+from .types import Symbols, LarkTree
+
+class ScanError(LarkError):
+  """ The document does not match the section grammar. """
+  pass
+
+@dataclass(frozen=True)
+class SnippetSpec:
+  """ Describes a section type: a begin marker, a body and an end marker. """
+  alias:str                         # Name of the `snippet` alternative
+  rule:str                          # Section rule name
+  begin:str                         # Begin marker rule name
+  body:str                          # Body rule name
+  end:str                           # End marker rule name
+  body_optional:bool                # Whether the body might be empty
+  priority:int                      # Grammar priority of the section rule
+
+# Item kinds, besides the indices of `SnippetSpec`s
+TEXT=-1
+INLINE=-2
+
+INLINE_RE=(r"(?P<inlinemarker>{inlinemarker})\{{(?P<inltext1>{inltext})?\}}"
+           r"(?P<spaces>[ \t\r\n]+)?(?P<obr>\{{)(?P<inltext2>{inltext})?(?P<cbr>\}})")
+INLINE_GROUPS=['inlinemarker','inltext1','spaces','obr','inltext2','cbr']
+INLTEXT_RE=r"[^{}]+(?:\{[^}]*\}[^{}]*)*"
+
+def _specs(filetype:str)->List[SnippetSpec]:
+  """ Return section types in the order of their grammar priority. """
+  if filetype in ["md","markdown"]:
+    return [
+      SnippetSpec('e_comsection','ignoresec','ignorebegin','ignoretext','ignoreend',False,2),
+      SnippetSpec('e_icodesection','codesec','codebegin','codetext','codeend',False,1),
+      SnippetSpec('e_icodesection','codesec','comcodebegin','codesectext','comcodeend',False,1),
+      SnippetSpec('e_ocodesection','resultsec','resultbegin','resulttext','resultend',False,1),
+      SnippetSpec('e_ocodesection','resultsec','comresultbegin','vertext','comresultend',False,1),
+    ]
+  elif filetype in ["tex","latex"]:
+    return [
+      SnippetSpec('e_comment','ignoresec','ignorebegin','ignoretext','ignoreend',True,2),
+      SnippetSpec('e_icodesection','codesec','codebegin','codetext','codeend',False,1),
+      SnippetSpec('e_icodesection','codesec','comcodebegin','comcodetext','comcodeend',False,1),
+      SnippetSpec('e_ocodesection','resultsec','resultbegin','resulttext','resultend',False,1),
+      SnippetSpec('e_ocodesection','resultsec','comresultbegin','comresulttext','comresultend',False,1),
+    ]
+  else:
+    raise ValueError(f"Unsupported filetype \"{filetype}\"")
+
+class Positions:
+  """ Translates character offsets into Lark-style line and column numbers.
+  Offsets are expected to be queried in mostly non-decreasing order, which
+  makes the overall cost linear in the document size. """
+  def __init__(self, text:str):
+    self.text,self.pos,self.line,self.col=text,0,1,1
+  def at(self, pos:int)->Tuple[int,int]:
+    if pos<self.pos:
+      self.line-=self.text.count('\n',pos,self.pos)
+      self.col=pos-self.text.rfind('\n',0,pos)
+    else:
+      nl=self.text.count('\n',self.pos,pos)
+      if nl>0:
+        self.line+=nl
+        self.col=pos-self.text.rfind('\n',self.pos,pos)
+      else:
+        self.col+=pos-self.pos
+    self.pos=pos
+    return self.line,self.col
+
+# Scanned document item: start, end, kind, priority and the marker positions.
+# Kind is either `TEXT`, `INLINE` or the index of the section `SnippetSpec`.
+ScanItem=Tuple[int,int,int,int,tuple]
+
+def _meta(line:int, column:int, start_pos:int,
+          end_line:int, end_column:int, end_pos:int)->Meta:
+  m=Meta()
+  m.line,m.column,m.start_pos=line,column,start_pos
+  m.end_line,m.end_column,m.end_pos=end_line,end_column,end_pos
+  m.empty=False
+  return m
+
+def _tokmeta(tok:Token)->Meta:
+  return _meta(tok.line,tok.column,tok.start_pos,
+               tok.end_line,tok.end_column,tok.end_pos)
+
+class Scanner:
+  """ Section scanner for the given `Symbols`. All the marker regexps are
+  compiled once per scanner. """
+  def __init__(self, symbols:Symbols, filetype:str):
+    s=symbols
+    self.filetype=filetype
+    self.specs=_specs(filetype)
+    self.markers={n:re_compile(getattr(s,n)) for n in [
+      'codebegin','codeend','comcodebegin','comcodeend','resultbegin',
+      'resultend','comresultbegin','comresultend','ignorebegin','ignoreend']}
+    if filetype in ["md","markdown"]:
+      toplevel=[s.codebegin,s.resultbegin,s.comresultbegin,s.ignorebegin,
+                s.comcodebegin]
+      self.inline=None
+    else:
+      toplevel=[s.codebegin,s.codeend,s.comcodebegin,s.comcodeend,
+                s.resultbegin,s.resultend,s.comresultbegin,s.comresultend,
+                s.ignorebegin,s.ignoreend,s.inlinemarker+r"\{"]
+      self.inline=re_compile(INLINE_RE.format(inlinemarker=s.inlinemarker,
+                                              inltext=INLTEXT_RE))
+    self.anchor=re_compile('|'.join(toplevel))
+    self.rules:Dict[str,Token]={}
+
+  def _rule(self, name:str)->Token:
+    t=self.rules.get(name)
+    if t is None:
+      t=self.rules[name]=Token('RULE',name)
+    return t
+
+  def _token(self, ps:Positions, name:str, start:int, end:int)->Token:
+    line,col=ps.at(start)
+    value=ps.text[start:end]
+    nl=value.count('\n',0,-1)
+    if nl>0:
+      eline,ecol=line+nl,end-1-ps.text.rfind('\n',start,end-1)
+    else:
+      eline,ecol=line,col+end-1-start
+    return Token(name.upper(),value,start,line,col,eline,ecol+1,end)
+
+  def _tree(self, data:str, children:list)->Tree:
+    """ Make a tree, propagating positions Lark-style: from the first and the
+    last children having them. """
+    ms=[c if isinstance(c,Token) else c.meta for c in children
+        if isinstance(c,Token) or not c.meta.empty]
+    if len(ms)==0:
+      return Tree(self._rule(data),children)
+    first,last=ms[0],ms[-1]
+    return Tree(self._rule(data),children,
+                _meta(first.line,first.column,first.start_pos,
+                      last.end_line,last.end_column,last.end_pos))
+
+  def _leaf(self, ps:Positions, name:str, start:int, end:int)->Tree:
+    tok=self._token(ps,name,start,end)
+    return Tree(self._rule(name),[tok],_tokmeta(tok))
+
+  def _filtered(self, ps:Positions, name:str, start:int, end:int)->Tree:
+    """ Make an empty tree for a rule whose only token is filtered out by
+    Lark, keeping the token's position. """
+    return Tree(self._rule(name),[],_tokmeta(self._token(ps,name,start,end)))
+
+  def _search(self, name:str, text:str, pos:int):
+    """ Find the first match of the `name` marker at or after `pos`. Queries
+    mostly come in increasing order, so the last answer is reused when it is
+    still valid. """
+    q,m=self.searches.get(name,(None,None))
+    if q is not None and q<=pos and (m is None or m.start()>=pos):
+      return m
+    m=self.markers[name].search(text,pos)
+    self.searches[name]=(pos,m)
+    return m
+
+  def choices(self, text:str, pos:int, prev_text:bool)->List[ScanItem]:
+    """ Return the possible document items starting at `pos`: the top-level
+    text first, then the sections in the grammar order. """
+    acc=[]
+    if not prev_text and pos<len(text):
+      m=self.anchor.search(text,pos+1)
+      acc.append((pos,m.start() if m else len(text),TEXT,0,()))
+    if pos>=len(text):
+      return acc
+    if self.anchor.match(text,pos):
+      for kind,spec in enumerate(self.specs):
+        mb=self.markers[spec.begin].match(text,pos)
+        if mb is None:
+          continue
+        b=mb.end()
+        # The body regexp allows the end marker at its very first character, so
+        # the section ends at the first end marker after that character.
+        ends=[self.markers[spec.end].match(text,b)] if spec.body_optional else []
+        ends.append(self._search(spec.end,text,b+1) if b<len(text) else None)
+        for me in ends:
+          if me is not None:
+            acc.append((pos,me.end(),kind,spec.priority,(b,me.start())))
+      if self.inline is not None:
+        mi=self.inline.match(text,pos)
+        if mi is not None:
+          acc.append((pos,mi.end(),INLINE,1,
+                      tuple(mi.span(g) for g in INLINE_GROUPS)))
+    return acc
+
+  def item_tree(self, ps:Positions, item:ScanItem)->Tree:
+    """ Build the Lark tree of a document item. """
+    start,end,kind,_,details=item
+    if kind==TEXT:
+      return self._leaf(ps,'topleveltext',start,end)
+    elif kind==INLINE:
+      spans=dict(zip(INLINE_GROUPS,details))
+      def _opt(name,group):
+        s,e=spans[group]
+        return Tree(self._rule(name),[]) if s<0 else self._leaf(ps,name,s,e)
+      children=[self._leaf(ps,'inlinemarker',*spans['inlinemarker']),
+                _opt('inltext','inltext1'),
+                _opt('spaces','spaces'),
+                self._filtered(ps,'obr',*spans['obr']),
+                _opt('inltext','inltext2'),
+                self._filtered(ps,'cbr',*spans['cbr'])]
+      t=self._tree('inlinecodesec',children)
+      return Tree('e_inline',[t],t.meta)
+    spec=self.specs[kind]
+    bend,estart=details
+    begin=self._leaf(ps,spec.begin,start,bend)
+    body=(self._leaf(ps,spec.body,bend,estart) if estart>bend else
+          Tree(self._rule(spec.body),[]))
+    t=self._tree(spec.rule,[begin,body,self._leaf(ps,spec.end,estart,end)])
+    return Tree(spec.alias,[t],t.meta)
+
+  def scan(self, text:str)->LarkTree:
+    """ Scan the document, return the Lark-compatible parse tree. Like Earley
+    parser, we pick the segmentation with the highest sum of section
+    priorities. Only the marker positions are visited, so the cost is linear
+    in the document size for all but degenerate documents. Unlike Earley, the
+    ties are resolved in the order of `choices`, so the top-level text wins
+    over a section starting at the same position. """
+    n=len(text)
+    self.searches={}
+    best:Dict[Tuple[int,bool],Optional[Tuple[int,Optional[ScanItem]]]]={}
+    items:List[ScanItem]=[]
+    start=(0,False)
+    stack=[start]
+    while stack:
+      st=stack[-1]
+      if st in best:
+        stack.pop()
+        continue
+      pos,prev_text=st
+      if pos>=n:
+        best[st]=(0,None)
+        stack.pop()
+        continue
+      cs=self.choices(text,pos,prev_text)
+      pending=[(c[1],c[2]==TEXT) for c in cs if (c[1],c[2]==TEXT) not in best]
+      if pending:
+        stack.extend(pending)
+        continue
+      res=None
+      for c in cs:
+        nxt=best[(c[1],c[2]==TEXT)]
+        if nxt is not None and (res is None or c[3]+nxt[0]>res[0]):
+          res=(c[3]+nxt[0],c)
+      best[st]=res
+      stack.pop()
+    if best[start] is None:
+      line,col=Positions(text).at(max((p for p,_ in best),default=0))
+      raise ScanError(f"Unable to scan the document near line {line} column {col}")
+    st=start
+    while st[0]<n:
+      c=best[st][1]
+      items.append(c)
+      st=(c[1],c[2]==TEXT)
+    ps=Positions(text)
+    return self._tree('start',[self.item_tree(ps,it) for it in items])
+
+def scan(text:str, symbols:Symbols, filetype:str)->LarkTree:
+  """ Scan the `text` document of the given `filetype` using the marker
+  `symbols`, see `litrepl.base.grammar_`. """
+  return Scanner(symbols,filetype).scan(text)
@@ -0,0 +1,200 @@
+""" The `litrepl serve` server. The server keeps the modules imported and the
+parsers compiled, and runs each command in a forked child. The client is the
+`litrepl` script: it passes the argument list, the working directory, the
+environment and its standard descriptors, then receives the pid of the child
+and its exit code. """
+
+import os
+import sys
+import marshal
+
+from os import environ, getuid, getcwd
+from os.path import join, dirname
+from typing import List, Tuple, Dict
+from select import select
+from signal import (signal, set_wakeup_fd, default_int_handler, SIGINT,
+                    SIGTERM, SIGCHLD, SIG_DFL)
+from socket import socket, AF_UNIX, SOCK_STREAM, recv_fds
+from struct import Struct
+from importlib import import_module
+
+from .types import LitreplArgs
+from .utils import remove_silent, hashdigest, assert_, isprivatedir
+from .base import grammar_, lark_parser, sloc_parser, pdebug
+
+SERVE_HEADER=Struct('>I') # The length of the request
+SERVE_REPLY=Struct('>i')  # The pid of the child, then its exit code
+SERVE_TIMEOUT_SEC=5.0
+
+def serve_sockname()->str:
+  """ The server socket of the current user and directory. The client script
+  computes the same name. The socket has a directory of its own, which must be
+  private, see `isprivatedir`. """
+  tmp=environ.get('TMPDIR') or environ.get('TEMP') or environ.get('TMP') or '/tmp'
+  return join(tmp,f"litrepl_{getuid()}_{hashdigest(getcwd())}_serve","serve.sock")
+
+def serve_envkey()->Tuple[Tuple[str,str],...]:
+  """ The part of the environment which the argument parser depends on. """
+  return tuple(sorted((k,v) for k,v in environ.items() if k.startswith('LITREPL_')))
+
+def serve_warmup(a:LitreplArgs)->None:
+  """ Compile the parsers, so the children find them in `PARSER_CACHE`. """
+  sloc_parser()
+  for ft in ['markdown','latex']:
+    g,_=grammar_(a,ft)
+    if a.parser=='lark':
+      lark_parser(a,g,propagate_positions=True)
+
+def serve_recv(conn:socket)->Tuple[dict,List[int]]:
+  """ Receive the request and the standard descriptors of the client. """
+  data,fds,_,_=recv_fds(conn,65536,3)
+  try:
+    assert_(len(fds)==3 and len(data)>=SERVE_HEADER.size, "Malformed request")
+    n,=SERVE_HEADER.unpack(data[:SERVE_HEADER.size])
+    buf=bytearray(data[SERVE_HEADER.size:])
+    while len(buf)<n:
+      r=conn.recv(n-len(buf))
+      assert_(len(r)>0, "Truncated request")
+      buf+=r
+    return marshal.loads(buf),fds
+  except Exception:
+    for fd in fds:
+      os.close(fd)
+    raise
+
+def serve_child(req:dict, fds:List[int], envkey)->int:
+  """ Run the command in the environment of the client. Return the exit code. """
+  for fd,fd2 in zip(fds,[0,1,2]):
+    os.dup2(fd,fd2)
+    os.close(fd)
+  sys.stdin=open(0,'r',closefd=False)
+  sys.stdout=open(1,'w',closefd=False)
+  sys.stderr=open(2,'w',closefd=False,errors='backslashreplace')
+  environ.clear()
+  environ.update(req['env'])
+  os.chdir(req['cwd'])
+  sys.argv=['litrepl']+req['argv']
+  m=import_module('litrepl.main')
+  if serve_envkey()!=envkey:
+    m.AP=m.make_parser()
+  try:
+    m.main(req['argv'])
+    ecode=0
+  except SystemExit as e:
+    if e.code is None or isinstance(e.code,int):
+      ecode=e.code or 0
+    else:
+      print(e.code,file=sys.stderr)
+      ecode=1
+  except KeyboardInterrupt:
+    ecode=128+SIGINT
+  except BaseException:
+    import traceback
+    traceback.print_exc()
+    ecode=1
+  for f in [sys.stdout,sys.stderr]:
+    try:
+      f.flush()
+    except OSError:
+      pass
+  return ecode
+
+def serve(a:LitreplArgs)->int:
+  """ Serve the clients until SIGINT or SIGTERM. Each request is run by a
+  child process, the exit code is sent to the client when the child is
+  reaped. """
+  sname=serve_sockname()
+  with socket(AF_UNIX,SOCK_STREAM) as s:
+    try:
+      s.connect(sname)
+      running=True
+    except OSError:
+      running=False
+  if running:
+    raise ValueError(f"The server is already running at \"{sname}\"")
+  serve_warmup(a)
+  envkey=serve_envkey()
+  os.makedirs(dirname(sname),mode=0o700,exist_ok=True)
+  assert_(isprivatedir(dirname(sname)),
+          f"\"{dirname(sname)}\" is not a private directory of the current user")
+  remove_silent(sname)
+  ls=socket(AF_UNIX,SOCK_STREAM)
+  ls.bind(sname)
+  os.chmod(sname,0o600)
+  ls.listen(64)
+  # SIGCHLD wakes up the `select` call via the wakeup pipe
+  wr,ww=os.pipe()
+  os.set_blocking(wr,False)
+  os.set_blocking(ww,False)
+  set_wakeup_fd(ww)
+  signal(SIGCHLD,lambda *_: None)
+  signal(SIGTERM,lambda *_: sys.exit(0))
+  clients:Dict[int,socket]={}
+  pdebug(f"serve: listening on {sname}")
+  try:
+    while True:
+      ready=select([ls,wr],[],[])[0]
+      if wr in ready:
+        try:
+          while len(os.read(wr,4096))>0:
+            pass
+        except BlockingIOError:
+          pass
+      while True:
+        try:
+          pid,status=os.waitpid(-1,os.WNOHANG)
+        except ChildProcessError:
+          break
+        if pid==0:
+          break
+        ecode=os.waitstatus_to_exitcode(status)
+        ecode=ecode if ecode>=0 else 128-ecode
+        pdebug(f"serve: child {pid} exits with {ecode}")
+        conn=clients.pop(pid,None)
+        if conn is not None:
+          with conn:
+            try:
+              conn.sendall(SERVE_REPLY.pack(ecode))
+            except OSError as err:
+              pdebug(f"serve: {err}")
+      if ls not in ready:
+        continue
+      conn,_=ls.accept()
+      try:
+        conn.settimeout(SERVE_TIMEOUT_SEC)
+        req,fds=serve_recv(conn)
+      except Exception as err:
+        pdebug(f"serve: failed to receive a request: {err}")
+        conn.close()
+        continue
+      pdebug(f"serve: request {req['argv']}")
+      sys.stdout.flush(); sys.stderr.flush()
+      pid=os.fork()
+      if pid==0:
+        ecode=1
+        try:
+          set_wakeup_fd(-1)
+          signal(SIGCHLD,SIG_DFL)
+          signal(SIGTERM,SIG_DFL)
+          signal(SIGINT,default_int_handler)
+          for s in [ls,conn]+list(clients.values()):
+            s.close()
+          os.close(wr)
+          os.close(ww)
+          ecode=serve_child(req,fds,envkey)
+        finally:
+          os._exit(ecode)
+      for fd in fds:
+        os.close(fd)
+      try:
+        conn.sendall(SERVE_REPLY.pack(pid))
+        clients[pid]=conn
+      except OSError as err:
+        pdebug(f"serve: {err}")
+        conn.close()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    ls.close()
+    remove_silent(sname)
+  return 0
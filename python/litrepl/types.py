@@ -1,9 +1,15 @@
 import re
-from typing import (Any, Set, List, Dict, Tuple, Callable, Optional, Iterable)
+from typing import (Any, Set, List, Dict, Tuple, Callable, Optional, Iterable,
+                    TYPE_CHECKING)
 from re import compile as re_compile
 from dataclasses import dataclass
 from enum import Enum
-from lark import ParseTree as LarkTree
+
+if TYPE_CHECKING:
+  from lark import ParseTree as LarkTree
+else:
+  # Lark is only loaded by the commands which parse documents
+  LarkTree=Any
 
 
 class LitreplException(Exception):
@@ -43,6 +49,15 @@ class RunResult:
   temporary file `fname`."""
   fname:FileName     # File where the output data is piped into
 
+@dataclass
+class ResultLimits:
+  """ Limits of the result text of a code section. Zero means no limit. """
+  max_bytes:int=0                   # Size of the result text
+  max_lines:int=0                   # Number of lines of the result text
+  spill:bool=False                  # Save the complete text into the auxdir
+  errors:str='replace'              # Presentation of invalid UTF-8, see
+                                    # `eval.TextDecoder`
+
 @dataclass
 class ReadResult:
   """ Result of reading from the readout job, as specified by a `RunResult`
@@ -71,6 +86,7 @@ class ParseResult:
   symbols:Symbols
   tree:LarkTree
   filetype:str
+  text:Optional[str]=None
 
 NSec=int
 CursorPos=Tuple[int,int]
@@ -87,6 +103,14 @@ class PrepInfo:
   def empty():
     return PrepInfo(0,{},{},{})
 
+@dataclass
+class InterpCaps:
+  """ Capabilities of a Python interpreter, see `base.probe_python`. """
+  version:str                       # Python version
+  ipython:Optional[str]             # IPython version, None if not importable
+  mtimes:Dict[str,int]              # Modification times of the interpreter and
+                                    # its site directories
+
 @dataclass
 class SecRec:
   """ Request for section evaluation in an input document. """
@@ -108,6 +132,10 @@ class FileNames:
   pidf:str                          # File containing current PID
   ecodef:str                        # File containing exit code
   emsgf:str                         # File containing last output
+  syncf:str                         # File containing the reader sync state
+  classf:str                        # File containing the interpreter class name
+  readoutd:str                      # Directory of the readout files
+  readout_sync:bool                 # Write the readout files synchronously
 
 
 SECVAR_RE = re_compile(r"(\^+ *R[0-9]+ *\^+)|(v+ *R[0-9]+ *v+)|(\>+ *R[0-9]+ *\<+)",
@@ -133,15 +161,16 @@ class Interpreter:
   """ Third-party interpreter base. Encodes the low-level POSIX API which
   Litrepl requires to start and manage the (possibly background) session. See
   the `litrepl.interpreters` submodule for implementations. """
+  poolable:bool=True # Can be pre-started by the pool, see `base.pool_adopt`
   def __init__(self, fns:FileNames)->None:
     """ Create the interpreter object, associated with certain files, as
     specified by `fns`."""
     self.fns=fns
-  def run_child(self, interpreter:str)->int:
-    """ Launch the interpreter process and wait for it to complete, then return
-    the system's exit code. This method should create only one child process.
-    Its stdin and stdout should be connected to pipes as described in
-    `self.fns`. """
+  def child_cmd(self, interpreter:str)->str:
+    """ Return the shell command launching the interpreter. The command should
+    `exec` the interpreter, so the shell process becomes the interpreter
+    process, see `base.run_child`. Its stdin and stdout should be connected to
+    pipes as described in `self.fns`. """
     raise NotImplementedError()
   def setup_child(self, args, finp:int, foutp:int)->None:
     """ Sets up the child process by sending interpreter-specific commands to
@@ -154,6 +183,17 @@ class Interpreter:
     evaluation requests, the second pair is used to determine the completion of
     the evaluation. """
     raise NotImplementedError()
+  def sentinel(self, nonce:int)->Tuple[str,str]:
+    """ Return a request-response pair which is unique for the given `nonce`.
+    The pairs mark the ends of the code sections evaluated in a batch.
+    Interpreters which do not support batches raise NotImplementedError. """
+    raise NotImplementedError()
+  def frame(self, code:str, nonce:int)->bytes:
+    """ Return the request frame evaluating the `code`. The interpreter
+    responds with the output frames followed by the completion frame carrying
+    the `nonce`, see `litrepl.interpreters.pyagent`. Interpreters which do not
+    talk the framed protocol raise NotImplementedError. """
+    raise NotImplementedError()
   def code_preprocess(self, a:LitreplArgs, es:EvalState, code:str) -> str:
     """ Preprocess a code section before sending it to the interpreter. Return
     the resulting code to be sent to the interpreter. """
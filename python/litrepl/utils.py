@@ -1,7 +1,9 @@
 from textwrap import dedent, wrap
 from re import match as re_match, compile as re_compile
-from typing import Iterable, List, Optional
-from os import unlink, system
+from typing import Iterable, List, Optional, TextIO, Union
+from os import unlink, system, writev, lstat, getuid
+from stat import S_ISDIR, S_IMODE
+from io import UnsupportedOperation
 from hashlib import sha256
 from .types import CursorPos, LitreplException
 
@@ -129,8 +131,19 @@ def runsocat(fns, hint=None):
   if hint is None:
     hint=SOCAT_HINT
   print(hint,end='')
+  remove_silent(fns.syncf)
   system(f"socat - 'PIPE:{fns.outp},flock-ex-nb=1!!PIPE:{fns.inp},flock-ex-nb=1'")
 
+def isprivatedir(d:str)->bool:
+  """ Check that `d` is a directory (not a symlink) owned by the current user
+  and not accessible by the others. A directory with a predictable name in the
+  shared temporary directory could be planted by another user. """
+  try:
+    st=lstat(d)
+  except OSError:
+    return False
+  return S_ISDIR(st.st_mode) and st.st_uid==getuid() and S_IMODE(st.st_mode)==0o700
+
 def hashdigest(x)->str:
   return sha256(str(x).encode('utf-8')).hexdigest()[:7]
 
@@ -139,3 +152,65 @@ def assert_(condition:bool, message:Optional[str]=None)->None:
   if not condition:
     raise LitreplException(message or "No message")
 
+IOV_MAX=1024
+
+def writev_all(fd:int, bufs:list)->None:
+  """ Write the byte buffers `bufs` to `fd`, resuming after partial writes. """
+  bufs=[b for b in bufs if len(b)>0]
+  while bufs:
+    n=writev(fd,bufs[:IOV_MAX])
+    i=0
+    while i<len(bufs) and n>=len(bufs[i]):
+      n-=len(bufs[i])
+      i+=1
+    bufs=bufs[i:]
+    if n>0:
+      bufs[0]=memoryview(bufs[0])[n:]
+
+class SpanWriter:
+  """ Write a copy of `text` with some of its spans replaced. Unchanged spans
+  are copied from the original by offset. For ASCII documents these are
+  slices of a single encoded buffer, written with `writev`. """
+  def __init__(self, text:str, out:TextIO):
+    self.text=text
+    self.out=out
+    self.pos=0
+    self.chunks:List[Union[str,bytes,memoryview]]=[]
+    try:
+      self.fd:Optional[int]=out.fileno()
+    except (AttributeError,UnsupportedOperation,ValueError):
+      self.fd=None
+    self.raw=memoryview(text.encode()) if self.fd is not None and text.isascii() else None
+
+  def _copy(self, end:int)->None:
+    if end>self.pos:
+      self.chunks.append((self.text if self.raw is None else self.raw)[self.pos:end])
+    self.pos=end
+
+  def replace(self, start:int, end:int, s:str)->None:
+    """ Write `s` in place of the original `text[start:end]`. Spans must be
+    replaced in order. """
+    assert_(self.pos<=start<=end, f"Span ({start},{end}) overlaps position {self.pos}")
+    self._copy(start)
+    if self.raw is None:
+      self.chunks.append(s)
+    else:
+      self.chunks.append(s.encode(self.out.encoding, self.out.errors or 'strict'))
+    self.pos=end
+    if len(self.chunks)>=IOV_MAX:
+      self.flush()
+
+  def flush(self)->None:
+    if self.raw is None:
+      for c in self.chunks:
+        self.out.write(c)
+    else:
+      self.out.flush()
+      writev_all(self.fd,self.chunks)
+    self.chunks=[]
+
+  def close(self)->None:
+    """ Write the rest of the original text. """
+    self._copy(len(self.text))
+    self.flush()
+
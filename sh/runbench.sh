@@ -0,0 +1,444 @@
+#!/bin/sh
+# Performance benchmarks. Unlike `runtests.sh`, benchmarks only report timings
+# and fail if the code under measure returns wrong results.
+
+readout_bench() {
+# Pipe $BENCH_SIZE_MB megabytes of lines followed by a prompt through `readout`.
+# The lines are either `plain` or `progress`-bar-like, as set by `$1`.
+$LITREPL_BENCH_PYTHON - "$BENCH_SIZE_MB" "$1" <<"EOF"
+import os, sys
+from time import time
+from litrepl.eval import readout, PromptMatcher, merge_rn2
+size=int(sys.argv[1])*1024*1024
+prompt='325674801010\n'
+if sys.argv[2]=='progress':
+  line=b''.join(b'\r%3d%%|' % p + b'#'*(p//10) for p in range(0,101,10))+b'\n'
+  kept=line[line.rindex(b'\r')+1:]
+else:
+  line=kept=b'0123456789'*10+b'\n'
+nlines=size//len(line)
+fdr,fdw=os.pipe()
+pid=os.fork()
+if pid==0:
+  os.close(fdr)
+  with os.fdopen(fdw,'wb') as f:
+    for _ in range(nlines):
+      f.write(line)
+    f.write(prompt.encode())
+  os._exit(0)
+os.close(fdw)
+t0=time()
+res=readout(fdr,prompt=PromptMatcher(prompt),merge=merge_rn2)
+t1=time()
+os.waitpid(pid,0)
+assert res.encode()==kept*nlines, len(res)
+mb=nlines*len(line)/2**20
+print(f"readout ({sys.argv[2]}): {mb:.0f} MB in {t1-t0:.2f} s ({mb/(t1-t0):.0f} MB/s)")
+EOF
+}
+
+bench_readout() {( #{{{
+# Read a large interpreter response, checking that the reading cost does not
+# depend on the amount of output already received.
+readout_bench plain
+)} #}}}
+
+bench_readout_progress() {( #{{{
+# Same as `bench_readout`, but every line is redrawn several times using `\r`.
+readout_bench progress
+)} #}}}
+
+bench_readout_asis() {( #{{{
+# Copy a large interpreter response to a file the way the forked reader does,
+# checking that the reader memory does not grow with the amount of output.
+$LITREPL_BENCH_PYTHON - "$BENCH_SIZE_MB" <<"EOF"
+import os, sys
+from time import time
+from resource import getrusage, RUSAGE_SELF
+from litrepl.eval import readout_asis, PromptMatcher
+size=int(sys.argv[1])*1024*1024
+prompt='325674801010\n'
+line=b'0123456789'*10+b'\n'
+nlines=size//len(line)
+fdr,fdw=os.pipe()
+pid=os.fork()
+if pid==0:
+  os.close(fdr)
+  with os.fdopen(fdw,'wb') as f:
+    for _ in range(nlines):
+      f.write(line)
+    f.write(prompt.encode())
+  os._exit(0)
+os.close(fdw)
+_,fdsync=os.pipe()
+fo=os.open(os.devnull,os.O_WRONLY)
+rss0=getrusage(RUSAGE_SELF).ru_maxrss
+t0=time()
+readout_asis(fdr,fdsync,fo,prompt,prompt=PromptMatcher(prompt))
+t1=time()
+rss1=getrusage(RUSAGE_SELF).ru_maxrss
+os.waitpid(pid,0)
+mb=nlines*len(line)/2**20
+print(f"readout_asis: {mb:.0f} MB in {t1-t0:.2f} s ({mb/(t1-t0):.0f} MB/s), "
+      f"max RSS grew by {(rss1-rss0)/1024:.1f} MB")
+assert rss1-rss0 < 32*1024, "The reader memory grows with the output"
+EOF
+)} #}}}
+
+bench_readout_store() {( #{{{
+# Copy a large interpreter response to a readout file the way the reader does,
+# for each of the readout stores. The `durable` and `auxdir` files are placed
+# into the temporary directory, like the default auxiliary directories.
+$LITREPL_BENCH_PYTHON - "$BENCH_SIZE_MB" <<"EOF"
+import os, sys
+from time import time
+from tempfile import TemporaryDirectory, gettempdir
+from litrepl.eval import readout_asis, readout_flags, PromptMatcher
+from litrepl.types import FileNames
+size=int(sys.argv[1])*1024*1024
+prompt='325674801010\n'
+line=b'0123456789'*10+b'\n'
+nlines=size//len(line)
+mb=nlines*len(line)/2**20
+for store,base,sync in [('shm','/dev/shm',False),
+                        ('auxdir',gettempdir(),False),
+                        ('durable',gettempdir(),True)]:
+  if not os.path.isdir(base):
+    continue
+  with TemporaryDirectory(dir=base) as d:
+    fns=FileNames(d,'','','','','','',d,sync)
+    fdr,fdw=os.pipe()
+    pid=os.fork()
+    if pid==0:
+      os.close(fdr)
+      with os.fdopen(fdw,'wb') as f:
+        for _ in range(nlines):
+          f.write(line)
+        f.write(prompt.encode())
+      os._exit(0)
+    os.close(fdw)
+    _,fdsync=os.pipe()
+    fo=os.open(os.path.join(d,'partial.txt'),readout_flags(fns))
+    t0=time()
+    readout_asis(fdr,fdsync,fo,prompt,prompt=PromptMatcher(prompt))
+    t1=time()
+    os.close(fo)
+    os.waitpid(pid,0)
+    assert os.stat(os.path.join(d,'partial.txt')).st_size>=nlines*len(line)
+  print(f"readout store ({store}): {mb:.0f} MB in {t1-t0:.2f} s "
+        f"({mb/(t1-t0):.0f} MB/s)")
+EOF
+)} #}}}
+
+bench_readout_cont() {( #{{{
+# Poll a growing readout file ten times, the way `process_cont` polls a pending
+# section, and report the cost of the last poll. The incremental polls only
+# merge the new output, the full re-reading is shown for comparison.
+$LITREPL_BENCH_PYTHON - "$BENCH_SIZE_MB" <<"EOF"
+import os, sys
+from time import time
+from tempfile import TemporaryDirectory
+from litrepl.eval import (readout, readout_merged, PromptMatcher, merge_rn2,
+                          merged_fname)
+size=int(sys.argv[1])*1024*1024
+prompt='325674801010\n'
+line=b''.join(b'\r%3d%%|' % p + b'#'*(p//10) for p in range(0,101,10))+b'\n'
+nsteps=10
+nlines=size//len(line)//nsteps
+mb=nlines*nsteps*len(line)/2**20
+with TemporaryDirectory() as d:
+  fname=os.path.join(d,'partial.txt')
+  fo=os.open(fname,os.O_WRONLY|os.O_CREAT)
+  fdr=os.open(fname,os.O_RDONLY)
+  for step in range(nsteps):
+    os.write(fo,line*nlines)
+    t0=time()
+    res=readout_merged(fname,fdr,PromptMatcher(prompt))
+    t1=time()
+    os.lseek(fdr,0,os.SEEK_SET)
+    full=readout(fdr,prompt=PromptMatcher(prompt),merge=merge_rn2)
+    t2=time()
+    assert res==full, (len(res),len(full))
+  assert os.path.isfile(merged_fname(fname))
+print(f"readout_cont: {mb:.0f} MB in {nsteps} polls, the last poll takes "
+      f"{t1-t0:.2f} s ({t2-t1:.2f} s when re-reading the whole file)")
+EOF
+)} #}}}
+
+bench_eval_sections() {( #{{{
+# Evaluate a document with many short code sections using the `python` (with
+# both protocols), `ipython` and Jupyter kernel (if available) and `sh`
+# interpreters, one by one and in a batch.
+# The document is parsed by the scanner to keep the parsing time low.
+$LITREPL_BENCH_PYTHON - "$LITREPL_ROOT/python/bin/litrepl" <<"EOF"
+import sys
+from time import time
+from shutil import which
+from importlib.util import find_spec
+from subprocess import run
+from tempfile import TemporaryDirectory
+n=200
+backends=[('python','python','print({})',[]),
+          ('python','python','print({})',['--python-protocol=framed']),
+          ('ipython','python','print({})',[]),
+          ('python3','python','print({})',['--python-protocol=kernel']),
+          ('/bin/sh','sh','echo {}',[])]
+for interpreter,cls,stmt,opts in backends:
+  if which(interpreter) is None or \
+     ('--python-protocol=kernel' in opts and find_spec('jupyter_client') is None):
+    print(f"eval-sections {' '.join(opts+[''])}({interpreter}): not available")
+    continue
+  litrepl=[sys.executable,sys.argv[1],f'--{cls}-interpreter={interpreter}',
+           '--parser=scanner']+opts
+  doc=''.join(f"```{cls}\n{stmt.format(i)}\n```\n```result\n```\n"
+              for i in range(n))
+  for mode in [[],['--batch']]:
+    with TemporaryDirectory() as d:
+      run(litrepl+['start',cls],cwd=d,check=True)
+      try:
+        t0=time()
+        out=run(litrepl+mode+['--filetype=markdown','eval-sections'],cwd=d,
+                input=doc.encode(),capture_output=True,check=True).stdout.decode()
+        t1=time()
+      finally:
+        run(litrepl+['stop',cls],cwd=d)
+    for i in range(n):
+      assert f"```result\n{i}\n```" in out, (interpreter,mode,i)
+    print(f"eval-sections {' '.join(mode+opts+[''])}({interpreter}): {n} sections "
+          f"in {t1-t0:.2f} s ({(t1-t0)/n*1000:.0f} ms per section)")
+EOF
+)} #}}}
+
+bench_serve() {( #{{{
+# Run a trivial `eval-sections` command many times, starting a new Litrepl
+# process each time, then sending the same command to `litrepl serve`.
+$LITREPL_BENCH_PYTHON - "$LITREPL_ROOT/python/bin/litrepl" <<"EOF"
+import os, sys
+from os.path import exists
+from time import time, sleep
+from subprocess import run, Popen
+from tempfile import TemporaryDirectory
+from litrepl.server import serve_sockname
+n=20
+doc="```python\nprint(42)\n```\n```result\n```\n"
+litrepl=[sys.executable,sys.argv[1],'--python-interpreter=python',
+         '--filetype=markdown']
+def _evals():
+  t0=time()
+  for i in range(n):
+    out=run(litrepl+['eval-sections'],input=doc.encode(),
+            capture_output=True,check=True).stdout.decode()
+    assert "```result\n42\n```" in out, out
+  return (time()-t0)/n
+with TemporaryDirectory() as d:
+  os.chdir(d)
+  try:
+    run(litrepl+['start','python'],check=True)
+    t_direct=_evals()
+    server=Popen(litrepl+['serve'])
+    try:
+      while not exists(serve_sockname()):
+        assert server.poll() is None, "The server has failed to start"
+        sleep(0.1)
+      t_serve=_evals()
+    finally:
+      server.terminate()
+      server.wait()
+  finally:
+    run(litrepl+['stop'])
+print(f"eval-sections: {t_direct*1000:.0f} ms per command, "
+      f"{t_serve*1000:.0f} ms per command with `litrepl serve`")
+EOF
+)} #}}}
+
+bench_interp_exit() {( #{{{
+# Run a code section that makes the interpreter exit and report the time of
+# the `eval-code` command, compared to a section that leaves it running. The
+# difference is the cost of detecting the exit and reading the exit code.
+$LITREPL_BENCH_PYTHON - "$LITREPL_ROOT/python/bin/litrepl" <<"EOF"
+import os, sys
+from time import time
+from subprocess import run
+from tempfile import TemporaryDirectory
+n=10
+litrepl=[sys.executable,sys.argv[1],'--python-interpreter=python']
+def _eval(code:str, ecode:int)->float:
+  run(litrepl+['restart','python'],check=True,capture_output=True)
+  t0=time()
+  p=run(litrepl+['eval-code','python'],input=code.encode(),capture_output=True)
+  t=time()-t0
+  assert p.returncode==ecode, (p.returncode,p.stderr)
+  return t
+with TemporaryDirectory() as d:
+  os.chdir(d)
+  try:
+    t_ok=sum(_eval("print(42)\n",0) for _ in range(n))/n
+    t_exit=sum(_eval("import os; os._exit(3)\n",3) for _ in range(n))/n
+  finally:
+    run(litrepl+['stop'])
+print(f"eval-code: {t_ok*1000:.0f} ms, {t_exit*1000:.0f} ms if the interpreter "
+      f"exits")
+EOF
+)} #}}}
+
+bench_start() {( #{{{
+# Restart the `python` (with both protocols), `ipython`, Jupyter kernel (if
+# available) and `sh` interpreters several times and report the average
+# start-up latency of each class.
+$LITREPL_BENCH_PYTHON - "$LITREPL_ROOT/python/bin/litrepl" <<"EOF"
+import sys
+from time import time
+from shutil import which
+from importlib.util import find_spec
+from subprocess import run
+from tempfile import TemporaryDirectory
+n=10
+backends=[('python','python',[]),
+          ('python','python',['--python-protocol=framed']),
+          ('ipython','python',[]),
+          ('python3','python',['--python-protocol=kernel']),
+          ('/bin/sh','sh',[])]
+for interpreter,cls,opts in backends:
+  if which(interpreter) is None or \
+     ('--python-protocol=kernel' in opts and find_spec('jupyter_client') is None):
+    print(f"start {' '.join(opts+[''])}({interpreter}): not available")
+    continue
+  litrepl=[sys.executable,sys.argv[1],f'--{cls}-interpreter={interpreter}']+opts
+  with TemporaryDirectory() as d:
+    try:
+      t0=time()
+      for i in range(n):
+        run(litrepl+['restart',cls],cwd=d,check=True,capture_output=True)
+      t1=time()
+      out=run(litrepl+['eval-code',cls],cwd=d,input=b'echo 42\n' if cls=='sh'
+              else b'print(42)\n',capture_output=True,check=True).stdout
+      assert out.strip()==b'42', out
+    finally:
+      run(litrepl+['stop',cls],cwd=d)
+  print(f"start {' '.join(opts+[''])}({interpreter}): "
+        f"{(t1-t0)/n*1000:.0f} ms per start")
+EOF
+)} #}}}
+
+bench_pool() {( #{{{
+# Evaluate a document with `--foreground` several times, with and without the
+# interpreter pool, and report the average time per document. The documents are
+# evaluated back-to-back, when the pool is refilled concurrently with the
+# evaluation, and with a pause, when the refill is complete.
+$LITREPL_BENCH_PYTHON - "$LITREPL_ROOT/python/bin/litrepl" <<"EOF"
+import sys
+from time import time, sleep
+from subprocess import run
+from tempfile import TemporaryDirectory
+n=10
+docs={'python':"```python\nprint(42)\n```\n```result\n```\n",
+      'sh':"```sh\necho 42\n```\n```result\n```\n"}
+for cls,doc in docs.items():
+  for pause in [0,1]:
+    for size in [0,1,2]:
+      litrepl=[sys.executable,sys.argv[1],f'--pool-size={size}',
+               '--filetype=markdown']
+      with TemporaryDirectory() as d:
+        try:
+          t=0.0
+          for i in range(n):
+            t0=time()
+            out=run(litrepl+['--foreground','eval-sections'],cwd=d,
+                    input=doc.encode(),capture_output=True,check=True).stdout
+            t+=time()-t0
+            assert b'\n42\n' in out, out
+            sleep(pause)
+        finally:
+          run(litrepl+['stop'],cwd=d)
+      print(f"--foreground {cls}, pool size {size}, {pause} s pause: "
+            f"{t/n*1000:.0f} ms per document")
+EOF
+)} #}}}
+
+bench_import_time() {( #{{{
+# Report the import time of the modules (`-X importtime`) for several commands,
+# the best of ten runs. The lazy loading is checked by `test_lazy_imports`.
+$LITREPL_BENCH_PYTHON - "$LITREPL_ROOT/python/bin/litrepl" <<"EOF"
+import re, sys
+from subprocess import run
+from tempfile import TemporaryDirectory
+doc="```python\nprint(42)\n```\n"
+with TemporaryDirectory() as d:
+  for args in [['--version'],['print-auxdir','python'],
+               ['--filetype=markdown','parse-print']]:
+    best=None
+    for _ in range(10):
+      err=run([sys.executable,'-X','importtime',sys.argv[1]]+args,cwd=d,
+              input=doc.encode(),capture_output=True,check=True).stderr.decode()
+      t=sum(int(m.group(1)) for m in
+            re.finditer(r'^import time: +\d+ \| +(\d+) \| \S',err,re.M))
+      best=t if best is None else min(best,t)
+    print(f"import time ({' '.join(args)}): {best/1000:.0f} ms")
+EOF
+)} #}}}
+
+benchmarks() {
+  echo bench_readout
+  echo bench_readout_progress
+  echo bench_readout_asis
+  echo bench_readout_store
+  echo bench_readout_cont
+  echo bench_eval_sections
+  echo bench_serve
+  echo bench_interp_exit
+  echo bench_start
+  echo bench_pool
+  echo bench_import_time
+}
+
+usage() {
+cat <<EOF
+Usage: runbench.sh [-b B] [-s MB] [-p P]
+Arguments:
+  -b B, --benchmarks=B      Run benchmarks whose names match the grep expression B
+                            Run -b '?' to list all available benchmarks
+  -s MB, --size=MB          Size of the generated interpreter output (default: 100)
+  -p P, --python=P          Use this Python interpreter to run the benchmarks
+
+Examples:
+  runbench.sh -b readout -s 10
+EOF
+}
+
+set -e
+
+BENCHMARKS='.*'
+BENCH_SIZE_MB=100
+LITREPL_BENCH_PYTHON=python
+while test -n "$1" ; do
+  case "$1" in
+    --benchmarks=*) BENCHMARKS=$(echo "$1" | sed 's/.*=//g') ;;
+    -b|--benchmarks) BENCHMARKS="$2"; shift ;;
+    --size=*) BENCH_SIZE_MB=$(echo "$1" | sed 's/.*=//g') ;;
+    -s|--size) BENCH_SIZE_MB="$2"; shift ;;
+    --python=*) LITREPL_BENCH_PYTHON=$(echo "$1" | sed 's/.*=//g') ;;
+    -p|--python) LITREPL_BENCH_PYTHON="$2"; shift ;;
+    -h|--help) usage ; exit 1 ;;
+  esac
+  shift
+done
+
+if test "$BENCHMARKS" = "?" ; then
+  benchmarks
+  exit 1
+fi
+
+if test -z "$LITREPL_ROOT" ; then
+  export LITREPL_ROOT=`pwd`
+fi
+export PYTHONPATH="$LITREPL_ROOT/python${PYTHONPATH:+:$PYTHONPATH}"
+
+trap "echo FAIL\(\$?\)" EXIT
+for b in $(benchmarks) ; do
+  if echo "$b" | grep -q -E "$BENCHMARKS" ; then
+    echo "Running benchmark \"$b\""
+    $b
+  fi
+done
+trap "" EXIT
+echo OK
@@ -1500,10 +1500,1024 @@ EOF
 test_debug() {( #{{{
 mktest "_test_debug"
 
-runlitrepl --debug=1 2>&1 | grep -q 'eval_code'
+runlitrepl --debug=1 </dev/null 2>&1 | grep -q 'eval_code'
 
 )} #}}}
 
+test_parser_cache() {( #{{{
+mktest "_test_parser_cache"
+cat >source.md <<"EOF"
+``` python
+print("Hello")
+```
+EOF
+runlitrepl --parser-cache=cache --debug=1 parse <source.md >out1.txt 2>&1
+grep -q 'parser cache miss' out1.txt
+not grep -q 'parser.cache.hit' out1.txt
+runlitrepl --parser-cache=cache --debug=1 parse <source.md >out2.txt 2>&1
+grep -q 'parser.cache.hit' out2.txt
+not grep -q 'parser.cache.miss' out2.txt
+for f in cache/parser_*.pickle ; do
+  echo "garbage" >"$f"
+done
+runlitrepl --parser-cache=cache --debug=1 parse <source.md >out3.txt 2>&1
+grep -q 'parser cache miss' out3.txt
+runlitrepl --parser-cache=cache --verbose status </dev/null >status.txt || true
+grep -q "parser cache: cache (hits: 1, misses: 0)" status.txt
+runlitrepl --parser-cache=- --debug=1 parse <source.md >out4.txt 2>&1
+not grep -q 'parser.cache.hit' out4.txt
+)} #}}}
+
+test_parser_scanner() {( #{{{
+mktest "_test_parser_scanner"
+cmp_parsers() {
+  cat >"source.$1"
+  runlitrepl --parser=lark --filetype=$2 parse <"source.$1" >lark.txt
+  runlitrepl --parser=scanner --filetype=$2 parse <"source.$1" >scanner.txt
+  diff -u lark.txt scanner.txt
+  runlitrepl --parser=scanner --filetype=$2 parse-print <"source.$1" >parsed.txt
+  diff -u "source.$1" parsed.txt
+}
+cmp_parsers md markdown <<"EOF"
+AAA
+```python
+print("Hello")
+```
+```lresult
+Hello
+```
+<!--lignore-->
+```python
+print("ignored")
+```
+<!--lnoignore-->
+* <!--lresult-->
+  BLABLA
+  <!--lnoresult-->
+<!--ai-->
+AI MESSAGE
+<!--noai-->
+``` {.python}
+x=1
+```
+EOF
+cmp_parsers tex latex <<"EOF"
+\begin{lpython}
+print("Hello")
+\end{lpython}
+\begin{lresult}
+Hello
+\end{lresult}
+%lignore
+\begin{lpython}
+print("ignored")
+\end{lpython}
+%lnoignore
+Inline \linline{1+1}{2} and \linline{2+2} {}
+%lpython
+%print("comment")
+%lnopython
+%lresult
+%lnoresult
+EOF
+printf 'A\n```python\n' >unclosed.md
+not runlitrepl --parser=scanner --filetype=markdown parse <unclosed.md
+# Two splits of the same priority: Lark picks a `<!--result-->` section, the
+# scanner keeps the text and picks the code section following it
+printf '```<!--lnoignore-->\n```result\n<!--result-->\n```<!--result-->\n```python\n<!--lignore-->\n<!--litrepl-->\n<!--result-->\n```result\n<!--noresult-->\n ' >tie.md
+runlitrepl --parser=lark --filetype=markdown parse <tie.md >lark.txt
+runlitrepl --parser=scanner --filetype=markdown parse <tie.md >scanner.txt
+grep -q 'codebegin' scanner.txt
+not grep -q 'comresultbegin' scanner.txt
+runlitrepl --parser=scanner --filetype=markdown parse-print <tie.md >parsed.txt
+diff -u tie.md parsed.txt
+)} #}}}
+
+test_filetype_sniff() {( #{{{
+mktest "_test_filetype_sniff"
+nparses() {
+  runlitrepl --debug=1 "$@" 2>&1 >/dev/null | \
+    grep -E 'parser.cache.(hit|miss)' | wc -l | tr -d ' '
+}
+cat >source.md <<"EOF"
+```python
+print("Hello")
+```
+EOF
+cat >source.tex <<"EOF"
+\begin{lpython}
+print("Hello")
+\end{lpython}
+EOF
+cat >mixed.md <<"EOF"
+```python
+print("Hello")
+```
+\begin{lpython}
+print("Hello")
+\end{lpython}
+EOF
+test "$(nparses --parser-cache=- parse <source.md)" = "1"
+test "$(nparses --parser-cache=- parse <source.tex)" = "1"
+test "$(nparses --parser-cache=- parse <mixed.md)" = "2"
+runlitrepl parse <source.md >auto.txt
+runlitrepl --filetype=markdown parse <source.md >md.txt
+diff -u md.txt auto.txt
+runlitrepl parse <source.tex >auto.txt
+runlitrepl --filetype=latex parse <source.tex >tex.txt
+diff -u tex.txt auto.txt
+export LITREPL_FILE=mixed.md
+runlitrepl --parser-cache=cache parse <mixed.md >/dev/null
+grep -q markdown cache/filetype_*.txt
+test "$(nparses --parser-cache=cache parse <mixed.md)" = "1"
+)} #}}}
+
+test_eval_cursors() {( #{{{
+mktest "_test_eval_cursors"
+runlitrepl start python
+cat >source.md <<"EOF"
+``` python
+print("A")
+```
+``` result
+```
+Text
+``` python
+print("B")
+```
+``` result
+```
+EOF
+locs="$(seq 500 | sed 's/.*/8:2/' | tr '\n' ',')6:1"
+runlitrepl --filetype=markdown eval-sections "$locs" <source.md >out1.md
+grep -q "^B" out1.md
+not grep -q "^A" out1.md
+runlitrepl --filetype=markdown eval-sections '5:1,6:1' <source.md >out2.md
+grep -q "^A" out2.md
+not grep -q "^B" out2.md
+)} #}}}
+
+test_eval_spans() {( #{{{
+mktest "_test_eval_spans"
+runlitrepl start python
+for i in $(seq 0 299) ; do
+  printf 'Text %s\n```python\nprint("R%s")\n```\n```result\nstale\n```\n' "$i" "$i"
+done >source.md
+sed '/^print("R150")$/,/^stale$/s/^stale$/R150/' source.md >expected.md
+runlitrepl --filetype=markdown parse-print <source.md >out0.md
+diff -u source.md out0.md
+runlitrepl --filetype=markdown eval-sections 151 <source.md >out1.md
+diff -u expected.md out1.md
+sed 's/^Text /Tëxt /' source.md >source2.md
+sed 's/^Text /Tëxt /' expected.md >expected2.md
+runlitrepl --filetype=markdown eval-sections 151 <source2.md >out2.md
+diff -u expected2.md out2.md
+cat >source.tex <<"EOF"
+\linline{1+1}{old} text
+\begin{lpython}
+print("hi")
+\end{lpython}
+%lresult
+stale
+%lnoresult
+\linline{2+2}{old}
+EOF
+runlitrepl --filetype=latex eval-sections 1 <source.tex >out.tex
+diff -u - out.tex <<"EOF"
+\linline{1+1}{old} text
+\begin{lpython}
+print("hi")
+\end{lpython}
+%lresult
+hi
+%lnoresult
+\linline{2+2}{4}
+EOF
+)} #}}}
+
+test_eval_large_output() {( #{{{
+mktest "_test_eval_large_output"
+runlitrepl start python
+cat >source.md <<"EOF"
+```python
+for i in range(100000):
+  print(f"line {i:06d}")
+```
+```result
+```
+EOF
+runlitrepl --filetype=markdown --result-textwidth=0 eval-sections <source.md >out.md
+test "$(grep -c '^line ' out.md)" = "100000"
+grep -q '^line 099999$' out.md
+)} #}}}
+
+test_eval_rn_chunks() {( #{{{
+# Terminal-like output, arriving in random chunks, must be merged the same way
+# as if it arrived at once. The reference is the original per-byte `merge_rn2`.
+mktest "_test_eval_rn_chunks"
+runlitrepl start python
+cat >code.py <<EOF
+import random, sys
+
+def old_merge_rn2(buf_,r,i_n=-1):
+  buf=buf_
+  sz=len(buf)
+  i_n=-(sz-i_n)
+  start=0
+  for i in range(len(r)):
+    if r[i]==10:
+      i_n=i
+      buf+=r[start:i+1]
+      start=i+1
+    elif r[i]==13:
+      if i_n<0:
+        buf=buf[:sz+i_n+1]
+        sz=len(buf)
+        i_n=-1
+      start=i+1
+  buf+=r[start:]
+  return buf
+
+random.seed(7)
+frags=[b'a',b'bc',b'xyz',b'\n',b'\r',b'\r\n',b'\n\n',b'\r\r']
+data=b''.join(random.choice(frags) for _ in range(30000))+b'\n'
+with open("$(pwd)/expected.txt","wb") as f:
+  _=f.write(old_merge_rn2(b'',data))
+
+pos=0
+while pos<len(data):
+  n=random.randint(1,3000)
+  _=sys.stdout.buffer.write(data[pos:pos+n])
+  sys.stdout.flush()
+  pos+=n
+
+EOF
+runlitrepl eval-code python <code.py >out.txt
+cmp expected.txt out.txt
+)} #}}}
+
+test_reader_daemon() {( #{{{
+mktest "_test_reader_daemon"
+rl() { runlitrepl --python-auxdir="$(pwd)/aux" "$@" ; }
+rl start python
+echo 'print("A")' | rl eval-code python >out.txt
+grep -q '^A$' out.txt
+test -S aux/reader.sock
+rl restart python
+echo 'print("B")' | rl eval-code python >out.txt
+grep -q '^B$' out.txt
+rl stop python
+for i in $(seq 30) ; do
+  test -S aux/reader.sock || break
+  sleep 0.1
+done
+not test -S aux/reader.sock
+)} #}}}
+
+test_reader_sync() {( #{{{
+# The reader skips the sync after clean jobs. A slow section makes it re-send
+# the prompt pattern, so the following section must not skip the sync.
+mktest "_test_reader_sync"
+rl() { runlitrepl --python-auxdir="$(pwd)/aux" "$@" ; }
+rl start python
+cat >source.md <<"EOF"
+```python
+from time import sleep
+sleep(4)
+print("A")
+```
+```result
+```
+```python
+print("B")
+```
+```result
+```
+```python
+print("C")
+```
+```result
+```
+EOF
+cat source.md | rl --filetype=markdown eval-sections >out.md
+cat >out.expected <<"EOF"
+```python
+from time import sleep
+sleep(4)
+print("A")
+```
+```result
+A
+```
+```python
+print("B")
+```
+```result
+B
+```
+```python
+print("C")
+```
+```result
+C
+```
+EOF
+diff -u out.md out.expected
+test -f aux/sync.txt
+echo 'print("D")' | rl eval-code python >out.txt
+grep -q '^D$' out.txt
+rl stop python
+)} #}}}
+
+test_eval_batch() {( #{{{
+mktest "_test_eval_batch"
+runlitrepl start python
+runlitrepl start sh
+cat >source.md <<"EOF"
+```python
+print("A")
+```
+```result
+```
+```sh
+echo X
+```
+```result
+```
+```python
+from time import sleep
+sleep(2)
+print("B")
+```
+```result
+```
+```python
+print("C")
+```
+```result
+```
+```sh
+echo X
+```
+```result
+```
+EOF
+cat source.md | runlitrepl --batch --filetype=markdown --timeout=0.5,inf \
+  eval-sections >out1.md
+grep -q '^A$' out1.md
+test "$(grep -c '^X$' out1.md)" = "2"
+test "$(grep -c 'LR:' out1.md)" = "2"
+cat out1.md | runlitrepl --batch --filetype=markdown eval-sections '3,4' >out2.md
+cat >out.expected <<"EOF"
+```python
+print("A")
+```
+```result
+A
+```
+```sh
+echo X
+```
+```result
+X
+```
+```python
+from time import sleep
+sleep(2)
+print("B")
+```
+```result
+B
+```
+```python
+print("C")
+```
+```result
+C
+```
+```sh
+echo X
+```
+```result
+X
+```
+EOF
+diff -u out2.md out.expected
+)} #}}}
+
+test_eval_code_compound() {( #{{{
+# A compound statement without the trailing newline must not swallow the
+# completion sentinel.
+mktest "_test_eval_code_compound"
+runlitrepl start python
+printf 'def f():\n  return 42' | runlitrepl eval-code python >out1.txt
+not grep -q 'Error' out1.txt
+printf 'print(f())' | runlitrepl eval-code python >out2.txt
+grep -q '^42$' out2.txt
+)} #}}}
+
+test_eval_framed() {( #{{{
+# Python sessions running the framed protocol agent.
+mktest "_test_eval_framed"
+export LITREPL_PYTHON_PROTOCOL=framed
+runlitrepl start python
+runlitrepl status python </dev/null | grep -q 'litrepl-agent'
+cat >source.md <<"EOF"
+```python
+import os, sys
+def f(x):
+  return x*2
+f(21)
+```
+```result
+```
+```python
+print("out"); print("err", file=sys.stderr)
+_=os.system("echo subprocess")
+```
+```result
+```
+```python
+print("A")
+1/0
+print("B")
+```
+```result
+```
+EOF
+cat >out.expected <<"EOF"
+```python
+import os, sys
+def f(x):
+  return x*2
+f(21)
+```
+```result
+42
+```
+```python
+print("out"); print("err", file=sys.stderr)
+_=os.system("echo subprocess")
+```
+```result
+out
+err
+subprocess
+```
+```python
+print("A")
+1/0
+print("B")
+```
+```result
+A
+Traceback (most recent call last):
+  File "<litrepl>", line 3, in <module>
+ZeroDivisionError: division by zero
+```
+EOF
+for batch in "" "--batch" ; do
+  cat source.md | runlitrepl $batch --filetype=markdown eval-sections >out.md
+  diff -u out.md out.expected
+done
+cat >slow.md <<"EOF"
+```python
+from time import sleep
+sleep(2)
+print("slow")
+```
+```result
+```
+EOF
+cat slow.md | runlitrepl --timeout=0.5 --filetype=markdown eval-sections >out1.md
+grep -q 'LR:' out1.md
+cat out1.md | runlitrepl --timeout=inf --filetype=markdown eval-sections >out2.md
+grep -q '^slow$' out2.md
+echo 'print(f(1))' | runlitrepl eval-code python >out3.txt
+grep -q '^2$' out3.txt
+runlitrepl stop python
+)} #}}}
+
+test_eval_kernel() {( #{{{
+# Python sessions running a Jupyter kernel.
+mktest "_test_eval_kernel"
+export LITREPL_PYTHON_PROTOCOL=kernel
+runlitrepl start python
+runlitrepl status python </dev/null | grep -q 'litrepl-kernel'
+cat >source.md <<"EOF"
+```python
+def f(x):
+  return x*2
+f(21)
+```
+```result
+```
+```python
+import sys
+print("out"); print("err", file=sys.stderr)
+```
+```result
+```
+```python
+%%bash
+echo BASHMAGIC
+```
+```result
+```
+```python
+1/0
+```
+```result
+```
+```python
+print(f(1))
+```
+```result
+```
+EOF
+for batch in "" "--batch" ; do
+  cat source.md | runlitrepl $batch --filetype=markdown eval-sections >out.md
+  grep -q '^42$' out.md
+  grep -q '^out$' out.md
+  grep -q '^err$' out.md
+  grep -q '^BASHMAGIC$' out.md
+  grep -q '^ZeroDivisionError' out.md
+  grep -q '^2$' out.md
+done
+# A dying kernel fails its section and stops the session
+cat >source.md <<"EOF"
+```python
+import os
+os._exit(3)
+```
+```result
+```
+EOF
+cat source.md | runlitrepl --filetype=markdown eval-sections >out.md
+grep -q '^The kernel has died$' out.md
+for i in $(seq 50) ; do
+  runlitrepl status python </dev/null | grep -q -E '^python +- +1 ' && break
+  sleep 0.1
+done
+runlitrepl status python </dev/null | grep -q -E '^python +- +1 '
+runlitrepl stop python
+)} #}}}
+
+test_serve() {( #{{{
+# Commands sent to `litrepl serve` by the client script.
+mktest "_test_serve"
+$LITREPL_TEST_PYTHON $LITREPL --debug=1 serve 2>serve.log &
+SP=$!
+trap "kill $SP 2>/dev/null || true ; runlitrepl stop || true" EXIT
+for i in $(seq 100) ; do
+  grep -q 'listening on' serve.log && break
+  sleep 0.1
+done
+SOCK=$(grep 'listening on' serve.log | sed 's/.*listening on //')
+test -S "$SOCK"
+export LITREPL_PYTHON_MARKERS=py
+cat >source.md <<"EOF"
+```py
+print(40+2)
+```
+```result
+```
+EOF
+cat source.md | runlitrepl --filetype=markdown eval-sections >out.md
+grep -q '^42$' out.md
+grep -q "serve: request" serve.log
+ECODE=0
+runlitrepl --invalid-option </dev/null 2>err.txt || ECODE=$?
+test "$ECODE" = "2"
+grep -q 'unrecognized arguments' err.txt
+# Only the command word decides if the server is used
+runlitrepl --ai-auxdir repl print-auxdir python >/dev/null
+grep -q "serve: request.*'repl', 'print-auxdir'" serve.log
+$LITREPL_TEST_PYTHON - "$LITREPL_ROOT/python" <<"EOF"
+import sys, runpy
+sys.path.insert(0,sys.argv[1])
+from litrepl.main import make_parser
+flags={o for x in make_parser()._actions if x.nargs==0 for o in x.option_strings}
+assert runpy.run_path(sys.argv[1]+'/bin/litrepl')['FLAGS']==flags
+EOF
+kill $SP
+wait $SP || true
+not test -S "$SOCK"
+# A server which dies during a request makes the client fail, not crash
+$LITREPL_TEST_PYTHON $LITREPL --debug=1 serve 2>serve.log &
+SP=$!
+for i in $(seq 100) ; do
+  grep -q 'listening on' serve.log && break
+  sleep 0.1
+done
+echo 'import time; time.sleep(3)' | runlitrepl eval-code python >out.txt 2>err.txt &
+CP=$!
+for i in $(seq 100) ; do
+  grep -q 'serve: request' serve.log && break
+  sleep 0.1
+done
+kill -9 $SP
+ECODE=0
+wait $CP || ECODE=$?
+test "$ECODE" = "1"
+grep -q 'closed the connection' err.txt
+not grep -q 'Traceback' err.txt
+# The socket directory must be private
+test "$(stat -c %a "$(dirname "$SOCK")")" = "700"
+chmod 755 "$(dirname "$SOCK")"
+ECODE=0
+$LITREPL_TEST_PYTHON $LITREPL serve 2>err.txt || ECODE=$?
+test "$ECODE" != "0"
+grep -q 'is not a private directory' err.txt
+chmod 700 "$(dirname "$SOCK")"
+)} #}}}
+
+test_lazy_imports() {( #{{{
+# `--version` must not load the package modules, the commands which do not
+# parse documents must not load Lark and psutil. The timings are reported by
+# `bench_import_time`.
+mktest "_test_lazy_imports"
+loaded() {
+  $LITREPL_TEST_PYTHON - "$LITREPL_ROOT/python" "$@" <<"EOF"
+import sys
+sys.path.insert(0,sys.argv[1])
+from litrepl.main import main
+try:
+  main(sys.argv[2:])
+except SystemExit:
+  pass
+print(' '.join(m for m in ['lark','psutil','litrepl.base'] if m in sys.modules),
+      file=sys.stderr)
+EOF
+}
+loaded --version >/dev/null 2>mods.txt
+test -z "$(cat mods.txt)"
+loaded print-auxdir python >/dev/null 2>mods.txt
+not grep -q -w -E 'lark|psutil' mods.txt
+grep -q -w 'litrepl.base' mods.txt
+)} #}}}
+
+test_readout_store() {( #{{{
+mktest "_test_readout_store"
+runlitrepl start python
+cat >source.md <<"EOF"
+```python
+from time import sleep
+sleep(1)
+print("hi")
+```
+```result
+```
+EOF
+AUXDIR=$(runlitrepl print-auxdir python)
+readout() {
+  cat source.md | runlitrepl "$@" --timeout=0.2,inf eval-sections >out1.md
+  sed -n 's/^\[LR:\(.*\)\]$/\1/p' out1.md
+}
+complete() {
+  cat out1.md | runlitrepl "$@" eval-sections >out2.md
+  grep -q '^hi$' out2.md
+}
+SHMDIR=
+for store in shm auxdir durable ; do
+  F=$(readout --readout-store=$store)
+  test -f "$F"
+  if test "$store" = "shm" -a -d /dev/shm ; then
+    SHMDIR=$(dirname "$F")
+    test "$SHMDIR" != "$AUXDIR"
+    test "$(stat -c %a "$SHMDIR")" = "700"
+  else
+    test "$(dirname "$F")" = "$AUXDIR"
+  fi
+  complete --readout-store=$store
+  test ! -f "$F"
+done
+# The readout files kept for debugging are placed into the auxdir
+F=$(readout -K)
+test "$(dirname "$F")" = "$AUXDIR"
+complete -K
+test -f "$F"
+rm "$F"
+# A readout store directory accessible by others is not used
+if test -n "$SHMDIR" ; then
+  chmod 755 "$SHMDIR"
+  F=$(LITREPL_READOUT_STORE=shm readout)
+  test "$(dirname "$F")" = "$AUXDIR"
+  complete
+fi
+runlitrepl stop
+# The empty readout store directory is removed with the session
+test -z "$SHMDIR" || test ! -d "$SHMDIR"
+)} #}}}
+
+test_readout_cont() {( #{{{
+# Poll a pending section with terminal-like output several times. The merge
+# state is kept next to the readout file between the polls and is removed
+# with the file.
+mktest "_test_readout_cont"
+runlitrepl start sh
+P=0123456789012345678901234567890123456789012345678901234567890123456789
+cat >source.md <<EOF
+\`\`\`sh
+for i in 1 2 3 4 5 6 7 8 9 ; do
+  printf "\\r%s %s" \$i $P
+  sleep 0.3
+  if test \$((i % 3)) = 0 ; then echo " line \$i" ; fi
+done
+echo done
+\`\`\`
+\`\`\`result
+\`\`\`
+EOF
+cat source.md | runlitrepl --timeout=0.2,0.2 eval-sections >out.md
+F=$(sed -n 's/^\[LR:\(.*\)\]$/\1/p' out.md)
+M=$(echo "$F" | sed 's/\.txt$/.merged/')
+NPOLL=0
+PARTIAL=n
+while grep -q 'LR:' out.md ; do
+  cat out.md | runlitrepl --timeout=0.2,0.2 eval-sections >out2.md
+  mv out2.md out.md
+  if grep -q 'LR:' out.md ; then
+    test -f "$M"
+    if grep -q "^3 $P line 3\$" out.md ; then PARTIAL=y ; fi
+  fi
+  NPOLL=$((NPOLL+1))
+  test "$NPOLL" -lt 50
+done
+test "$PARTIAL" = "y"
+test ! -f "$M"
+test ! -f "$F"
+cat >out.expected <<EOF
+\`\`\`result
+3 $P line 3
+6 $P line 6
+9 $P line 9
+done
+\`\`\`
+EOF
+sed -n '/^```result/,$p' out.md >out.result
+diff -u out.result out.expected
+runlitrepl stop
+)} #}}}
+
+test_result_limits() {( #{{{
+mktest "_test_result_limits"
+runlitrepl start python
+cat >source.md <<"EOF"
+```python
+for i in range(1000):
+  print(f"line {i}")
+
+```
+```result
+```
+```{.python result-max-bytes=64 result-spill}
+print("ä"*100)
+for i in range(1000):
+  print(f"line {i}")
+
+```
+```result
+```
+EOF
+cat source.md | runlitrepl --result-max-lines=10 eval-sections >out.md
+cat >out.expected <<"EOF"
+```python
+for i in range(1000):
+  print(f"line {i}")
+
+```
+```result
+line 0
+line 1
+line 2
+line 3
+line 4
+<LitREPL: 8810 bytes (990 lines) elided>
+line 995
+line 996
+line 997
+line 998
+line 999
+```
+EOF
+head -n 18 out.md >out1.md
+diff -u out1.md out.expected
+grep -q '^<LitREPL: [0-9]* bytes ([0-9]* lines) elided, see .*result_[0-9a-f]\{64\}\.txt>$' out.md
+grep -q '^ääääääääääääääää$' out.md
+test "$(sed -n '/^<LitREPL:.*see/,/^```$/p' out.md | wc -l)" = "5"
+SPILL=$(sed -n 's/^<LitREPL:.*see \(.*\)>$/\1/p' out.md)
+$LITREPL_TEST_PYTHON -c '
+print("ä"*100)
+for i in range(1000):
+  print(f"line {i}")' >spill.expected
+cmp "$SPILL" spill.expected
+# The limits are applied while a pending section is polled
+runlitrepl stop python
+runlitrepl start sh
+cat >source.md <<"EOF"
+```sh
+for i in $(seq 1 10) ; do
+  seq 1 200
+  sleep 0.2
+done
+echo done
+```
+```result
+```
+EOF
+cat source.md | runlitrepl --result-max-lines=20 --timeout=0.3,0.3 \
+  eval-sections >out.md
+while grep -q 'LR:' out.md ; do
+  # The text where the prompt may start is kept in addition to the limits
+  test "$(sed -n '/^```result$/,/^```$/p' out.md | wc -l)" -le 26
+  cat out.md | runlitrepl --result-max-lines=20 --timeout=0.3,0.3 \
+    eval-sections >out2.md
+  mv out2.md out.md
+done
+grep -q '^<LitREPL: [0-9]* bytes (1981 lines) elided>$' out.md
+test "$(sed -n '/^```result$/,/^```$/p' out.md | tail -n 2 | head -n 1)" = "done"
+test "$(sed -n '/^```result$/,/^```$/p' out.md | wc -l)" = "23"
+runlitrepl stop
+)} #}}}
+
+test_result_encoding() {( #{{{
+mktest "_test_result_encoding"
+runlitrepl start python
+cat >source.md <<"EOF"
+```python
+import sys
+sys.stdout.flush()
+for i in range(3):
+  sys.stdout.buffer.write(b"a\xffb\xfe\xfdc \xc3\xa4\n")
+
+sys.stdout.buffer.flush()
+```
+```result
+```
+EOF
+cat source.md | runlitrepl eval-sections >out.md
+grep -q '^a�b��c ä$' out.md
+test "$(grep -c '^a�b��c ä$' out.md)" = "3"
+cat source.md | runlitrepl --result-encoding-errors=backslashreplace \
+  eval-sections >out.md
+grep -q '^a\\xffb\\xfe\\xfdc ä$' out.md
+cat source.md | LITREPL_RESULT_ENCODING_ERRORS=hexdump runlitrepl \
+  eval-sections >out.md
+grep -q '^a<LitREPL: invalid bytes ff>b<LitREPL: invalid bytes fe fd>c ä$' out.md
+cat source.md | runlitrepl --result-encoding-errors=strict \
+  eval-sections >out.md
+grep -q 'Non-unicode output' out.md
+runlitrepl stop
+)} #}}}
+
+test_probe_cache() {( #{{{
+mktest "_test_probe_cache"
+runlitrepl --parser-cache=cache --debug=1 start python </dev/null >out1.txt 2>&1
+grep -q 'capability cache miss' out1.txt
+echo 'print(1+1)' | runlitrepl --debug=1 eval-code python >out.txt 2>debug.txt
+test "$(cat out.txt)" = "2"
+grep -q 'was recorded as .*Interpreter' debug.txt
+runlitrepl --parser-cache=cache --debug=1 restart python </dev/null >out2.txt 2>&1
+grep -q 'capability cache hit' out2.txt
+not grep -q 'capability.cache.miss' out2.txt
+# A modified interpreter or a modified site directory invalidate the probe
+$LITREPL_TEST_PYTHON - "$LITREPL_ROOT/python" cache/probe_*.pickle <<"EOF"
+import sys, pickle
+sys.path.insert(0,sys.argv[1])
+with open(sys.argv[2],'rb') as f:
+  ident,caps=pickle.load(f)
+caps.mtimes={p:t+1 for p,t in caps.mtimes.items()}
+with open(sys.argv[2],'wb') as f:
+  pickle.dump((ident,caps),f)
+EOF
+runlitrepl --parser-cache=cache --debug=1 restart python </dev/null >out3.txt 2>&1
+grep -q 'was modified' out3.txt
+grep -q 'capability cache miss' out3.txt
+# The variables changing the module search path are a part of the key
+( export PYTHONNOUSERSITE=1
+  runlitrepl --parser-cache=cache --debug=1 restart python </dev/null >out4.txt 2>&1 )
+grep -q 'capability cache miss' out4.txt
+test "$(ls cache/probe_*.pickle | wc -l)" = "2"
+echo 'print(1+1)' | runlitrepl eval-code python >out.txt
+test "$(cat out.txt)" = "2"
+runlitrepl stop
+)} #}}}
+
+test_pool() {( #{{{
+mktest "_test_pool"
+mkdir tmp
+export TMPDIR="$(pwd)/tmp" LITREPL_POOL_SIZE=2
+idle() {
+  ls -d tmp/litrepl_*_pool/*_$1_*/idle_* 2>/dev/null | wc -l
+}
+wait_idle() {
+  for i in $(seq 1 100) ; do
+    test "$(idle $1)" = "$2" && return 0
+    sleep 0.1
+  done
+  return 1
+}
+echo 'print(1+1)' | runlitrepl --foreground eval-code python >out.txt
+test "$(cat out.txt)" = "2"
+wait_idle python 2
+# The --foreground runs adopt the pooled interpreters, the pool is refilled
+echo 'import os; print(os.getpid())' | \
+  runlitrepl --debug=1 --foreground eval-code python >out.txt 2>debug.txt
+grep -q "adopted PID $(cat out.txt) from the pool" debug.txt
+wait_idle python 2
+# So do the sessions, a restart gets a fresh interpreter
+runlitrepl start python
+echo 'a=33; print(a)' | runlitrepl eval-code python >out.txt
+test "$(cat out.txt)" = "33"
+wait_idle python 2
+runlitrepl --debug=1 restart python 2>debug.txt
+grep -q "adopted PID" debug.txt
+echo 'print(a)' | runlitrepl eval-code python >out.txt || true
+grep -q "NameError" out.txt
+echo 'echo $$' | runlitrepl --debug=1 --foreground eval-code sh >out.txt 2>debug.txt
+wait_idle sh 2
+echo 'echo $$' | runlitrepl --debug=1 --foreground eval-code sh >out.txt 2>debug.txt
+grep -q "adopted PID $(cat out.txt) from the pool" debug.txt
+# Without the pool size, the interpreters are started as usual
+wait_idle python 2
+echo 'print(1+1)' | LITREPL_POOL_SIZE=0 runlitrepl --debug=1 --foreground \
+  eval-code python >out.txt 2>debug.txt
+test "$(cat out.txt)" = "2"
+not grep -q "adopted" debug.txt
+# The `stop` command stops the pooled interpreters
+wait_idle sh 2
+runlitrepl stop python
+test "$(idle python)" = "0"
+test "$(idle sh)" = "2"
+runlitrepl stop
+test "$(idle sh)" = "0"
+# A slot claimed by a crashed session is removed, its interpreter is stopped
+sh -c 'exit 0' & DEAD=$!
+wait $DEAD
+sleep 100 & SLEEPER=$!
+PDIR=$(ls -d tmp/litrepl_*_pool/*_sh_* | head -n 1)
+mkdir "$PDIR/claimed_${DEAD}_x"
+echo "$SLEEPER" >"$PDIR/claimed_${DEAD}_x/pid.txt"
+runlitrepl stop sh
+not test -d "$PDIR/claimed_${DEAD}_x"
+wait $SLEEPER || ECODE=$?
+test "$ECODE" = "143"
+# The pool is not used if the auxiliary directory is on another file system
+if test -d /dev/shm && test "$(stat -c %d /dev/shm)" != "$(stat -c %d tmp)" ; then
+  SHM=/dev/shm/litrepl_test_pool_$$
+  runlitrepl --debug=1 --sh-auxdir="$SHM" restart sh 2>debug.txt
+  not grep -q "adopted" debug.txt
+  echo 'echo 42' | runlitrepl --sh-auxdir="$SHM" eval-code sh >out.txt
+  test "$(cat out.txt)" = "42"
+  runlitrepl --sh-auxdir="$SHM" stop sh
+  rm -rf "$SHM"
+  test -z "$(ls -d tmp/litrepl_*_pool/*/claimed_* 2>/dev/null)"
+fi
+# The pool directory must be private
+chmod 755 tmp/litrepl_*_pool
+runlitrepl --debug=1 restart sh 2>debug.txt
+grep -q "is not a private directory" debug.txt
+not grep -q "adopted" debug.txt
+runlitrepl stop sh
+test "$(idle sh)" = "0"
+)} #}}}
+
+test_eval_stdin() {( #{{{
+mktest "_test_eval_stdin"
+runlitrepl start python
+runlitrepl start sh
+cat >source.md <<"EOF"
+```python
+x=input()
+```
+```result
+```
+```python
+print(2)
+```
+```result
+```
+```sh
+read x
+```
+```result
+```
+```sh
+echo 3
+```
+```result
+```
+EOF
+cat source.md | runlitrepl --filetype=markdown --timeout=20 eval-sections >out.md
+grep -q '^2$' out.md
+grep -q '^3$' out.md
+not grep -q 'LR:' out.md
+echo 'print(4)' | runlitrepl eval-code python | grep -q '^4$'
+echo 'echo 5' | runlitrepl eval-code sh | grep -q '^5$'
+runlitrepl stop
+)} #}}}
+
 test_eval_ipython_bash_magic() {( #{{{
 mktest "_test_eval_ipython_bash_magic"
 runlitrepl start python
@@ -1598,19 +2612,46 @@ tests() {
       echo test_irreproducible $python - -
       echo test_invalid_markers $python $aicli $sh
       echo test_print_auxdir $python $aicli $sh
+      echo test_eval_cursors $python - -
+      echo test_eval_spans $python - -
+      echo test_eval_large_output $python - -
+      echo test_eval_rn_chunks $python - -
+      echo test_reader_daemon $python - -
+      echo test_reader_sync $python - -
+      echo test_eval_batch $python - $sh
+      echo test_eval_code_compound $python - -
+      echo test_serve $python - -
+      echo test_readout_store $python - -
+      echo test_result_limits $python - $sh
+      echo test_result_encoding $python - -
+      echo test_pool $python - $sh
+      echo test_eval_stdin $python - $sh
       if test "$aicli" != "-" ; then
         echo test_aicli - $aicli -
       fi
       if echo "$python" | grep -q -i "ipython" ; then
         echo test_eval_ipython_bash_magic $python - -
+      else
+        echo test_eval_framed $python - -
       fi
     done
   done
+  if $LITREPL_TEST_PYTHON -c 'import jupyter_client' >/dev/null 2>&1 ; then
+    echo test_eval_kernel python3 - -
+  else
+    echo "Skipping test_eval_kernel: jupyter_client is not importable" >&2
+  fi
   echo test_bash - - $(which bash)
   echo test_doublestart - - $(which bash)
   echo test_vim_extras - - -
   echo test_debug - - -
   echo test_close_out_fd - - $(which bash)
+  echo test_parser_cache - - -
+  echo test_parser_scanner - - -
+  echo test_filetype_sniff - - -
+  echo test_lazy_imports - - -
+  echo test_readout_cont - - $(which bash)
+  echo test_probe_cache auto - -
 }
 
 runlitrepl() {